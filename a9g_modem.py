@@ -0,0 +1,172 @@
+"""Shared A9G modem engine.
+
+One engine owns the UART. A single reader thread splits the byte stream into
+lines; lines that belong to the AT transaction in progress are handed to it,
+and unsolicited result codes (URCs such as "+CLCC:" or "NO CARRIER") are
+dispatched to registered handlers. Transactions are serialised with a lock, so
+the button thread, the SMS fan-out and the call escalation can share the
+module without garbling each other's commands.
+"""
+
+import queue
+import threading
+import time
+
+from device_log import log
+
+COMMAND_TIMEOUT = 5    # Seconds to wait for the final result of an AT command
+SMS_PROMPT_TIMEOUT = 5  # Seconds to wait for the '>' prompt after AT+CMGS
+SMS_SEND_TIMEOUT = 30  # Seconds to wait for +CMGS/OK after the message body
+
+# Lines that end an AT transaction. Call progress results ("NO CARRIER", "BUSY",
+# ...) are not among them: voice calls report them later as URCs, and treating
+# them as final would cut short whatever transaction happens to be in progress.
+FINAL_RESULTS = ("OK", "ERROR", "+CME ERROR", "+CMS ERROR")
+
+
+def is_final_result(line):
+    """Return True if line terminates an AT transaction."""
+    return any(line.startswith(result) for result in FINAL_RESULTS)
+
+
+def is_ok(response):
+    """Return True if a transaction's response lines contain OK."""
+    return any(line == "OK" for line in response)
+
+
+class ModemEngine:
+    """Serialised AT transactions and URC dispatch over one serial handle."""
+
+    def __init__(self, port):
+        self.port = port                 # pyserial-like: write(), read(), in_waiting
+        self._lock = threading.Lock()    # One AT transaction at a time
+        self._lines = queue.Queue()      # Lines for the transaction in progress
+        self._in_transaction = threading.Event()
+        self._urc_handlers = []          # (prefix, callback) pairs
+        self._handlers_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._reader = None
+
+    def start(self):
+        """Start the reader thread if it is not already running."""
+        if self._reader is not None and self._reader.is_alive():
+            return
+        self._stop_event.clear()
+        self._reader = threading.Thread(target=self._read_loop, name="a9g-reader", daemon=True)
+        self._reader.start()
+
+    def stop(self):
+        """Stop the reader thread."""
+        self._stop_event.set()
+        if self._reader is not None:
+            self._reader.join(timeout=2)
+            self._reader = None
+
+    def is_running(self):
+        """Return True if the reader thread is alive."""
+        return self._reader is not None and self._reader.is_alive()
+
+    def add_urc_handler(self, prefix, callback):
+        """Call callback(line) for every line starting with prefix."""
+        with self._handlers_lock:
+            self._urc_handlers.append((prefix, callback))
+
+    def remove_urc_handler(self, prefix, callback):
+        """Remove a handler added with add_urc_handler."""
+        with self._handlers_lock:
+            if (prefix, callback) in self._urc_handlers:
+                self._urc_handlers.remove((prefix, callback))
+
+    def command(self, command, timeout=COMMAND_TIMEOUT):
+        """Send an AT command and return its decoded response lines (up to the final result)."""
+        if isinstance(command, str):
+            command = (command + '\r\n').encode()
+        with self._lock:
+            self._begin()
+            try:
+                self.port.write(command)
+                return self._collect(timeout)
+            finally:
+                self._in_transaction.clear()
+
+    def send_sms(self, cmgs_command, body, prompt_timeout=SMS_PROMPT_TIMEOUT, send_timeout=SMS_SEND_TIMEOUT):
+        """Send one SMS from pre-encoded AT+CMGS command and body bytes.
+
+        Returns the response lines; the SMS went out if they contain "+CMGS:".
+        """
+        with self._lock:
+            self._begin()
+            try:
+                self.port.write(cmgs_command)
+                response = self._collect(prompt_timeout, prompt=True)
+                if not response or response[-1] != ">":
+                    return response
+
+                self.port.write(body)
+                return response + self._collect(send_timeout)
+            finally:
+                self._in_transaction.clear()
+
+    def _begin(self):
+        """Start the reader if needed and drop stale lines from a timed out transaction."""
+        self.start()
+        while not self._lines.empty():
+            self._lines.get_nowait()
+        self._in_transaction.set()
+
+    def _collect(self, timeout, prompt=False):
+        """Collect transaction lines until a final result (or the SMS prompt) or timeout."""
+        lines = []
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print(f"Modem response timed out after {timeout} seconds: {lines}")
+                return lines
+            try:
+                line = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            lines.append(line)
+            if is_final_result(line) or (prompt and line == ">"):
+                return lines
+
+    def _read_loop(self):
+        """Read the UART, split it into lines and route them."""
+        buffer = b""
+        while not self._stop_event.is_set():
+            try:
+                data = self.port.read(getattr(self.port, "in_waiting", 0) or 1)
+            except Exception as e:
+                print(f"Modem read error: {e}")
+                time.sleep(1)
+                continue
+            if not data:
+                continue
+            buffer += data
+
+            while b"\n" in buffer:
+                raw, buffer = buffer.split(b"\n", 1)
+                line = raw.decode('utf-8', errors='ignore').strip()
+                if line:
+                    self._route(line)
+
+            # The SMS prompt is not newline terminated
+            if buffer.strip() == b">":
+                buffer = b""
+                self._route(">")
+
+    def _route(self, line):
+        """Hand a line to URC handlers and/or the transaction in progress."""
+        with self._handlers_lock:
+            handlers = [callback for prefix, callback in self._urc_handlers if line.startswith(prefix)]
+        for callback in handlers:
+            try:
+                callback(line)
+            except Exception as e:
+                print(f"URC handler error for '{line}': {e}")
+
+        if self._in_transaction.is_set():
+            self._lines.put(line)
+        elif not handlers:
+            log.debug("modem", "Unsolicited: %s", line)
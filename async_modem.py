@@ -0,0 +1,290 @@
+"""asyncio backend for the A9G modem.
+
+AsyncModemEngine speaks the same protocol as ModemEngine (a9g_modem), but on
+an event loop instead of a reader thread:
+
+- the UART is read into one preallocated buffer (READ_BUFFER bytes) and
+  split into lines in place; for a real serial port the loop is woken by the
+  file descriptor becoming readable (loop.add_reader), so no thread blocks
+  in read();
+- everything written goes through a write queue drained by one writer task;
+- command() and send_sms() are coroutines, serialised by an asyncio.Lock, so
+  any number of coroutines can drive the modem concurrently without their
+  commands interleaving.
+
+URC handlers are plain callables run on the event loop; like with
+ModemEngine they must not wait for AT commands themselves.
+
+The rest of the program is threaded, so ThreadedAsyncModem runs the engine on
+a loop thread of its own and offers ModemEngine's blocking interface. With
+MODEM_BACKEND = "asyncio" get_modem() hands out that facade, and the SOS
+fan-out, tracking, calls and inbound SMS run over the asyncio engine
+unchanged.
+
+Ports without a file descriptor (the simulator, replays) are read through
+the loop's executor instead of add_reader.
+"""
+
+import asyncio
+import threading
+import time
+
+from a9g_modem import COMMAND_TIMEOUT, SMS_PROMPT_TIMEOUT, SMS_SEND_TIMEOUT, is_final_result
+from device_log import log
+
+READ_BUFFER = 4096  # Bytes of the receive buffer; a longer line is split
+
+
+class AsyncModemEngine:
+    """Awaitable AT transactions and URC dispatch over one serial handle."""
+
+    def __init__(self, port):
+        self.port = port                    # pyserial-like: write(), read()/readinto(), fileno() if real
+        self._buffer = bytearray(READ_BUFFER)
+        self._view = memoryview(self._buffer)
+        self._fill = 0                      # Bytes of _buffer in use
+        self._lock = None                   # asyncio.Lock: one transaction at a time
+        self._lines = None                  # asyncio.Queue of lines for the transaction in progress
+        self._writes = None                 # asyncio.Queue of (bytes, future)
+        self._in_transaction = False
+        self._urc_handlers = []             # (prefix, callback) pairs
+        self._handlers_lock = threading.Lock()  # Handlers are added from other threads
+        self._tasks = []
+        self._fd = None
+        self.loop = None
+
+    async def start(self):
+        """Start reading and writing on the running loop."""
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._lock = asyncio.Lock()
+        self._lines = asyncio.Queue()
+        self._writes = asyncio.Queue()
+        self._tasks.append(self.loop.create_task(self._write_loop()))
+        try:
+            self._fd = self.port.fileno()
+        except (AttributeError, OSError):
+            self._fd = None
+        if self._fd is not None:
+            self.loop.add_reader(self._fd, self._on_readable)
+        else:
+            self._tasks.append(self.loop.create_task(self._executor_read_loop()))
+
+    async def stop(self):
+        if self.loop is None:
+            return
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.loop = None
+
+    def is_running(self):
+        return self.loop is not None
+
+    def add_urc_handler(self, prefix, callback):
+        """Call callback(line) on the loop for every line starting with prefix."""
+        with self._handlers_lock:
+            self._urc_handlers.append((prefix, callback))
+
+    def remove_urc_handler(self, prefix, callback):
+        with self._handlers_lock:
+            if (prefix, callback) in self._urc_handlers:
+                self._urc_handlers.remove((prefix, callback))
+
+    async def command(self, command, timeout=COMMAND_TIMEOUT):
+        """Send an AT command and return its decoded response lines (up to the final result)."""
+        if isinstance(command, str):
+            command = (command + '\r\n').encode()
+        async with self._lock:
+            self._begin()
+            try:
+                await self._write(command)
+                return await self._collect(timeout)
+            finally:
+                self._in_transaction = False
+
+    async def send_sms(self, cmgs_command, body, prompt_timeout=SMS_PROMPT_TIMEOUT,
+                       send_timeout=SMS_SEND_TIMEOUT):
+        """Send one SMS from pre-encoded AT+CMGS command and body bytes; see ModemEngine.send_sms."""
+        async with self._lock:
+            self._begin()
+            try:
+                await self._write(cmgs_command)
+                response = await self._collect(prompt_timeout, prompt=True)
+                if not response or response[-1] != ">":
+                    return response
+                await self._write(body)
+                return response + await self._collect(send_timeout)
+            finally:
+                self._in_transaction = False
+
+    def _begin(self):
+        while not self._lines.empty():
+            self._lines.get_nowait()  # Stale lines of a timed out transaction
+        self._in_transaction = True
+
+    async def _write(self, data):
+        done = self.loop.create_future()
+        self._writes.put_nowait((bytes(data), done))
+        await done
+
+    async def _write_loop(self):
+        while True:
+            data, done = await self._writes.get()
+            try:
+                self.port.write(data)
+            except Exception as e:
+                if not done.done():
+                    done.set_exception(e)
+                continue
+            if not done.done():
+                done.set_result(len(data))
+
+    async def _collect(self, timeout, prompt=False):
+        lines = []
+        deadline = self.loop.time() + timeout
+        while True:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                print(f"Modem response timed out after {timeout} seconds: {lines}")
+                return lines
+            try:
+                line = await asyncio.wait_for(self._lines.get(), remaining)
+            except asyncio.TimeoutError:
+                continue
+            lines.append(line)
+            if is_final_result(line) or (prompt and line == ">"):
+                return lines
+
+    # Reading
+
+    def _on_readable(self):
+        try:
+            # Only what is already there, so the read never blocks the loop
+            size = min(self.port.in_waiting, READ_BUFFER - self._fill)
+            count = self.port.readinto(self._view[self._fill:self._fill + size]) if size else 0
+        except Exception as e:
+            print(f"Modem read error: {e}")
+            return
+        if count:
+            self._received(count)
+
+    async def _executor_read_loop(self):
+        while True:
+            try:
+                data = await self.loop.run_in_executor(None, self.port.read, READ_BUFFER - self._fill)
+            except RuntimeError:
+                return  # The executor is shut down with the interpreter
+            except Exception as e:
+                print(f"Modem read error: {e}")
+                await asyncio.sleep(1)
+                continue
+            if data:
+                self._view[self._fill:self._fill + len(data)] = data
+                self._received(len(data))
+
+    def _received(self, count):
+        """Split the buffer into lines after count new bytes, keeping the unfinished rest."""
+        self._fill += count
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", start, self._fill)
+            if end < 0:
+                break
+            line = self._buffer[start:end].decode('utf-8', errors='ignore').strip()
+            if line:
+                self._route(line)
+            start = end + 1
+        rest = self._buffer[start:self._fill]
+        if rest.strip() == b">" or len(rest) == READ_BUFFER:
+            # The SMS prompt is not newline terminated; an overlong line is cut
+            self._route(rest.decode('utf-8', errors='ignore').strip())
+            rest = b""
+        self._buffer[:len(rest)] = rest
+        self._fill = len(rest)
+
+    def _route(self, line):
+        with self._handlers_lock:
+            handlers = [callback for prefix, callback in self._urc_handlers if line.startswith(prefix)]
+        for callback in handlers:
+            try:
+                callback(line)
+            except Exception as e:
+                print(f"URC handler error for '{line}': {e}")
+        if self._in_transaction:
+            self._lines.put_nowait(line)
+        elif not handlers:
+            log.debug("modem", "Unsolicited: %s", line)
+
+
+class ThreadedAsyncModem:
+    """ModemEngine's blocking interface over an AsyncModemEngine on its own loop thread."""
+
+    def __init__(self, port):
+        self.engine = AsyncModemEngine(port)
+        self.port = port
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self.is_running():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="a9g-loop", daemon=True)
+            self._thread.start()
+            self._call(self.engine.start())
+
+    def _call(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def stop(self):
+        with self._start_lock:
+            if not self.is_running():
+                return
+            self._call(self.engine.stop(), timeout=2)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=2)
+            self._loop.close()
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_urc_handler(self, prefix, callback):
+        self.engine.add_urc_handler(prefix, callback)
+
+    def remove_urc_handler(self, prefix, callback):
+        self.engine.remove_urc_handler(prefix, callback)
+
+    def command(self, command, timeout=COMMAND_TIMEOUT):
+        self.start()
+        return self._call(self.engine.command(command, timeout))
+
+    def send_sms(self, cmgs_command, body, prompt_timeout=SMS_PROMPT_TIMEOUT, send_timeout=SMS_SEND_TIMEOUT):
+        self.start()
+        return self._call(self.engine.send_sms(cmgs_command, body, prompt_timeout, send_timeout))
+
+
+async def main():
+    """Drive a simulated A9G from several coroutines at once and time it."""
+    from modem_sim import SimulatedA9G
+
+    engine = AsyncModemEngine(SimulatedA9G())
+    await engine.start()
+    started = time.monotonic()
+    results = await asyncio.gather(*(engine.command("AT") for _ in range(200)),
+                                   *(engine.send_sms(f'AT+CMGS="{n}"\r\n'.encode(), b"test\x1a") for n in range(50)))
+    elapsed = time.monotonic() - started
+    garbled = [result for result in results if not any(line == "OK" for line in result)]
+    print(f"{len(results)} concurrent transactions in {elapsed * 1000:.0f} ms, {len(garbled)} garbled")
+    await engine.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
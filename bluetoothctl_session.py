@@ -0,0 +1,226 @@
+"""Long-lived bluetoothctl session.
+
+Every flow used to start its own bluetoothctl, write a command, sleep a second
+and hope it had been handled, then block in readline() so the pairing
+countdown could only advance when bluetoothctl happened to print something.
+
+BluetoothCtl keeps one bluetoothctl process per program. A reader thread
+collects its output into numbered lines (with colour codes removed) and
+tracks the prompt, which also shows the connected device ("[Pixel 7]#").
+Callers never block on the pipe:
+
+    ctl = get_bluetoothctl()
+    ctl.command("power on", expect="power on succeeded")   # output lines of the command
+    line = ctl.read_line(timeout=1)                        # None if nothing arrived
+    ctl.wait_for("Authorize service", timeout=10)
+
+command() returns the lines printed from the moment the command was written
+until its expected line (or, without one, until the prompt comes back and
+output stays quiet for a moment). Events printed meanwhile by bluetoothctl
+([NEW], [CHG], agent prompts) are part of that output too, and stay
+available to read_line().
+"""
+
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+
+COMMAND_TIMEOUT = 5     # Seconds to wait for the expected output of a command
+QUIET_PERIOD = 0.2      # Seconds of silence after the prompt that end a command without expect
+HISTORY = 1000          # Output lines kept
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|[\x01\x02]")
+PROMPT = re.compile(r"^\[([^\]]*)\][#>]\s*")
+QUESTION = re.compile(r"[:?]\s*$")  # Agent questions ("... (yes/no): ") end without a newline
+
+
+class BluetoothCtl:
+    """One bluetoothctl process with non-blocking, correlated access to its output."""
+
+    def __init__(self, argv=("bluetoothctl",)):
+        self.argv = list(argv)
+        self.process = None
+        self.prompt = None            # Text inside the last prompt, e.g. "bluetooth" or a device name
+        self._lines = deque(maxlen=HISTORY)
+        self._first = 0               # Number of the oldest line kept
+        self._cursor = 0              # Next line for read_line()
+        self._last_output = 0.0
+        self._prompts = 0             # Number of prompts seen
+        self._partial = ""
+        self._changed = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._reader = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+        self._reader = threading.Thread(target=self._read_loop, name="bluetoothctl", daemon=True)
+        self._reader.start()
+        return self
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def close(self):
+        """Quit bluetoothctl (terminating it if it does not exit)."""
+        if not self.is_running():
+            return
+        try:
+            self.send("quit")
+            self.process.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.terminate()
+
+    # Reader
+
+    def _read_loop(self):
+        fd = self.process.stdout.fileno()
+        while True:
+            try:
+                chunk = os.read(fd, 4096)
+            except OSError:
+                break
+            if not chunk:
+                break
+            self._feed(chunk.decode('utf-8', errors='replace'))
+        with self._changed:
+            self._changed.notify_all()
+
+    def _feed(self, text):
+        text = ANSI_ESCAPE.sub("", self._partial + text).replace("\r\n", "\n")
+        pieces = re.split(r"[\r\n]", text)
+        self._partial = pieces.pop()
+        with self._changed:
+            for piece in pieces:
+                self._add_line(piece)
+            # A prompt, or a question from the agent, is printed without a newline
+            match = PROMPT.match(self._partial)
+            if match and not self._partial[match.end():].strip():
+                self.prompt = match.group(1)
+                self._prompts += 1
+                self._partial = ""
+            elif QUESTION.search(self._partial):
+                self._add_line(self._partial)
+                self._partial = ""
+            self._last_output = time.monotonic()
+            self._changed.notify_all()
+
+    def _add_line(self, line):
+        match = PROMPT.match(line)
+        if match:
+            self.prompt = match.group(1)
+            line = line[match.end():]
+        line = line.strip()
+        if line:
+            if len(self._lines) == self._lines.maxlen:
+                self._first += 1
+            self._lines.append(line)
+
+    def _end(self):
+        return self._first + len(self._lines)
+
+    def _line(self, number):
+        return self._lines[number - self._first]
+
+    # Commands and output
+
+    def mark(self):
+        """Return the number of the next line to arrive."""
+        with self._changed:
+            return self._end()
+
+    def lines_since(self, mark):
+        with self._changed:
+            return [self._line(number) for number in range(max(mark, self._first), self._end())]
+
+    def send(self, text):
+        """Write one line to bluetoothctl without waiting for anything."""
+        with self._write_lock:
+            self.process.stdin.write((text + "\n").encode('utf-8'))
+            self.process.stdin.flush()
+
+    def command(self, text, expect=None, timeout=COMMAND_TIMEOUT):
+        """Run a command and return its output lines.
+
+        With expect (a regular expression) the command ends at the first line
+        matching it; otherwise when the prompt is back and output has been
+        quiet for QUIET_PERIOD. Returns what arrived if timeout passes first.
+        """
+        pattern = re.compile(expect) if expect else None
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            start = self._end()
+            prompts = self._prompts
+            self.send(text)
+            while True:
+                lines = self.lines_since(start)
+                if pattern is not None and any(pattern.search(line) for line in lines):
+                    break
+                now = time.monotonic()
+                if (pattern is None and self._prompts > prompts
+                        and now - self._last_output >= QUIET_PERIOD):
+                    break
+                if now >= deadline or not self.is_running():
+                    print(f"bluetoothctl: no {'match for ' + repr(expect) if expect else 'prompt'} "
+                          f"after '{text}' within {timeout} s")
+                    break
+                self._changed.wait(min(QUIET_PERIOD, deadline - now))
+            return lines
+
+    def discard(self):
+        """Skip the lines received so far, so read_line() returns only new ones."""
+        with self._changed:
+            self._cursor = self._end()
+
+    def read_line(self, timeout=None):
+        """Return the next output line not yet read, or None if none arrives within timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while True:
+                self._cursor = max(self._cursor, self._first)
+                if self._cursor < self._end():
+                    line = self._line(self._cursor)
+                    self._cursor += 1
+                    return line
+                if not self.is_running():
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    def wait_for(self, pattern, timeout=COMMAND_TIMEOUT):
+        """Read lines until one matches pattern; return it, or None after timeout."""
+        pattern = re.compile(pattern)
+        deadline = time.monotonic() + timeout
+        while True:
+            line = self.read_line(max(0, deadline - time.monotonic()))
+            if line is None:
+                return None
+            if pattern.search(line):
+                return line
+
+
+# The shared session, started on first use by get_bluetoothctl()
+session = None
+session_lock = threading.Lock()
+
+
+def get_bluetoothctl():
+    """Return the shared bluetoothctl session, (re)starting it if it is not running."""
+    global session
+    with session_lock:
+        if session is None or not session.is_running():
+            session = new_bluetoothctl()
+        return session
+
+
+def new_bluetoothctl():
+    """Start a bluetoothctl session, recorded for replay if SOSD_CAPTURE names a directory."""
+    if os.environ.get("SOSD_CAPTURE"):
+        from session_replay import RecordingBluetoothCtl, capture_path  # session_replay imports this module
+        return RecordingBluetoothCtl(capture_path("bluetoothctl")).start()
+    return BluetoothCtl().start()
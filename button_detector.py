@@ -1,15 +1,39 @@
+from startup_timing import startup  # First import: starts the startup clock
 import time
 import sys
 import signal
-import subprocess
-import bluetooth
-import csv
 import sqlite3
 import os
 import threading
 import RPi.GPIO as GPIO
-import serial
 import random
+import json
+import base64
+from contextlib import contextmanager, ExitStack
+from sosd.leds import LedController
+from sos_plan import SosPlan, encode_cmgs_command, encode_sms_body, split_sms_segments
+from a9g_modem import ModemEngine
+from modem_pool import ModemPool
+from async_modem import ThreadedAsyncModem
+from device_log import log, LEVELS
+from stack_sampler import StackSampler, list_profiles, profile_path
+from voice_escalation import CallEscalation
+from location_upload import LocationUploader
+from tracking import LocationTracker, haversine_distance, DISTANCE_THRESHOLD
+from track_store import TrackStore, TRACK_FILE, RECORD
+from sosd.config import ConfigManager
+from remote_ops import default_operations, run_command as run_local_command
+from secure_session import accept_session, SecureSession
+from bluetoothctl_session import get_bluetoothctl
+from trusted_devices import TrustedDevices
+from write_behind import WriteBehind
+from message_store import MessageStore
+from db_backup import BackupError, send_backup, receive_restore
+from inbound_sms import InboundSms, create_tables as create_inbound_tables, recent_messages, number_key
+from sosd.power import PowerManager, SCANNING, DISCOVERABLE, CONNECTABLE, ACTIVE, IDLE, OFF
+
+# bluetooth (PyBluez) and serial (pyserial) are imported where they are first
+# used, so a cold boot reaches the button loop without loading them.
 
 # Define GPIO pins
 BUTTON_PIN_1 = 23  # Button 1 connected to GPIO 23 (Bluetooth)
@@ -18,8 +42,226 @@ LED_PIN = 12       # Green LED connected to GPIO 12
 LED_BLUE = 6       # Blue LED connected to GPIO 6
 A9G_POWER_PIN = 17  # GPIO17
 
-# Initialize Serial connection with A9G module
-ser = serial.Serial('/dev/serial0', baudrate=115200, timeout=1)
+# RFCOMM server channel, and the range a free channel is picked from when it is taken
+RFCOMM_CHANNEL = 23
+RFCOMM_FALLBACK_MIN = 24
+RFCOMM_FALLBACK_MAX = 30
+
+# Pre-shared key of the encrypted RFCOMM session (see secure_session); without
+# the file connections are accepted unauthenticated, as before
+SESSION_KEY_FILE = 'session.key'
+
+# Phones that completed a session are remembered (see trusted_devices); a press
+# then listens for the last one on its channel for RECONNECT_WAIT seconds before
+# falling back to the full pairing flow. RECONNECT_INITIATE also asks
+# bluetoothctl to connect to the phone instead of only waiting for it.
+FAST_RECONNECT = True
+RECONNECT_WAIT = 8
+RECONNECT_INITIATE = False
+TRUSTED_DEVICES_FILE = 'trusted_devices.json'
+
+# Delays and timeouts (seconds)
+PAIRING_COUNTDOWN = 10       # Wait for the authorization prompt before giving up on pairing
+BLUETOOTHCTL_TIMEOUT = 5     # Wait for bluetoothctl to confirm a command
+AT_COMMAND_TIMEOUT = 5       # Wait for the final result of an AT command
+SMS_PROMPT_TIMEOUT = 5       # Wait for the '>' prompt after AT+CMGS
+SMS_SEND_TIMEOUT = 30        # Wait for +CMGS after the message body
+GPS_FIX_WAIT = 6             # Let the GPS gather data before AT+LOCATION=2
+GPS_RETRY_DELAY = 2          # Pause before asking for the location again
+A9G_POWER_ON_DELAY = 10      # Boot time of the A9G after its power pin goes high
+LONG_PRESS_SECONDS = 3       # Holding button 2 this long starts an SOS
+BUTTON_POLL_INTERVAL = 0.1   # Button polling period
+
+# The constants above and the SOS settings below can be overridden from the
+# configuration file (see sosd/config.py); reload_config() applies a new file
+
+# SOS fan-out scheduling
+# "location_first": send the location to every contact (highest priority first),
+#                   then the saved messages one round at a time across all contacts.
+# "per_contact":    legacy order, every message and then the location to one contact
+#                   before moving on to the next.
+SOS_SCHEDULE_MODE = "location_first"
+
+# Cached SOS plan (recipients, encoded bodies, send order); rebuilt whenever
+# contacts or messages change over RFCOMM so the SOS path never touches the database
+sos_plan = None
+
+# Failed SMS are retried after the first pass, up to this many extra rounds
+SMS_RETRY_ROUNDS = 2
+
+# Number of top-priority contacts to call after the SMS fan-out (0 disables calls)
+VOICE_ESCALATION_CONTACTS = 2
+
+# Endpoint that receives batched fixes over GPRS during an alert (None disables it)
+LOCATION_UPLOAD_URL = None
+location_upload = None  # Uploader of the alert in progress
+
+# Seconds to keep tracking the unit after an SOS (0 sends a single fix only)
+SOS_TRACKING_DURATION = 30 * 60
+
+# Without an upload URL tracking positions go out by SMS, at most once every
+# TRACKING_SMS_INTERVAL seconds and only after DISTANCE_THRESHOLD metres of movement
+TRACKING_SMS_INTERVAL = 10 * 60
+last_tracking_sms = None  # (time, latitude, longitude) of the last position sent by SMS
+
+# Ring file of packed fixes next to contacts.db (opened by create_database)
+track_store = None
+
+# Tracking and calls of the alert in progress; an SMS "STOP" ends them early. They run
+# in the background (finish_sos_alert), which powers the A9G down when the alert ends.
+sos_tracker = None
+sos_escalation = None
+sos_stopped = threading.Event()
+sos_finisher = None
+sos_alert = 0               # Number of the latest alert; an older one leaves the A9G on for it
+sos_lock = threading.Lock()
+
+# Received SMS are read, stored and deleted from the SIM while the A9G is on (see
+# inbound_sms); contacts may text "LOCATE" (reply with a fix, up to LOCATE_ATTEMPTS
+# tries) or "STOP" (end the alert). SMS_COMMANDS = False only stores the messages.
+SMS_COMMANDS = True
+LOCATE_ATTEMPTS = 3
+inbound_sms = None
+
+# Power policy of the idle unit (see sosd/power.py): "performance", "balanced" or "standby"
+POWER_POLICY = "balanced"
+BATTERY_CAPACITY_MAH = 0  # Battery size for the standby estimate (0 if mains powered)
+
+# Sampling profiler (see stack_sampler): on while PROFILING is set, or for a while
+# after the "profile start" remote operation; collapsed stacks go to PROFILE_DIR
+PROFILING = False
+PROFILE_INTERVAL = 0.02
+PROFILE_DIR = 'profiles'
+profiler = None
+
+# Logging (see device_log): records below LOG_LEVEL are dropped before they are
+# formatted; the rest go to the console and LOG_FILE, rotated at LOG_MAX_KB
+LOG_LEVEL = "info"
+LOG_FILE = 'sosd.log'
+LOG_MAX_KB = 1024
+LOG_BACKUPS = 3
+LOG_CONSOLE = True
+
+# Every LED is driven through this controller (its run() loop renders blinking)
+leds = LedController(GPIO)
+
+# All AT traffic goes through the shared engine (one reader thread, serialised
+# commands); the serial port is opened on first use by get_modem()
+modem = None
+modem_lock = threading.Lock()
+
+# Gateway units: further A9G modules on USB serial ("/dev/ttyUSB0,/dev/ttyUSB1"), each
+# with its own engine. Outbound SMS are spread over them and /dev/serial0 (see
+# modem_pool); GPS, calls and inbound SMS stay on /dev/serial0.
+SMS_MODEMS = ""
+modem_pool = None
+
+# "thread": ModemEngine, a reader thread per UART. "asyncio": the asyncio engine
+# (see async_modem), one event loop per UART behind the same blocking interface.
+MODEM_BACKEND = "thread"
+
+# Set once the database, track file and SOS plan are ready (see warm_up)
+warmup_done = threading.Event()
+
+def get_modem():
+    """Return the shared A9G modem engine, opening /dev/serial0 on first use."""
+    global modem
+    with modem_lock:
+        if modem is None:
+            modem = new_modem_engine(open_serial('/dev/serial0'))
+        return modem
+
+def new_modem_engine(port):
+    """Return the MODEM_BACKEND engine for an open UART."""
+    return ThreadedAsyncModem(port) if MODEM_BACKEND == "asyncio" else ModemEngine(port)
+
+def open_serial(device):
+    """Open an A9G UART, recording it when SOSD_CAPTURE is set."""
+    import serial
+    port = serial.Serial(device, baudrate=115200, timeout=1)
+    if os.environ.get("SOSD_CAPTURE"):
+        from session_replay import RecordingSerial, capture_path  # Record the UART for replay
+        port = RecordingSerial(port, capture_path("uart"))
+    return port
+
+def get_modem_pool():
+    """Return the pool of SMS modems: /dev/serial0 plus the SMS_MODEMS devices that open."""
+    global modem_pool
+    primary = get_modem()
+    with modem_lock:
+        if modem_pool is None:
+            members = [("serial0", primary)]
+            for device in filter(None, (device.strip() for device in SMS_MODEMS.split(","))):
+                try:
+                    members.append((os.path.basename(device), new_modem_engine(open_serial(device))))
+                except Exception as e:
+                    print(f"SMS modem {device} not available: {e}")
+            modem_pool = ModemPool(members)
+        return modem_pool
+
+def stop_modem_pool():
+    """Stop the engines of the extra SMS modems; the next get_modem_pool() reopens them."""
+    global modem_pool
+    with modem_lock:
+        pool, modem_pool = modem_pool, None
+    if pool is not None:
+        pool.stop(keep=(modem,))
+
+# One connection to contacts.db is shared by every thread; db_lock serialises its use
+DB_FILE = 'contacts.db'
+db_conn = None
+db_lock = threading.RLock()
+
+class GroupedConnection(sqlite3.Connection):
+    """sqlite3 connection whose commit() can be held back to group several writes."""
+
+    hold_commits = False
+
+    def commit(self):
+        if not self.hold_commits:
+            super().commit()
+
+def get_db():
+    """Return the shared connection to contacts.db, opening it on first use."""
+    global db_conn
+    with db_lock:
+        if db_conn is None:
+            db_conn = sqlite3.connect(DB_FILE, check_same_thread=False, factory=GroupedConnection)
+        return db_conn
+
+@contextmanager
+def database():
+    """Hold the shared database connection; roll back if the block raises."""
+    with db_lock:
+        conn = get_db()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+
+@contextmanager
+def one_transaction():
+    """Run the block's database functions as one transaction: their commits happen once, at the end."""
+    with database() as conn:
+        conn.hold_commits = True
+        try:
+            yield conn
+        finally:
+            conn.hold_commits = False
+        conn.commit()
+
+# Typed access to the messages table (schema, ordering, templates)
+message_store = MessageStore(database)
+
+def close_database():
+    """Close the shared database connection."""
+    global db_conn
+    with db_lock:
+        if db_conn is not None:
+            db_conn.close()
+            db_conn = None
+
 def setup_gpio():
     """Set up GPIO pins."""
     GPIO.setmode(GPIO.BCM)
@@ -28,163 +270,366 @@ def setup_gpio():
     GPIO.setup(LED_PIN, GPIO.OUT)                                # Green LED as output
     GPIO.setup(LED_BLUE, GPIO.OUT)                               # Blue LED as output
     GPIO.setup(A9G_POWER_PIN, GPIO.OUT)                          # A9G Power pin as output
-    GPIO.output(LED_PIN, GPIO.LOW)  # Ensure LEDs are initially off
-    GPIO.output(LED_BLUE, GPIO.LOW)
+    leds.off(LED_PIN)  # Ensure LEDs are initially off
+    leds.off(LED_BLUE)
 
 def create_database():
     """Create the SQLite database and contacts/messages tables if they don't exist."""
-    db_file = 'contacts.db'
-
     # Connect to the SQLite database; if the file doesn't exist, it will be created.
-    db_exists = os.path.exists(db_file)
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+    db_exists = os.path.exists(DB_FILE)
+    with database() as conn:
+        cursor = conn.cursor()
+
+        # If the database did not exist, create the tables
+        if not db_exists:
+            # Create a table named 'contacts' if it doesn't already exist
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS contacts (
+                    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    A_ID INTEGER NOT NULL,  -- New separate ID for Android data as INTEGER
+                    ContactName TEXT NOT NULL,
+                    ContactNumber TEXT NOT NULL,
+                    Priority INTEGER NOT NULL DEFAULT 0  -- Higher priority contacts are alerted first
+                )
+            ''')
+            print("Database and table 'contacts' created successfully.")
+        else:
+            print("Database already exists, no need to create tables.")
 
-    # If the database did not exist, create the tables
-    if not db_exists:
-        # Create a table named 'contacts' if it doesn't already exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS contacts (
-                ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                A_ID INTEGER NOT NULL,  -- New separate ID for Android data as INTEGER
-                ContactName TEXT NOT NULL,
-                ContactNumber TEXT NOT NULL
-            )
-        ''')
-
-        # Create a table named 'messages' if it doesn't already exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                MessageText TEXT NOT NULL
-            )
-        ''')
-        print("Database and tables 'contacts' and 'messages' created successfully.")
-    else:
-        print("Database already exists, no need to create tables.")
+            # Databases created before contact priorities existed lack the Priority column
+            cursor.execute('PRAGMA table_info(contacts)')
+            columns = [column[1] for column in cursor.fetchall()]
+            if 'Priority' not in columns:
+                cursor.execute('ALTER TABLE contacts ADD COLUMN Priority INTEGER NOT NULL DEFAULT 0')
+                print("Added 'Priority' column to the contacts table.")
 
-    conn.commit()
-    conn.close()
+        # Prefix indexes for search_contacts (ID breaks ties for the page cursor)
+        cursor.execute('CREATE INDEX IF NOT EXISTS contacts_name ON contacts (ContactName COLLATE NOCASE, ID)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS contacts_number ON contacts (ContactNumber, ID)')
+
+        # Received SMS, in new and existing databases alike
+        create_inbound_tables(conn)
+
+        conn.commit()
+
+    # Creates or upgrades the messages table and checks every message query against it
+    message_store.prepare()
+
+    # The GPS track log lives next to the database as a fixed-size ring file
+    open_track_store()
+
+def open_track_store():
+    """Open (creating if needed) the memory-mapped track ring file."""
+    global track_store
+    if track_store is None:
+        track_store = TrackStore(TRACK_FILE)
+        print(f"Track store '{TRACK_FILE}' ready: {len(track_store)} of {track_store.capacity} records used.")
+    return track_store
+
+def record_fix(fix):
+    """Append a tracking fix to the track ring file."""
+    if track_store is not None:
+        track_store.append(fix.timestamp, fix.latitude, fix.longitude, fix.speed, fix.hdop)
+
+def send_track_export(client_sock, recvdata):
+    """Send the packed track records of a time range to the RFCOMM client.
+
+    Format: "track export:[start],[end]" with unix times; both are optional.
+    The reply is "TRACK <records> <record size>\n", the raw little-endian records
+    straight from the ring file, then "\nEND_OF_DATA".
+    """
+    _, time_range = recvdata.split(":", 1)
+    start, _, end = time_range.partition(",")
+    try:
+        start = float(start) if start.strip() else None
+        end = float(end) if end.strip() else None
+    except ValueError as e:
+        client_sock.send(f"ERROR {e}\nEND_OF_DATA".encode('utf-8'))
+        return
+
+    slices = track_store.export(start, end) if track_store is not None else []
+    try:
+        count = sum(len(data) for data in slices) // RECORD.size
+        client_sock.send(f"TRACK {count} {RECORD.size}\n".encode('utf-8'))
+        for data in slices:
+            client_sock.sendall(data)
+        client_sock.send("\nEND_OF_DATA".encode('utf-8'))
+        print(f"Exported {count} track records.")
+    finally:
+        for data in slices:
+            data.release()
 
 
 def add_contact_to_database(a_id, contact_name, contact_number):
     """Add a new contact to the contacts table with A_ID."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
+    with database() as conn:
+        cursor = conn.cursor()
 
-    # Insert a new contact into the contacts table
-    cursor.execute('''
-        INSERT INTO contacts (A_ID, ContactName, ContactNumber)
-        VALUES (?, ?, ?)
-    ''', (a_id, contact_name, contact_number))
+        # Insert a new contact into the contacts table
+        cursor.execute('''
+            INSERT INTO contacts (A_ID, ContactName, ContactNumber)
+            VALUES (?, ?, ?)
+        ''', (a_id, contact_name, contact_number))
 
-    conn.commit()
-    conn.close()
+        conn.commit()
     print(f"Contact '{contact_name}' with number '{contact_number}' and A_ID '{a_id}' added successfully.")
     
 def retrieve_all_messages():
-    """Retrieve all saved messages from the messages table."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
-
-    # Query all messages from the messages table
-    cursor.execute('SELECT MessageText FROM messages')
-    messages = cursor.fetchall()
-
-    conn.close()
-    
-    # Extract messages from tuples and return as a list
-    return [message[0] for message in messages]
+    """Retrieve the enabled messages sent to every contact, in send order."""
+    return [message.text for message in message_store.all() if message.enabled and message.contact is None]
 
 def retrieve_all_messages_with_id():
-    """Retrieve all saved messages from the messages table."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
-
-    # Query all messages from the messages table
-    cursor.execute('SELECT ID,MessageText FROM messages')
-    messages = cursor.fetchall()
-
-    conn.close()
-    
-    # Extract messages from tuples and return as a list
-    return [{'id': message[0], 'message': message[1]} for message in messages]
+    """Retrieve all saved messages, templates and disabled ones included, in send order."""
+    return [{'id': message.id, 'message': message.text, 'position': message.position,
+             'enabled': message.enabled, 'contact': message.contact}
+            for message in message_store.all()]
 
 def update_contact_in_database(a_id, new_contact_name, new_contact_number):
     """Update the contact information in the contacts table based on the A_ID."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
+    with database() as conn:
+        cursor = conn.cursor()
 
-    try:
-        # Update the contact details using A_ID
-        cursor.execute('''
-            UPDATE contacts
-            SET ContactName = ?, ContactNumber = ?
-            WHERE A_ID = ?  -- Use A_ID to identify the contact
-        ''', (new_contact_name, new_contact_number, a_id))
+        try:
+            old_numbers = {row[0] for row in conn.execute('SELECT ContactNumber FROM contacts WHERE A_ID = ?', (a_id,))}
 
-        if cursor.rowcount == 0:
-            print(f"No contact found with A_ID {a_id}.")
-        else:
-            print(f"Contact with A_ID {a_id} updated to Name: '{new_contact_name}', Number: '{new_contact_number}'.")
+            # Update the contact details using A_ID
+            cursor.execute('''
+                UPDATE contacts
+                SET ContactName = ?, ContactNumber = ?
+                WHERE A_ID = ?  -- Use A_ID to identify the contact
+            ''', (new_contact_name, new_contact_number, a_id))
 
-        conn.commit()
+            if cursor.rowcount == 0:
+                print(f"No contact found with A_ID {a_id}.")
+            else:
+                print(f"Contact with A_ID {a_id} updated to Name: '{new_contact_name}', Number: '{new_contact_number}'.")
 
-    except sqlite3.Error as e:
-        print(f"An error occurred while updating the contact: {e}")
+            # Its message templates follow the new number
+            for old_number in old_numbers - {new_contact_number}:
+                if not contact_number_exists(old_number):
+                    moved = message_store.retarget(old_number, new_contact_number)
+                    if moved:
+                        print(f"{moved} message template(s) moved from '{old_number}' to '{new_contact_number}'.")
 
-    finally:
-        conn.close()
+            conn.commit()
+
+        except sqlite3.Error as e:
+            print(f"An error occurred while updating the contact: {e}")
         
             
-def add_message_to_database(message_text):
-    """Add a new message to the messages table."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
-
-    # Insert a new message into the messages table
-    cursor.execute('''
-        INSERT INTO messages (MessageText)
-        VALUES (?)
-    ''', (message_text,))
-
-    conn.commit()
-    conn.close()
-    print(f"Message '{message_text}' added successfully.")
+def add_message_to_database(message_text, contact_number=None):
+    """Add a new message to the messages table, for contact_number only if given."""
+    message_id = message_store.add(message_text, contact_number)
+    target = f" for '{contact_number}'" if contact_number else ""
+    print(f"Message '{message_text}'{target} added successfully with ID {message_id}.")
     
+def contact_number_exists(number):
+    """Return True if a contact has exactly this number."""
+    with database() as conn:
+        return conn.execute('SELECT 1 FROM contacts WHERE ContactNumber = ? LIMIT 1', (number,)).fetchone() is not None
+
+def find_contact_number(number):
+    """Return the stored number of the contact number refers to, or None.
+
+    Numbers are compared like inbound SMS senders (inbound_sms.number_key), so
+    "+639171234567" finds a contact stored as "09171234567".
+    """
+    key = number_key(number)
+    if not key:
+        return None
+    for stored in list_all_contacts():
+        if number_key(stored) == key:
+            return stored
+    return None
+
 def list_all_contacts():
-    """Retrieve and return all contact numbers from the contacts table."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
+    """Retrieve and return all contact numbers, highest priority first."""
+    with database() as conn:
+        cursor = conn.cursor()
 
-    # Query all contacts from the contacts table
-    cursor.execute('SELECT ContactNumber FROM contacts')
-    contact_numbers = cursor.fetchall()
+        # Query all contacts from the contacts table; ties keep insertion order
+        cursor.execute('SELECT ContactNumber FROM contacts ORDER BY Priority DESC, ID')
+        contact_numbers = cursor.fetchall()
 
-    conn.close()
 
     # Return only the numbers as a list
     return [contact[0] for contact in contact_numbers]  # Extract the number from the tuples
-def retrieve_all_contact_numbers():
-    """Retrieve all unique contact numbers from the contacts table."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
 
+# Page size of "search contacts" when the client does not give one, and its upper bound
+CONTACT_PAGE_SIZE = 20
+MAX_CONTACT_PAGE = 100
+
+def encode_contact_cursor(key, row_id):
+    """Encode the sort key and ID of the last contact of a page as an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps([key, row_id]).encode('utf-8')).decode('ascii')
+
+def decode_contact_cursor(cursor):
+    """Return (sort key, ID) of a cursor made by encode_contact_cursor."""
     try:
-        # Query all contact numbers from the contacts table
-        cursor.execute('SELECT ContactNumber FROM contacts')
-        contact_numbers = cursor.fetchall()
+        key, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError(f"invalid cursor {cursor!r}") from None
+    return key, int(row_id)
+
+def search_contacts(query="", limit=CONTACT_PAGE_SIZE, cursor=None):
+    """Return (contacts, next cursor) for one page of contacts starting with query.
+
+    A query of digits (optionally after "+") matches the start of the number,
+    anything else the start of the name, ignoring case; an empty query pages
+    through every contact by name. Each page is one range scan of the
+    contacts_name or contacts_number index, continued after the (key, ID) of
+    the previous page, so deep pages cost no more than the first. The cursor
+    is None on the last page.
+    """
+    query = query.strip()
+    column = "ContactNumber" if query.lstrip("+").isdigit() else "ContactName COLLATE NOCASE"
+    conditions, parameters = [], []
+    if query:
+        # Everything that starts with query sorts between query and query + the highest code point
+        conditions.append(f"{column} >= ? AND {column} < ?")
+        parameters += [query, query + "\U0010ffff"]
+    if cursor:
+        conditions.append(f"({column}, ID) > (?, ?)")
+        parameters += list(decode_contact_cursor(cursor))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    limit = max(1, min(limit, MAX_CONTACT_PAGE))
+
+    with database() as conn:
+        rows = conn.execute(f'SELECT ID, A_ID, ContactName, ContactNumber, Priority FROM contacts {where} '
+                            f'ORDER BY {column}, ID LIMIT ?', parameters + [limit + 1]).fetchall()
+
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_contact_cursor(last[3] if column == "ContactNumber" else last[2], last[0])
+    contacts = [{'A_ID': row[1], 'name': row[2], 'number': row[3], 'priority': row[4]} for row in page]
+    return contacts, next_cursor
+
+def send_contact_page(client_sock, recvdata):
+    """Answer "search contacts:<page size>,<cursor>,<query>" with one page of contacts.
+
+    Both the page size and the cursor may be empty. The reply is
+    "{'contacts': [...], 'next': <cursor or None>}" followed by "\nEND_OF_DATA";
+    the client passes 'next' back to get the following page.
+    """
+    db_writes.flush()  # Include the changes this client just sent
+    _, arguments = recvdata.split(":", 1)
+    size, _, rest = arguments.partition(",")
+    cursor, _, query = rest.partition(",")
+    try:
+        contacts, next_cursor = search_contacts(query, int(size) if size.strip() else CONTACT_PAGE_SIZE,
+                                                cursor.strip() or None)
+    except ValueError as e:
+        client_sock.send(f"ERROR {e}\nEND_OF_DATA".encode('utf-8'))
+        return
+    client_sock.send((str({'contacts': contacts, 'next': next_cursor}) + "\nEND_OF_DATA").encode('utf-8'))
+    print(f"Sent {len(contacts)} contacts for search '{query.strip()}'.")
 
-        # Extract numbers from tuples and return as a unique list
-        unique_contact_numbers = set(contact[0] for contact in contact_numbers)  # Use a set for uniqueness
-        return list(unique_contact_numbers)  # Convert set back to list
+def set_priority_command(client_sock, recvdata):
+    """Queue "set priority:<A_ID>,<priority>" (higher is alerted first); answer malformed input with an error."""
+    try:
+        _, priority_info = recvdata.split(":", 1)
+        a_id, priority = priority_info.split(",", 1)
+        a_id, priority = int(a_id.strip()), int(priority.strip())
+    except ValueError:
+        client_sock.send(f"ERROR expected 'set priority:<id>,<priority>', got {recvdata!r}\nEND_OF_DATA".encode('utf-8'))
+        return
+    db_writes.submit(set_contact_priority, a_id, priority)
+
+def send_database_backup(client_sock):
+    """Answer "backup" with a consistent snapshot of contacts.db (see db_backup)."""
+    db_writes.flush()  # Include the changes this client just sent
+    size = send_backup(client_sock, DB_FILE)
+    print(f"Sent a {size} byte backup of the database.")
+
+def restore_database(client_sock, recvdata):
+    """Answer "restore:<size>,<sha256>" by receiving and applying a backup (see db_backup).
+
+    Returns False if the restore failed: the rest of the client's chunks may
+    still be in flight, so the caller ends the session rather than read them
+    as commands.
+    """
+    db_writes.flush()  # Queued changes must not land on top of the restored data
+    try:
+        print(receive_restore(client_sock, recvdata, database, on_restored=reload_restored_database))
+    except BackupError as e:
+        print(f"Restore failed: {e}")
+        return False
+    return True
+
+def reload_restored_database():
+    """Bring a restored database up to the current schema and rebuild the SOS plan from it."""
+    create_database()
+    rebuild_sos_plan()
+
+def start_profiling(duration=None):
+    """Start sampling every thread's stack; stop by itself after duration seconds if given."""
+    global profiler
+    if profiler is None or not profiler.running():
+        profiler = StackSampler(PROFILE_INTERVAL, PROFILE_DIR).start(duration)
+        print(f"Profiling started{f' for {duration} s' if duration else ''}.")
+    return profiler
+
+def stop_profiling():
+    """Stop the profiler and save its profile; return the file path or None."""
+    if profiler is None or not profiler.running():
+        return None
+    return profiler.stop()
+
+def send_profile_export(client_sock, recvdata):
+    """Answer "profile export:[name]" with a saved profile (the newest without a name).
+
+    The reply is "PROFILE <bytes> <name>\n", the collapsed stacks, then "\nEND_OF_DATA".
+    """
+    _, name = recvdata.split(":", 1)
+    try:
+        path = profile_path(name.strip(), PROFILE_DIR)
+    except ValueError as e:
+        client_sock.send(f"ERROR {e}\nEND_OF_DATA".encode('utf-8'))
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    client_sock.send(f"PROFILE {len(data)} {os.path.basename(path)}\n".encode('utf-8'))
+    client_sock.sendall(data)
+    client_sock.send("\nEND_OF_DATA".encode('utf-8'))
+    print(f"Sent profile {path}.")
+
+def set_contact_priority(a_id, priority):
+    """Set the SOS priority of the contact with the given A_ID."""
+    with database() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('UPDATE contacts SET Priority = ? WHERE A_ID = ?', (priority, a_id))
+
+            if cursor.rowcount == 0:
+                print(f"No contact found with A_ID {a_id}.")
+            else:
+                print(f"Contact with A_ID {a_id} priority set to {priority}.")
 
-    except sqlite3.Error as e:
-        print(f"An error occurred while retrieving contact numbers: {e}")
-        return []  # Return an empty list on error
+            conn.commit()
 
-    finally:
-        conn.close()  # Ensure the connection is closed
+        except sqlite3.Error as e:
+            print(f"An error occurred while setting the contact priority: {e}")
+
+def retrieve_all_contact_numbers():
+    """Retrieve all unique contact numbers from the contacts table."""
+    with database() as conn:
+        cursor = conn.cursor()
+
+        try:
+            # Query all contact numbers from the contacts table
+            cursor.execute('SELECT ContactNumber FROM contacts')
+            contact_numbers = cursor.fetchall()
+
+            # Extract numbers from tuples and return as a unique list
+            unique_contact_numbers = set(contact[0] for contact in contact_numbers)  # Use a set for uniqueness
+            return list(unique_contact_numbers)  # Convert set back to list
+
+        except sqlite3.Error as e:
+            print(f"An error occurred while retrieving contact numbers: {e}")
+            return []  # Return an empty list on error
 
 
 def send_sms(latitude, longitude, contact, message_text):
@@ -193,18 +638,16 @@ def send_sms(latitude, longitude, contact, message_text):
     response = send_command('AT+CMGF=1')
     print("Setting SMS format:", response)
 
-    # Prepare the SMS command
-    sms_command = f'AT+CMGS="{contact}"'
-    response = send_command(sms_command)
-    print("SMS Command Response:", response)
+    # Send the AT+CMGS command, then the message followed by Ctrl+Z (ASCII 26)
+    return send_sms_payload(f'AT+CMGS="{contact}"\r\n'.encode(), (message_text + chr(26)).encode())
 
-    # Send the message body
-    ser.write((message_text + chr(26)).encode())  # Send the message followed by Ctrl+Z (ASCII 26)
-    time.sleep(3)  # Wait for the message to be sent
+def send_sms_payload(cmgs_command, body):
+    """Send a pre-encoded SMS: the AT+CMGS command bytes, then the body ending in Ctrl+Z.
 
-    # Check for response
-    response = ser.readlines()
-    print("SMS Response:", response)
+    Returns True if a module of the pool confirmed the SMS with +CMGS.
+    """
+    return get_modem_pool().send(cmgs_command, body, prompt_timeout=SMS_PROMPT_TIMEOUT,
+                                 send_timeout=SMS_SEND_TIMEOUT)
 
 
 
@@ -222,86 +665,154 @@ def blink_led(led_pin, duration=5):
         time.sleep(0.5)
         GPIO.output(led_pin, GPIO.LOW)    # Turn off the LED
         time.sleep(0.5)
-def blue_led_blink():
-    """Blink the Blue LED while Bluetooth is connecting until stopped."""
-    while not stop_event.is_set():
-        GPIO.output(LED_BLUE, GPIO.HIGH)  # Turn on Blue LED
-        time.sleep(0.5)                   # Blink interval
-        GPIO.output(LED_BLUE, GPIO.LOW)   # Turn off Blue LED
-        time.sleep(0.5)
-
 def manage_bluetooth_connection():
-    """Start bluetoothctl, manage commands, and handle device connections."""
+    """Pair and serve the phone, keeping the radio out of the power policy meanwhile.
+
+    A phone that connected before is served without pairing again if it
+    reconnects within RECONNECT_WAIT seconds.
+    """
+    if FAST_RECONNECT and run_fast_reconnect():
+        return
+    scan = power.policy().pairing_scan
+    with power.hold("bluetooth", SCANNING if scan else DISCOVERABLE):
+        run_pairing_flow(scan)
+
+# Remembered phones; opened on first use by get_trusted_devices()
+trusted_devices = None
+trusted_devices_lock = threading.Lock()
+
+# Channels with a Serial Port SDP record registered since bluetoothd started here
+registered_channels = set()
+
+def get_trusted_devices():
+    """Return the trusted-device cache, reading TRUSTED_DEVICES_FILE on first use."""
+    global trusted_devices
+    with trusted_devices_lock:
+        if trusted_devices is None:
+            trusted_devices = TrustedDevices(TRUSTED_DEVICES_FILE)
+        return trusted_devices
+
+def register_serial_port(channel):
+    """Register the Serial Port service on channel; return True on success."""
+    if run_raspberry_pi_command(["sudo", "sdptool", "add", f"--channel={channel}", "SP"]) is None:
+        return False
+    registered_channels.add(channel)
+    return True
+
+def remember_device(address, channel):
+    """Record a phone that opened a session, and let BlueZ accept it without the agent."""
+    try:
+        get_trusted_devices().record(address, channel)
+        get_bluetoothctl().command(f"trust {address}", r"trust succeeded|Failed|not available",
+                                   timeout=BLUETOOTHCTL_TIMEOUT)
+    except (OSError, ValueError) as e:
+        print(f"Could not remember device {address}: {e}")
+
+def run_fast_reconnect():
+    """Serve the last trusted phone without discovery or pairing; return False if it did not connect."""
+    last = get_trusted_devices().last()
+    if last is None:
+        return False
+    address, device = last
+
+    warmup_done.wait()  # The RFCOMM verbs need the database
+    leds.off(LED_PIN)
+    leds.blink(LED_BLUE)
+    connected = False
+    with power.hold("bluetooth", CONNECTABLE):
+        try:
+            ctl = get_bluetoothctl()
+            ctl.discard()
+            ctl.command("power on", r"power on succeeded|Failed", timeout=BLUETOOTHCTL_TIMEOUT)
+
+            # BlueZ must still hold the pairing, or the phone cannot reconnect
+            info = ctl.command(f"info {address}", r"Connected: |not available", timeout=BLUETOOTHCTL_TIMEOUT)
+            if not any("Paired: yes" in line for line in info):
+                print(f"{address} is no longer paired; forgetting it.")
+                get_trusted_devices().forget(address)
+                return False
+
+            channel = device["channel"]
+            if channel not in registered_channels and not register_serial_port(channel):
+                return False
+            if RECONNECT_INITIATE:
+                ctl.send(f"connect {address}")  # Answered while we already listen
+
+            print(f"Waiting {RECONNECT_WAIT} s for trusted device {address} on channel {channel}...")
+            if channel == RFCOMM_CHANNEL:
+                connected = start_rfcomm_server(accept_timeout=RECONNECT_WAIT)
+            else:
+                connected = start_rfcomm_server_with_new_port(channel, accept_timeout=RECONNECT_WAIT)
+        except Exception as e:
+            print(f"Fast reconnect failed: {e}")
+        finally:
+            if connected:
+                turn_off_bluetooth()
+                leds.off(LED_BLUE)
+                leds.on(LED_PIN)
+    if not connected:
+        print(f"{address} did not reconnect; starting pairing.")
+    return connected
+
+# bluetoothctl setup for pairing: (message, command, line that ends the command)
+PAIRING_COMMANDS = [
+    ("Powering on the Bluetooth adapter...", "power on", r"power on succeeded|Failed"),
+    ("Making device discoverable...", "discoverable on", r"discoverable on succeeded|Failed"),
+    ("Enabling agent...", "agent on", r"Agent (is already )?registered|Failed"),
+    ("Setting default agent...", "default-agent", r"Default agent request successful|Failed|No agent"),
+    ("Starting device scan...", "scan on", r"Discovery started|Failed"),
+]
+
+def run_pairing_flow(scan=True):
+    """Pair with the phone through the bluetoothctl session, then serve it over RFCOMM."""
     
+    warmup_done.wait()  # The RFCOMM verbs need the database
+
     # Set initial states for LEDs
-    GPIO.output(LED_PIN, GPIO.LOW)   # Turn off green LED initially
-    GPIO.output(LED_BLUE, GPIO.LOW)  # Turn off blue LED initially
-
-    # Start the Blue LED blinking thread
-    stop_event.clear()  # Ensure the stop event is cleared before starting the thread
-    blue_led_thread = threading.Thread(target=blue_led_blink)
-    blue_led_thread.start()
-
-    # Start bluetoothctl as a subprocess
-    process = subprocess.Popen(
-        ['bluetoothctl'],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1  # Line-buffered
-    )
-
-    commands = [
-        ("Powering on the Bluetooth adapter...", "power on"),
-        ("Making device discoverable...", "discoverable on"),
-        ("Enabling agent...", "agent on"),
-        ("Setting default agent...", "default-agent"),
-        ("Starting device scan...", "scan on")
-    ]
+    leds.off(LED_PIN)  # Turn off green LED initially
+    leds.off(LED_BLUE)  # Turn off blue LED initially
+
+    # Blink the Blue LED while Bluetooth is connecting
+    leds.blink(LED_BLUE)
 
-    for message, command in commands:
+    # One bluetoothctl runs for the whole program; only its new output matters here
+    ctl = get_bluetoothctl()
+    ctl.discard()
+
+    for message, command, expect in PAIRING_COMMANDS:
+        if command == "scan on" and not scan:
+            continue  # The phone connects to us either way
         print(message)
-        
-        if command is None:
-            print("Command is None. Skipping...")
-            continue
-        
-        if process.poll() is None:  # Check if the process is still running
-            try:
-                process.stdin.write(command + '\n')
-                process.stdin.flush()
-                time.sleep(1)  # Allow time for processing
-            except Exception as e:
-                print(f"Failed to send command '{command}': {e}")
-        else:
-            print(f"Process is not running. Unable to execute command: {command}")
+        for line in ctl.command(command, expect, timeout=BLUETOOTHCTL_TIMEOUT):
+            log.debug("bluetooth", "Output: %s", line)
 
     try:
         print("Waiting for a device to connect...")
         countdown_started = False
-        countdown_duration = 10  # 10 seconds countdown
+        countdown_duration = PAIRING_COUNTDOWN
         start_time = None
+        authorised = False  # The agent accepted a passkey or service request in this flow
 
         while True:
-            # Read output continuously
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break  # Exit loop if the process is terminated
+            # Wait at most a second for output, so the countdown keeps running
+            output = ctl.read_line(timeout=1)
+            if output is None and not ctl.is_running():
+                print("bluetoothctl exited.")
+                break
             if output:
-                print(f"Output: {output.strip()}")
+                log.debug("bluetooth", "Output: %s", output)
 
                 # Check for the passkey confirmation prompt
                 if "Confirm passkey" in output:
                     print("Responding 'yes' to passkey confirmation...")
-                    process.stdin.write("yes\n")
-                    process.stdin.flush()
+                    ctl.send("yes")
+                    authorised = True
 
                 # Check for authorization service prompt
                 if "[agent] Authorize service" in output:
                     print("Responding 'yes' to authorization service...")
-                    process.stdin.write("yes\n")
-                    process.stdin.flush()
+                    ctl.send("yes")
+                    authorised = True
                     countdown_started = False  # Stop countdown if service is authorized
 
                 # Check for the specific message to start the countdown
@@ -312,8 +823,7 @@ def manage_bluetooth_connection():
 
                 # Check for Serial Port service registration
                 if "Serial Port service registered" in output:
-                    print("Serial Port service registered. Waiting for 5 seconds...")
-                    time.sleep(5)  # Wait for 5 seconds
+                    print("Serial Port service registered.")
 
             # Show countdown if it has been started
             if countdown_started:
@@ -323,164 +833,183 @@ def manage_bluetooth_connection():
                     sys.stdout.write(f"\rWaiting for authorization service... {remaining_time} seconds remaining")
                     sys.stdout.flush()
                 else:
-                    print("\nNo authorization service found within 10 seconds. Sending 'quit' command to bluetoothctl...")
-                    process.stdin.write("quit\n")
-                    process.stdin.flush()
-                    process.wait()  # Wait for bluetoothctl to exit gracefully
-                    countdown_started = False  # Reset countdown after sending quit
+                    print(f"\nNo authorization service found within {countdown_duration} seconds.")
+                    if scan:
+                        ctl.command("scan off", r"Discovery stopped|Failed", timeout=BLUETOOTHCTL_TIMEOUT)
 
-                    # Wait for 5 seconds for any response from bluetoothctl
-                    print("Waiting for 5 seconds for any response from bluetoothctl...")
-                    time.sleep(5)
-
-                    # Execute the Raspberry Pi command after exiting bluetoothctl
-                    print("Ready to execute the Raspberry Pi command...")
-                    run_raspberry_pi_command("sudo sdptool add --channel=23 SP")
-                    print("Command executed successfully.")
+                    # Register the serial port service, then serve the phone
+                    register_serial_port(RFCOMM_CHANNEL)
 
                     # Stop Blue LED blinking and turn it to steady light
-                    stop_event.set()
-                    blue_led_thread.join()  # Ensure blinking thread stops
-                    GPIO.output(LED_BLUE, GPIO.HIGH)  # Turn on Blue LED (steady light)
+                    leds.on(LED_BLUE)  # Turn on Blue LED (steady light)
                     
-                    start_rfcomm_server()  # Now start the RFCOMM server
+                    start_rfcomm_server(authorised=authorised)  # Now start the RFCOMM server
+                    break
 
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
-        # Ensure the process is terminated
-        process.terminate()
-        print("bluetoothctl process terminated.")
         turn_off_bluetooth()  # Call this function to turn off Bluetooth
-        GPIO.output(LED_BLUE, GPIO.LOW)  # Turn off Blue LED
-        GPIO.output(LED_PIN, GPIO.HIGH)  # Turn on green LED steady
+        leds.off(LED_BLUE)  # Turn off Blue LED
+        leds.on(LED_PIN)  # Turn on green LED steady
 
 def turn_off_bluetooth():
-    """Turn off Bluetooth using bluetoothctl."""
+    """Power off the Bluetooth adapter through the bluetoothctl session."""
+    print("Turning off Bluetooth...")
     try:
-        # Start a new bluetoothctl process
-        process = subprocess.Popen(
-            ['bluetoothctl'],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1  # Line-buffered
-        )
-
-        # Send the 'power off' command to disable Bluetooth
-        print("Turning off Bluetooth...")
-        process.stdin.write("power off\n")
-        process.stdin.flush()
-        
-        # Wait for the process to finish gracefully
-        process.stdin.write("quit\n")
-        process.stdin.flush()
-        process.wait()  # Wait for process termination
-
-        # Process has successfully terminated
-        print("bluetoothctl process terminated. Bluetooth is now powered off.")
-
-    except Exception as e:
+        output = get_bluetoothctl().command("power off", r"power off succeeded|Failed", timeout=BLUETOOTHCTL_TIMEOUT)
+        if any("power off succeeded" in line for line in output):
+            power.set_state("bluetooth", OFF)  # The power policy leaves an adapter that is off alone
+            print("Bluetooth turned off successfully.")
+        else:
+            print(f"Bluetooth did not confirm power off: {output}")
+    except OSError as e:
         print(f"An error occurred while turning off Bluetooth: {e}")
-    finally:
-        process.terminate()
-        print("Bluetooth turned off successfully.")
         
                 
-def run_raspberry_pi_command(command):
-    """Run a command on Raspberry Pi."""
-    try:
-        output = subprocess.check_output(command, shell=True, text=True)
-        print("Command output:", output)
-        return output
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing command: {e}\nOutput: {e.output}")
+def run_raspberry_pi_command(argv):
+    """Run a command (argument list, no shell) on Raspberry Pi under a timeout."""
+    status, output = run_local_command(argv)
+    print(f"Command {' '.join(argv)}: {status}\n{output}")
+    return output if status == "EXIT 0" else None
 
 def retrieve_all_contacts():
     """Retrieve all contacts from the contacts table."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
+    with database() as conn:
+        cursor = conn.cursor()
 
-    # Query all contacts from the contacts table
-    cursor.execute('SELECT ContactName, ContactNumber FROM contacts')
-    contacts = cursor.fetchall()
+        # Query all contacts from the contacts table
+        cursor.execute('SELECT ContactName, ContactNumber FROM contacts')
+        contacts = cursor.fetchall()
 
-    conn.close()
     
     # Return contacts as a list of dictionaries
     return [{'name': contact[0], 'number': contact[1]} for contact in contacts]
 
 def retrieve_all_contacts_with_id():
     """Retrieve all contacts from the contacts table."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
+    with database() as conn:
+        cursor = conn.cursor()
 
-    # Query all contacts from the contacts table
-    cursor.execute('SELECT A_ID,ContactName, ContactNumber FROM contacts')
-    contacts = cursor.fetchall()
+        # Query all contacts from the contacts table
+        cursor.execute('SELECT A_ID,ContactName, ContactNumber, Priority FROM contacts')
+        contacts = cursor.fetchall()
 
-    conn.close()
     
     # Return contacts as a list of dictionaries
-    return [{'A_ID':contact[0],'name': contact[1], 'number': contact[2]} for contact in contacts]
+    return [{'A_ID':contact[0],'name': contact[1], 'number': contact[2], 'priority': contact[3]} for contact in contacts]
 
 def delete_contact_from_database(contact_number):
     """Delete a contact from the contacts table based on the contact number."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
+    with database() as conn:
+        cursor = conn.cursor()
 
-    # Delete the contact with the specified contact number
-    cursor.execute('DELETE FROM contacts WHERE ContactNumber = ?', (contact_number,))
+        # Delete the contact with the specified contact number, and its message templates
+        cursor.execute('DELETE FROM contacts WHERE ContactNumber = ?', (contact_number,))
+        templates = message_store.delete_templates(contact_number)
 
-    conn.commit()
-    conn.close()
-    print(f"Contact with number '{contact_number}' deleted successfully.")
+        conn.commit()
+    print(f"Contact with number '{contact_number}' deleted successfully"
+          f"{f' with {templates} message template(s)' if templates else ''}.")
 
 def update_message_in_database(message_id, new_message_text):
     """Update an existing message in the messages table, or insert if not found."""
-    conn = sqlite3.connect('contacts.db')
-    cursor = conn.cursor()
-
-    # Attempt to update the message text for the specified message ID
-    cursor.execute('''
-        UPDATE messages
-        SET message_text = ?
-        WHERE message_id = ?
-    ''', (new_message_text, message_id))
-
-    # Check if any row was updated
-    if cursor.rowcount == 0:
-        # If no rows were updated, insert the new message
-        cursor.execute('''
-            INSERT INTO messages (message_id, message_text)
-            VALUES (?, ?)
-        ''', (message_id, new_message_text))
+    if message_store.save(message_id, new_message_text):
+        print(f"Message with ID '{message_id}' updated successfully.")
+    else:
         print(f"Message with ID '{message_id}' not found. Inserted as a new record.")
+
+def enable_message_in_database(message_id, enabled):
+    """Enable or disable a saved message; a disabled message is kept but not sent."""
+    if message_store.set_enabled(message_id, enabled):
+        print(f"Message with ID '{message_id}' {'enabled' if enabled else 'disabled'}.")
     else:
-        print(f"Message with ID '{message_id}' updated successfully.")
+        print(f"No message found with ID '{message_id}'.")
 
-    # Commit the transaction and close the connection
-    conn.commit()
-    conn.close()
-def start_rfcomm_server():
-    """Start RFCOMM server on a random channel if needed."""
-    print("Starting RFCOMM server on channel 23...")
+def move_message_in_database(message_id, position):
+    """Set the send position of a saved message (lower positions are sent first)."""
+    if message_store.move(message_id, position):
+        print(f"Message with ID '{message_id}' moved to position {position}.")
+    else:
+        print(f"No message found with ID '{message_id}'.")
+
+def delete_message_from_database(message_id):
+    """Delete a saved message."""
+    if message_store.delete(message_id):
+        print(f"Message with ID '{message_id}' deleted successfully.")
+    else:
+        print(f"No message found with ID '{message_id}'.")
+
+def handle_message_verb(recvdata, reply):
+    """Queue a message change from an RFCOMM command; return False if recvdata is not one.
+
+    Handles "update message:<id>,<text>", "enable message:<id>",
+    "disable message:<id>", "move message:<id>,<position>",
+    "delete message:<id>" and "contact message:<number>,<text>". A template
+    for a number that is no contact is refused with "Unknown contact: <number>"
+    through reply.
+    """
+    verb, _, argument = recvdata.partition(":")
+    try:
+        if verb == "update message":
+            message_id, new_message_text = argument.split(",", 1)
+            db_writes.submit(update_message_in_database, int(message_id), new_message_text.strip())
+        elif verb in ("enable message", "disable message"):
+            db_writes.submit(enable_message_in_database, int(argument), verb == "enable message")
+        elif verb == "move message":
+            message_id, position = argument.split(",", 1)
+            db_writes.submit(move_message_in_database, int(message_id), int(position))
+        elif verb == "delete message":
+            db_writes.submit(delete_message_from_database, int(argument))
+        elif verb == "contact message":
+            contact_number, message_text = argument.split(",", 1)
+            db_writes.flush()  # The contact may have been sent just before
+            stored_number = find_contact_number(contact_number.strip())
+            if stored_number is None:
+                print(f"Template for unknown contact '{contact_number.strip()}' refused.")
+                reply(f"Unknown contact: {contact_number.strip()}".encode('utf-8'))
+                return True
+            # Stored under the contact's own spelling of the number, which the SOS plan matches
+            db_writes.submit(add_message_to_database, message_text.strip(), stored_number)
+        else:
+            return False
+    except ValueError:
+        print(f"Malformed message command: {recvdata}")
+        return True
+    print(f"'{recvdata}' queued for the database.")
+    return True
+
+def start_rfcomm_server(accept_timeout=None, authorised=False):
+    """Start RFCOMM server on a random channel if needed.
+
+    Returns False if no client connected within accept_timeout seconds. The
+    client is remembered for fast reconnect only if it established a secure
+    session, or if authorised says the pairing flow has just accepted it.
+    """
+    import bluetooth
+    print(f"Starting RFCOMM server on channel {RFCOMM_CHANNEL}...")
+    connected = False
 
     try:
         server_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-        port = 23
+        port = RFCOMM_CHANNEL
         server_sock.bind(("", port))
         server_sock.listen(1)
+        server_sock.settimeout(accept_timeout)
 
         print(f"Listening for connections on RFCOMM channel {port}...")
         client_sock, address = server_sock.accept()
-        GPIO.output(LED_BLUE, GPIO.HIGH)
         print("Connection established with:", address)
+        client_sock.settimeout(None)
+        connected = True
+        client_sock = accept_session(client_sock, SESSION_KEY_FILE)  # Authenticate before any command
+        if authorised or isinstance(client_sock, SecureSession):
+            remember_device(address[0], port)  # Not any device that merely opened a connection
+        leds.on(LED_BLUE)
        
         while True:
             recvdata = client_sock.recv(1024).decode('utf-8').strip()
-            print("Received command:", recvdata)
+            log.debug("rfcomm", "Received command: %s", recvdata)
 
             if recvdata == "Q" or recvdata == "socket close":
                 print("Ending connection.")
@@ -492,20 +1021,57 @@ def start_rfcomm_server():
                 a_id, contact_name, contact_number = contact_info.split(",", 2)
                 
                 # Call the function with all three arguments
-                add_contact_to_database(int(a_id.strip()), contact_name.strip(), contact_number.strip())
-                print(f"Contact '{contact_name.strip()}' with number '{contact_number.strip()}' and A_ID '{a_id.strip()}' saved to the database.")
+                db_writes.submit(add_contact_to_database, int(a_id.strip()), contact_name.strip(), contact_number.strip())
+                print(f"Contact '{contact_name.strip()}' with number '{contact_number.strip()}' and A_ID '{a_id.strip()}' queued for the database.")
                 continue
 
 
             if recvdata.startswith("set message:"):
                 # Example format: "set message:Hello, this is a test message"
                 _, message_text = recvdata.split(":", 1)
-                add_message_to_database(message_text.strip())
-                print(f"Message '{message_text.strip()}' saved to the database.")
+                db_writes.submit(add_message_to_database, message_text.strip())
+                print(f"Message '{message_text.strip()}' queued for the database.")
                 continue
             
+            if recvdata.startswith("op:"):
+                # Example format: "op:log 50" (see remote_ops for the operations)
+                remote_ops.execute(recvdata[3:], client_sock.send)
+                continue
+
+            if recvdata == "reload config":
+                # Re-read the configuration file; the reply says whether it was applied
+                client_sock.send(reload_config().encode('utf-8'))
+                continue
+
+            if recvdata.startswith("search contacts:"):
+                # Example format: "search contacts:20,,Ana" (page size, cursor of the previous page, prefix)
+                send_contact_page(client_sock, recvdata)
+                continue
+
+            if recvdata == "backup":
+                # Stream a snapshot of contacts.db in checksummed chunks
+                send_database_backup(client_sock)
+                continue
+
+            if recvdata.startswith("restore:"):
+                # Example format: "restore:<size>,<sha256>", followed by the chunks of a backup
+                if not restore_database(client_sock, recvdata):
+                    break  # Unread chunk bytes would be taken for commands
+                continue
+
+            if recvdata.startswith("profile export:"):
+                # Example format: "profile export:profile-20240101-120000.folded" (empty for the newest)
+                send_profile_export(client_sock, recvdata)
+                continue
+
+            if recvdata.startswith("track export:"):
+                # Example format: "track export:1700000000,1700003600" (either bound may be empty)
+                send_track_export(client_sock, recvdata)
+                continue
+
             if recvdata.startswith("sync data"):
                 # Retrieve all contacts and messages and send them to the Android app
+                db_writes.flush()  # Include the changes this client just sent
                 contacts = retrieve_all_contacts_with_id()
                 messages = retrieve_all_messages_with_id()
                 
@@ -522,37 +1088,41 @@ def start_rfcomm_server():
             if recvdata.startswith("delete contact:"):
                 # Example format: "delete contact:1234567890"
                 _, contact_number = recvdata.split(":", 1)
-                delete_contact_from_database(contact_number.strip())
-                print(f"Contact with number '{contact_number.strip()}' deleted.")
+                db_writes.submit(delete_contact_from_database, contact_number.strip())
+                print(f"Contact with number '{contact_number.strip()}' queued for deletion.")
                 continue
             
             if recvdata.startswith("update contact:"):
                 # Example format: "update contact:1,New Name,0987654321"
                 _, contact_info = recvdata.split(":", 1)
                 contact_id, new_contact_name, new_contact_number = contact_info.split(",", 2)
-                update_contact_in_database(contact_id.strip(), new_contact_name.strip(), new_contact_number.strip())
-                print(f"Contact with ID '{contact_id.strip()}' updated.")
+                db_writes.submit(update_contact_in_database, contact_id.strip(), new_contact_name.strip(), new_contact_number.strip())
+                print(f"Update of contact with ID '{contact_id.strip()}' queued.")
                 continue
 
+            if recvdata.startswith("set priority:"):
+                set_priority_command(client_sock, recvdata)
+                continue
 
-            if recvdata.startswith("update message:"):
-                # Example format: "update message:1,New Message Text"
-                _, message_info = recvdata.split(":", 1)
-                message_id, new_message_text = message_info.split(",", 1)
-                update_message_in_database(message_id.strip(), new_message_text.strip())
-                print(f"Message with ID '{message_id.strip()}' updated to '{new_message_text.strip()}'.")
+
+            # "update message:1,New text", "disable message:1", "move message:1,3",
+            # "contact message:+639171234567,Text for this contact only", ...
+            if handle_message_verb(recvdata, client_sock.send):
                 continue
 
             print(f"Unknown command received: {recvdata}")  # Log unknown commands
             client_sock.send(f"Unknown command: {recvdata}".encode('utf-8'))
 
     except bluetooth.BluetoothError as e:
+        if not connected and "timed out" in str(e):
+            print(f"No connection within {accept_timeout} seconds.")
+            return False
         print("Bluetooth error occurred:", e)
         if "Address already in use" in str(e):
-            new_port = random.randint(24, 99)
+            new_port = random.randint(RFCOMM_FALLBACK_MIN, RFCOMM_FALLBACK_MAX)
             print(f"Address already in use. Trying a new port: {new_port}...")
-            run_raspberry_pi_command(f"sudo sdptool add --channel={new_port} SP")
-            start_rfcomm_server_with_new_port(new_port)  # Retry with new port
+            register_serial_port(new_port)
+            connected = start_rfcomm_server_with_new_port(new_port, accept_timeout, authorised)  # Retry with new port
     except OSError as e:
         print("OS error occurred:", e)
     finally:
@@ -561,23 +1131,32 @@ def start_rfcomm_server():
         if 'server_sock' in locals():
             server_sock.close()
         print("Sockets closed.")
+    return connected
 
-def start_rfcomm_server_with_new_port(port):
-    """Start RFCOMM server on a specific port."""
+def start_rfcomm_server_with_new_port(port, accept_timeout=None, authorised=False):
+    """Start RFCOMM server on a specific port; False if nobody connected within accept_timeout."""
+    import bluetooth
+    connected = False
     try:
         server_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
         server_sock.bind(("", port))
         server_sock.listen(1)
+        server_sock.settimeout(accept_timeout)
 
         print(f"Listening for connections on RFCOMM channel {port}...")
         client_sock, address = server_sock.accept()
-        GPIO.output(LED_BLUE, GPIO.HIGH)
         print("Connection established with:", address)
+        client_sock.settimeout(None)
+        connected = True
+        client_sock = accept_session(client_sock, SESSION_KEY_FILE)  # Authenticate before any command
+        if authorised or isinstance(client_sock, SecureSession):
+            remember_device(address[0], port)  # Not any device that merely opened a connection
+        leds.on(LED_BLUE)
 
         # Continue handling client communication as above
         while True:
             recvdata = client_sock.recv(1024).decode('utf-8').strip()
-            print("Received command:", recvdata)
+            log.debug("rfcomm", "Received command: %s", recvdata)
 
             if recvdata == "Q" or recvdata == "socket close":
                 print("Ending connection.")
@@ -589,19 +1168,56 @@ def start_rfcomm_server_with_new_port(port):
                 a_id, contact_name, contact_number = contact_info.split(",", 2)
                 
                 # Call the function with all three arguments
-                add_contact_to_database(int(a_id.strip()), contact_name.strip(), contact_number.strip())
-                print(f"Contact '{contact_name.strip()}' with number '{contact_number.strip()}' and A_ID '{a_id.strip()}' saved to the database.")
+                db_writes.submit(add_contact_to_database, int(a_id.strip()), contact_name.strip(), contact_number.strip())
+                print(f"Contact '{contact_name.strip()}' with number '{contact_number.strip()}' and A_ID '{a_id.strip()}' queued for the database.")
                 continue
             
             if recvdata.startswith("set message:"):
                 # Example format: "set message:Hello, this is a test message"
                 _, message_text = recvdata.split(":", 1)
-                add_message_to_database(message_text.strip())
-                print(f"Message '{message_text.strip()}' saved to the database.")
+                db_writes.submit(add_message_to_database, message_text.strip())
+                print(f"Message '{message_text.strip()}' queued for the database.")
                 continue
             
+            if recvdata.startswith("op:"):
+                # Example format: "op:log 50" (see remote_ops for the operations)
+                remote_ops.execute(recvdata[3:], client_sock.send)
+                continue
+
+            if recvdata == "reload config":
+                # Re-read the configuration file; the reply says whether it was applied
+                client_sock.send(reload_config().encode('utf-8'))
+                continue
+
+            if recvdata.startswith("search contacts:"):
+                # Example format: "search contacts:20,,Ana" (page size, cursor of the previous page, prefix)
+                send_contact_page(client_sock, recvdata)
+                continue
+
+            if recvdata == "backup":
+                # Stream a snapshot of contacts.db in checksummed chunks
+                send_database_backup(client_sock)
+                continue
+
+            if recvdata.startswith("restore:"):
+                # Example format: "restore:<size>,<sha256>", followed by the chunks of a backup
+                if not restore_database(client_sock, recvdata):
+                    break  # Unread chunk bytes would be taken for commands
+                continue
+
+            if recvdata.startswith("profile export:"):
+                # Example format: "profile export:profile-20240101-120000.folded" (empty for the newest)
+                send_profile_export(client_sock, recvdata)
+                continue
+
+            if recvdata.startswith("track export:"):
+                # Example format: "track export:1700000000,1700003600" (either bound may be empty)
+                send_track_export(client_sock, recvdata)
+                continue
+
             if recvdata == "sync data":
                 # Retrieve all contacts and messages and send them to the Android app
+                db_writes.flush()  # Include the changes this client just sent
                 contacts = retrieve_all_contacts_with_id()
                 messages = retrieve_all_messages_with_id()
                 sync_data = {'contacts': contacts, 'messages': messages}
@@ -612,39 +1228,48 @@ def start_rfcomm_server_with_new_port(port):
             if recvdata.startswith("delete contact:"):
                 # Example format: "delete contact:1234567890"
                 _, contact_number = recvdata.split(":", 1)
-                delete_contact_from_database(contact_number.strip())
-                print(f"Contact with number '{contact_number.strip()}' deleted.")
+                db_writes.submit(delete_contact_from_database, contact_number.strip())
+                print(f"Contact with number '{contact_number.strip()}' queued for deletion.")
                 continue
 
-            if recvdata.startswith("update message:"):
-                # Example format: "update message:1,New Message Text"
-                _, message_info = recvdata.split(":", 1)
-                message_id, new_message_text = message_info.split(",", 1)
-                update_message_in_database(message_id.strip(), new_message_text.strip())
-                print(f"Message with ID '{message_id.strip()}' updated to '{new_message_text.strip()}'.")
+            if recvdata.startswith("set priority:"):
+                set_priority_command(client_sock, recvdata)
+                continue
+
+            # "update message:1,New text", "disable message:1", "move message:1,3",
+            # "contact message:+639171234567,Text for this contact only", ...
+            if handle_message_verb(recvdata, client_sock.send):
                 continue
 
             print(f"Unknown command received: {recvdata}")  # Log unknown commands
             client_sock.send(f"Unknown command: {recvdata}".encode('utf-8'))
 
     except bluetooth.BluetoothError as e:
+        if not connected and "timed out" in str(e):
+            print(f"No connection within {accept_timeout} seconds.")
+            return False
         print("Bluetooth error occurred:", e)
+    except OSError as e:
+        print("OS error occurred:", e)
     finally:
         if 'client_sock' in locals():
             client_sock.close()
         if 'server_sock' in locals():
             server_sock.close()
         print("Sockets closed.")
+    return connected
 
 def turn_on_a9g():
     print("Turning on A9G module...")
     GPIO.output(A9G_POWER_PIN, GPIO.HIGH)  # Set the pin high to turn on the A9G module
-    time.sleep(10)  # Keep it on for 2 seconds (adjust as needed)
+    time.sleep(A9G_POWER_ON_DELAY)  # Give the module time to boot
     
     if check_module_ready():  # Check if the A9G module is ready
         print("A9G module is ready.")
-        GPIO.output(LED_PIN, GPIO.LOW)
-        GPIO.output(LED_BLUE, GPIO.HIGH)
+        power.set_state("modem", IDLE)
+        start_inbound_sms()
+        leds.off(LED_PIN)
+        leds.on(LED_BLUE)
     else:
         GPIO.output(A9G_POWER_PIN, GPIO.LOW)
         print("A9G module is not ready. Please check the connection.")
@@ -652,8 +1277,8 @@ def turn_on_a9g():
 def turn_off_a9g():
     """Check A9G responsiveness with AT command, then power it off if responsive."""
     # Set initial LED states
-    GPIO.output(LED_PIN, GPIO.HIGH)   # Turn on green LED
-    GPIO.output(LED_BLUE, GPIO.LOW)   # Turn off blue LED
+    leds.on(LED_PIN)  # Turn on green LED
+    leds.off(LED_BLUE)  # Turn off blue LED
     
     # Step 1: Send initial AT command to check for response
     response = send_command('AT')
@@ -662,6 +1287,7 @@ def turn_off_a9g():
     # Step 2: Check if response is as expected
     if 'OK' in response:
         print("A9G module is responsive. Proceeding with power-off command.")
+        stop_inbound_sms()
         
         # Step 3: Send the power-off command
         power_off_response = send_command('AT+RST=2')
@@ -670,13 +1296,15 @@ def turn_off_a9g():
         # Optional: Control GPIO pin to ensure power is off
         GPIO.output(A9G_POWER_PIN, GPIO.LOW)
         print("A9G module powered off via AT command and GPIO.")
+        power.set_state("modem", OFF)
+        power.set_state("gps", OFF)
         
         # Delay to allow for complete power-off
         time.sleep(2)
         
         # Update LED state to indicate completion
-        GPIO.output(LED_PIN, GPIO.LOW)   # Turn off green LED
-        GPIO.output(LED_BLUE, GPIO.HIGH) # Turn on blue LED to indicate module is powered off
+        leds.off(LED_PIN)  # Turn off green LED
+        leds.on(LED_BLUE)  # Turn on blue LED to indicate module is powered off
         
     else:
         print("A9G module is not responding. Unable to power off.")
@@ -685,15 +1313,11 @@ def turn_off_a9g():
     
 def send_command(command):
     """Send a command to the A9G module and return the response."""
-    ser.write((command + '\r\n').encode())
-    time.sleep(1)  # Wait for the response
-    response = ser.readlines()
+    response = get_modem().command(command, timeout=AT_COMMAND_TIMEOUT)
     
-    # Print raw byte data for debugging
-    print("Raw Response:", response)  
+    log.debug("modem", "Raw Response: %s", response)
     
-    # Decode response and ignore decoding errors
-    return [line.decode('utf-8', errors='ignore').strip() for line in response]
+    return response
 
 def check_module_ready():
     """Check if the A9G module is ready by sending the AT command."""
@@ -701,162 +1325,557 @@ def check_module_ready():
     print("AT Command Response:", response)
     return any("OK" in line for line in response)
        
-def detect_button_presses():
-    """Detect button presses and handle actions."""
-    global green_led_thread  # Make green_led_thread a global variable
-    while True:
+def start_sos():
+    """Blink the green LED and run the SOS flow.
+
+    Returns after the first SMS pass; the retries, calls and tracking window go
+    on in the background. A press during an alert ends the old one and starts anew.
+    """
+    global sos_alert
+    leds.blink(LED_PIN)
+    db_writes.flush()  # Contacts and messages sent just before the press count
+    with sos_lock:
+        sos_alert += 1
+    previous = sos_finisher
+    if previous is not None and previous.is_alive():
+        stop_sos_alert()
+        previous.join()  # Ends quickly once stopped; it leaves the A9G on for this alert
+    with power.active():  # No sleep or GPS duty cycling during the alert
+        get_gps_location()  # Call the function to fetch GPS data
+
+def detect_button_presses(on_bluetooth=None, on_long_press=None, on_short_press=None, stop_event=None):
+    """Detect button presses and handle actions.
+
+    The actions run inline by default; the daemon passes handlers that hand
+    them to its subsystems instead, and a stop_event to end the loop.
+    """
+    on_bluetooth = on_bluetooth or manage_bluetooth_connection
+    on_long_press = on_long_press or start_sos
+    on_short_press = on_short_press or turn_on_a9g
+
+    while stop_event is None or not stop_event.is_set():
         # Check for button press on BUTTON_PIN_1
         if GPIO.input(BUTTON_PIN_1) == GPIO.LOW:
             print("Initiating Bluetooth connection...")
-            GPIO.output(LED_PIN, GPIO.HIGH)  # Turn on green LED (steady)
-            manage_bluetooth_connection()  # Your Bluetooth handling function
+            leds.on(LED_PIN)  # Turn on green LED (steady)
+            on_bluetooth()  # Your Bluetooth handling function
+            while GPIO.input(BUTTON_PIN_1) == GPIO.LOW:
+                time.sleep(BUTTON_POLL_INTERVAL)  # One press, one action
 
         # Check for button press on BUTTON_PIN_2
         if GPIO.input(BUTTON_PIN_2) == GPIO.LOW:
             press_start_time = time.time()  # Record the start time of the press
-            GPIO.output(LED_PIN, GPIO.HIGH)  # Turn on green LED (steady)
+            leds.on(LED_PIN)  # Turn on green LED (steady)
             while GPIO.input(BUTTON_PIN_2) == GPIO.LOW:
-                time.sleep(0.1)  # Debounce delay while button is pressed
+                time.sleep(BUTTON_POLL_INTERVAL)  # Debounce delay while button is pressed
 
             press_duration = time.time() - press_start_time  # Calculate press duration
 
-            # Check if it was a long press (3 seconds)
-            if press_duration >= 3:
+            # Check if it was a long press
+            if press_duration >= LONG_PRESS_SECONDS:
                 print("Long press detected. Fetching GPS data...")
-                GPIO.output(LED_PIN, GPIO.LOW)  # Start blinking (set to low initially)
-                stop_event.clear()  # Clear stop event to allow blinking
-                green_led_thread = threading.Thread(target=green_led_blink)
-                green_led_thread.start()  # Start blinking thread
-                get_gps_location()  # Call the function to fetch GPS data
+                on_long_press()
             else:
                 print("Short press detected. Turning on A9G module...")
-                turn_on_a9g()  # Call to turn on A9G and check readiness
+                on_short_press()  # Call to turn on A9G and check readiness
             
             time.sleep(1)  # Delay to avoid multiple triggers
 
-        time.sleep(0.1)  # Small delay to prevent CPU overload
+        time.sleep(BUTTON_POLL_INTERVAL)  # Small delay to prevent CPU overload
         
         
         
-def green_led_blink():
-    """Blink the Green LED indefinitely until stopped."""
-    while not stop_event.is_set():
-        GPIO.output(LED_PIN, GPIO.HIGH)  # Turn on Green LED
-        time.sleep(0.5)                  # Blink interval
-        GPIO.output(LED_PIN, GPIO.LOW)   # Turn off Green LED
-        time.sleep(0.5)
+def read_gps_fix():
+    """Ask the A9G for one fix with AT+LOCATION=2; return (latitude, longitude) or None."""
+    print("Attempting to fetch GPS location...")
 
-def get_gps_location():
-    """Fetch GPS location data from the A9G module using AT+LOCATION=2."""
-    global green_led_thread  # Ensure access to green_led_thread
-    while True:
-        print("Attempting to fetch GPS location...")
+    # Enable GPS if it's not enabled
+    gps_enable_response = send_command('AT+GPS=1')  # Ensure GPS is enabled
+    print("GPS Activation Response:", gps_enable_response)
 
-        # Enable GPS if it's not enabled
-        gps_enable_response = send_command('AT+GPS=1')  # Ensure GPS is enabled
-        print("GPS Activation Response:", gps_enable_response)
+    # Request GPS data for 5 seconds
+    gps_read_response = send_command('AT+GPSRD=5')
+    print("GPS Read Response:", gps_read_response)
 
-        # Request GPS data for 5 seconds
-        gps_read_response = send_command('AT+GPSRD=5')
-        print("GPS Read Response:", gps_read_response)
+    # Wait for a moment to ensure data is ready
+    time.sleep(GPS_FIX_WAIT)  # Allow the GPS to gather data
 
-        # Wait for a moment to ensure data is ready
-        time.sleep(6)  # Wait for 5 seconds to allow GPS to gather data
+    # Now request GPS location
+    response = send_command('AT+LOCATION=2')
+    print("GPS Location Response:", response)
 
-        # Now request GPS location
-        response = send_command('AT+LOCATION=2')
-        print("GPS Location Response:", response)
+    latitude, longitude = None, None
 
-        latitude, longitude = None, None
+    # Check for the expected response format
+    for line in response:
+        if "OK" not in line and line:  # Exclude the OK line
+            try:
+                latitude, longitude = map(float, line.split(','))
+                print(f"Latitude: {latitude}, Longitude: {longitude}")
+                break  # Exit once valid data is found
+            except ValueError:
+                print(f"Failed to parse GPS data: {line}")
+
+    # Stop GPS reading, or hand the reports back to a running tracker at its own interval
+    tracker = sos_tracker
+    interval = tracker.interval if tracker is not None and tracker.running() else 0
+    gps_read_response = send_command(f'AT+GPSRD={interval}')
+    print("GPS Read Response After Location Request:", gps_read_response)
+
+    if latitude is None or longitude is None:
+        return None
+
+    # Log the fix to the track file
+    if track_store is not None:
+        track_store.append(time.time(), latitude, longitude)
+    return latitude, longitude
 
-        # Check for the expected response format
-        for line in response:
-            if "OK" not in line and line:  # Exclude the OK line
-                try:
-                    latitude, longitude = map(float, line.split(','))
-                    print(f"Latitude: {latitude}, Longitude: {longitude}")
-                    break  # Exit once valid data is found
-                except ValueError:
-                    print(f"Failed to parse GPS data: {line}")
+def get_gps_location():
+    """Fetch GPS location data from the A9G module using AT+LOCATION=2."""
+    while True:
+        fix = read_gps_fix()
 
         # Check if valid GPS data was found
-        if latitude is not None and longitude is not None:
-            # Stop GPS reading after getting the location
-            gps_read_response = send_command('AT+GPSRD=0')
-            print("GPS Read Response After Location Request:", gps_read_response)
+        if fix is not None:
+            latitude, longitude = fix
+
+            # Stop green LED blinking
+            leds.off(LED_PIN)
 
-            # Stop green LED blinking by setting the stop event
-            stop_event.set()
-            green_led_thread.join()  # Ensure the thread finishes
+            # Now turn on the Blue LED for 10 seconds, without holding up the SMS
+            leds.on(LED_BLUE)  # Turn on Blue LED
+            threading.Timer(10, leds.off, (LED_BLUE,)).start()
 
-            # Now turn on the Blue LED for 10 seconds
-            GPIO.output(LED_BLUE, GPIO.HIGH)  # Turn on Blue LED
-            time.sleep(10)                   # Keep Blue LED on for 10 seconds
-            GPIO.output(LED_BLUE, GPIO.LOW)   # Turn off Blue LED
+            # Post the fix over GPRS alongside the SMS
+            start_location_upload(latitude, longitude)
 
             # Send SMS with retrieved messages and GPS coordinates
             send_sms_to_all_contacts(latitude, longitude)  # Send SMS after getting location
             return latitude, longitude  # Return valid data
         else:
             print("No valid GPS data found. Retrying...")
-            time.sleep(2)  # Wait before retrying
+            time.sleep(GPS_RETRY_DELAY)  # Wait before retrying
 
 
 def send_sms_to_all_contacts(latitude, longitude):
-    """Send all saved messages from the database and then the GPS coordinates to all contacts."""
-    contact_numbers = list_all_contacts()  # Retrieve all contact numbers from the database
-    messages = retrieve_all_messages()  # Retrieve all saved messages from the database
-    
-    if not contact_numbers:
+    """Send the GPS coordinates and all saved messages to all contacts.
+
+    Contacts are alerted in priority order. With SOS_SCHEDULE_MODE set to
+    "location_first" every contact receives the location before anyone gets the
+    supplementary messages, so the last contact waits len(contacts) sends for a
+    useful SMS instead of (contacts - 1) * (messages + 1).
+
+    Recipients and message bodies come from the cached SOS plan, so this path
+    does no database reads and only encodes the coordinates. Once every SMS has
+    been attempted, the top-priority contacts are called while failed SMS are
+    retried. The SMS are spread over the modem pool (see modem_pool).
+    """
+    warmup_done.wait()  # A press right after boot waits for the database here
+    plan = get_sos_plan()
+
+    if not plan.recipients:
         print("No contacts to send SMS.")
         return
 
-    if not messages:
-        print("No messages to send.")
+    if not plan.messages and not plan.contact_messages:
+        print("No messages to send. Sending GPS coordinates only.")
+
+    # Text mode and a signal reading on every modem once for the whole fan-out
+    pool = get_modem_pool()
+    pool.prepare()
+    timeouts = {"prompt_timeout": SMS_PROMPT_TIMEOUT, "send_timeout": SMS_SEND_TIMEOUT}
+    failed = pool.dispatch(plan.sends(latitude, longitude), **timeouts)
+
+    # Follow-up positions for the tracking window
+    tracker = None
+    global sos_tracker, sos_escalation, sos_stopped, sos_finisher, last_tracking_sms
+    sos_stopped = stopped = threading.Event()
+    last_tracking_sms = (time.time(), latitude, longitude)
+    if SOS_TRACKING_DURATION > 0:
+        tracker = sos_tracker = LocationTracker(get_modem(), send_tracking_batch, duration=SOS_TRACKING_DURATION,
+                                  on_fix=record_fix).start()
+
+    # Call the top-priority contacts while any failed SMS are retried
+    escalation = None
+    if VOICE_ESCALATION_CONTACTS > 0:
+        escalation = sos_escalation = CallEscalation(get_modem(), plan.recipients[:VOICE_ESCALATION_CONTACTS]).start()
+
+    # The rest of the alert must not hold up the button loop (or the daemon's
+    # modem queue): it keeps the modem and GPS at full power on a thread of its own
+    alert_hold = ExitStack()
+    alert_hold.enter_context(power.active())
+    sos_finisher = threading.Thread(target=finish_sos_alert, name="sos-alert",
+                                    args=(sos_alert, pool, failed, timeouts, tracker, escalation, stopped, alert_hold),
+                                    daemon=True)
+    sos_finisher.start()
+
+def finish_sos_alert(alert, pool, failed, timeouts, tracker, escalation, stopped, alert_hold):
+    """Retry the failed SMS, wait for the calls and the tracking window, then power the A9G down."""
+    global sos_tracker, sos_escalation
+    try:
+        for retry_round in range(SMS_RETRY_ROUNDS):
+            if not failed or stopped.is_set():
+                break
+            print(f"Retrying {len(failed)} failed SMS (round {retry_round + 1})...")
+            pool.prepare()  # Modems that failed get another chance
+            failed = pool.dispatch(failed, **timeouts)
+
+        for contact, _, _ in failed:
+            print(f"Giving up on SMS to {contact}.")
+
+        if escalation is not None:
+            escalation.join()  # Keep the module powered until the calls are done
+        if tracker is not None:
+            tracker.join()  # Keep the module powered for the tracking window (or until STOP)
+    finally:
+        with sos_lock:
+            if alert == sos_alert:  # No newer press is using the module
+                sos_tracker = sos_escalation = None
+                stop_location_upload()  # Post the remaining fixes before the module goes down
+                turn_off_a9g()
+                print("All messages sent. A9G module turned off.")
+            alert_hold.close()
+
+def send_tracking_batch(fixes):
+    """Send a batch of tracking fixes: over GPRS when uploading, else the latest fix by SMS.
+
+    An SMS only goes out TRACKING_SMS_INTERVAL after the previous position sent,
+    and only if the unit moved DISTANCE_THRESHOLD metres since.
+    """
+    if location_upload is not None:
+        for fix in fixes:
+            location_upload.add_fix(fix.latitude, fix.longitude, fix.timestamp)
         return
 
-    # Format for Google Maps URL
-    google_maps_url = f"{latitude},{longitude}"
-
-    # Send each message to each contact number
-    for contact in contact_numbers:
-        # Send each retrieved message
-        for message in messages:
-            print(f"Sending SMS to {contact}: {message}...")
-            send_sms(latitude, longitude, contact, message)  # Send each message to the contact
-            time.sleep(1)  # Delay to avoid overwhelming the module
+    global last_tracking_sms
+    latest = fixes[-1]
+    if last_tracking_sms is not None:
+        sent_at, latitude, longitude = last_tracking_sms
+        if (time.time() - sent_at < TRACKING_SMS_INTERVAL
+                or haversine_distance(latitude, longitude, latest.latitude, latest.longitude) < DISTANCE_THRESHOLD):
+            return  # Too soon, or the contacts already have this position
+    last_tracking_sms = (time.time(), latest.latitude, latest.longitude)
+
+    plan = get_sos_plan()
+    print(f"Sending tracking update to all contacts: {latest.latitude},{latest.longitude}")
+    location = plan.location_payload(latest.latitude, latest.longitude)
+    for contact in plan.recipients:
+        for body in location:
+            send_sms_payload(plan.cmgs_commands[contact], body)
+
+def start_location_upload(latitude, longitude):
+    """Start posting fixes over GPRS for the current alert, if an endpoint is configured."""
+    global location_upload
+    if not LOCATION_UPLOAD_URL:
+        return None
+    if location_upload is None:
+        location_upload = LocationUploader(get_modem(), LOCATION_UPLOAD_URL).start()
+    location_upload.add_fix(latitude, longitude)
+    return location_upload
+
+def stop_location_upload():
+    """Flush the remaining fixes of the current alert and detach from GPRS."""
+    global location_upload
+    if location_upload is not None:
+        location_upload.stop()
+        print(f"Location upload finished: {location_upload.posted} fixes posted.")
+        location_upload = None
+
+def stop_sos_alert():
+    """End the tracking, calls and SMS retries of the alert in progress; False if there is none."""
+    tracker, escalation = sos_tracker, sos_escalation
+    if tracker is None and escalation is None:
+        return False
+    sos_stopped.set()
+    if escalation is not None:
+        escalation.cancel()
+    if tracker is not None:
+        tracker.stop()
+    print("SOS alert stopped.")
+    return True
+
+def send_text_sms(number, text):
+    """Send text to one number; return True if every segment went out."""
+    command = encode_cmgs_command(number)
+    return all([send_sms_payload(command, encode_sms_body(segment)) for segment in split_sms_segments(text)])
+
+def locate_command(sender):
+    """SMS "LOCATE": reply with the current fix."""
+    tracker = sos_tracker
+    latest = tracker.ring.latest() if tracker is not None and tracker.running() else None
+    if latest is not None:
+        # Tracking owns the GPS reports: answer from its newest kept fix
+        return send_text_sms(sender, f"{latest.latitude},{latest.longitude}")
+
+    fix = None
+    with power.active():
+        for attempt in range(LOCATE_ATTEMPTS):
+            if attempt:
+                time.sleep(GPS_RETRY_DELAY)
+            fix = read_gps_fix()
+            if fix is not None:
+                break
+    return send_text_sms(sender, f"{fix[0]},{fix[1]}" if fix is not None else "NO GPS FIX")
+
+def stop_command(sender):
+    """SMS "STOP": end the alert in progress."""
+    return send_text_sms(sender, "SOS STOPPED" if stop_sos_alert() else "NO ACTIVE SOS")
+
+def sms_command_senders():
+    """Numbers allowed to send SMS commands: every contact, or nobody with SMS_COMMANDS off."""
+    db_writes.flush()
+    return list_all_contacts() if SMS_COMMANDS else []
+
+def start_inbound_sms():
+    """Start reading received SMS from the A9G, or restart a reader that died."""
+    global inbound_sms
+    if inbound_sms is not None and not inbound_sms.is_running():
+        print("Inbound SMS reader had stopped; restarting it.")
+        inbound_sms.stop()
+        inbound_sms = None
+    if inbound_sms is None:
+        inbound_sms = InboundSms(get_modem(), database, sms_command_senders,
+                                 {"LOCATE": locate_command, "STOP": stop_command},
+                                 modem_hold=lambda: power.hold("modem", ACTIVE, after=IDLE),
+                                 ready=warmup_done).start()
+
+def stop_inbound_sms():
+    """Stop reading received SMS (the A9G is going down)."""
+    global inbound_sms
+    if inbound_sms is not None:
+        inbound_sms.stop()
+        inbound_sms = None
+
+def rebuild_sos_plan():
+    """Rebuild the cached SOS plan from the contacts and messages tables."""
+    global sos_plan
+    messages, contact_messages = message_store.sos_messages()
+    sos_plan = SosPlan(list_all_contacts(), messages, SOS_SCHEDULE_MODE, contact_messages)
+    print(f"SOS plan rebuilt: {len(sos_plan.recipients)} contacts, {len(sos_plan)} messages scheduled.")
+    orphaned = sorted(set(contact_messages) - set(sos_plan.recipients))
+    if orphaned:
+        print(f"Message templates for numbers that are not contacts are not sent: {', '.join(orphaned)}")
+    return sos_plan
+
+def get_sos_plan():
+    """Return the cached SOS plan, building it if it has not been built yet."""
+    return sos_plan if sos_plan is not None else rebuild_sos_plan()
+
+# Contact and message changes from RFCOMM are queued here and written in grouped
+# transactions (see write_behind); each batch rebuilds the SOS plan once
+db_writes = WriteBehind(one_transaction, on_flush=rebuild_sos_plan)
+
+
+# Settings from the configuration file; loaded by main() and on reload
+config = ConfigManager(sys.modules[__name__])
+
+def reload_config():
+    """Load the configuration file and apply it; return a one-line result."""
+    try:
+        changed = config.load()
+    except ValueError as e:
+        print(f"Configuration not applied: {e}")
+        return f"CONFIG ERROR {e}"
+    print(f"Configuration loaded from {config.path}: {', '.join(changed) or 'no changes'}")
+    return f"CONFIG OK {len(changed)} changed"
+
+PIN_SETTINGS = ("BUTTON_PIN_1", "BUTTON_PIN_2", "LED_PIN", "LED_BLUE", "A9G_POWER_PIN")
+
+def apply_config_changes(changed):
+    """Bring the running device in line with changed settings."""
+    pins = [old for name, old in changed.items() if name in PIN_SETTINGS]
+    if pins and GPIO.getmode() is not None:
+        # LEDs keep their pattern on their new pins
+        patterns = {name: leds.forget(changed[name]) if name in changed else leds.pattern(globals()[name])
+                    for name in ("LED_PIN", "LED_BLUE")}
+        GPIO.cleanup(pins)  # Release the old pins before the new ones are set up
+        setup_gpio()
+        for name, pattern in patterns.items():
+            leds.set(globals()[name], pattern)
+    if "SOS_SCHEDULE_MODE" in changed and warmup_done.is_set():
+        rebuild_sos_plan()
+    if "MODEM_BACKEND" in changed:
+        print("The modem backend changes when the device restarts.")  # Engines in use are kept
+    if any(name.startswith("LOG_") for name in changed):
+        configure_log()
+    if "PROFILING" in changed:
+        if PROFILING:
+            start_profiling()
+        else:
+            stop_profiling()
+    if "SMS_MODEMS" in changed:
+        stop_modem_pool()  # Reopened with the new devices on the next SMS
+    if "TRUSTED_DEVICES_FILE" in changed:
+        global trusted_devices
+        with trusted_devices_lock:
+            trusted_devices = None  # Reopened from the new file on next use
 
-        # After sending all messages, send the GPS coordinates
-        print(f"Sending GPS coordinates to {contact}: {google_maps_url}...")
-        send_sms(latitude, longitude, contact, google_maps_url)  # Send Google Maps link to the contact
-        time.sleep(1)  # Delay to avoid overwhelming the module
+config.add_listener(apply_config_changes)
 
-    # Turn off A9G module after sending the final message
-    turn_off_a9g()
-    print("All messages sent. A9G module turned off.")
+reload_requested = threading.Event()
 
+def reload_on_request():
+    """Reload the configuration each time reload_requested is set (by SIGHUP)."""
+    while True:
+        reload_requested.wait()
+        reload_requested.clear()
+        try:
+            reload_config()  # Prints its result
+        except Exception as e:
+            print(f"Configuration reload failed: {e}")
+
+def configure_log():
+    """Apply the LOG_* settings to the device log."""
+    log.configure(level=LOG_LEVEL, path=LOG_FILE or "", max_bytes=LOG_MAX_KB * 1024, backups=LOG_BACKUPS,
+                  console=LOG_CONSOLE)
+
+def device_status():
+    """Return the device lines of the "status" remote operation."""
+    plan = sos_plan
+    return [
+        f"modem: {'running' if modem is not None and modem.is_running() else 'not started'}",
+        *(f"sms modem {line}" for line in (modem_pool.status() if modem_pool is not None else [])),
+        f"warm-up: {'done' if warmup_done.is_set() else 'in progress'}",
+        f"sos plan: {len(plan.recipients) if plan is not None else 0} contacts",
+        f"track records: {len(track_store) if track_store is not None else 0}",
+        f"config: {config.path}",
+    ]
 
+# Duty-cycles the modem, GPS and Bluetooth by POWER_POLICY; its run() loop applies the policy
+power = PowerManager(sys.modules[__name__])
+
+def power_operation(arguments, reply, timeout):
+    """The "power" remote operation: states, current draw and standby estimate."""
+    for line in power.report(BATTERY_CAPACITY_MAH):
+        reply.line(line)
+    return "EXIT 0"
+
+def devices_operation(arguments, reply, timeout):
+    """The "devices" remote operation: phones that can reconnect without pairing."""
+    for address, device in get_trusted_devices().items():
+        seen = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(device["last_seen"]))
+        reply.line(f"{address} channel {device['channel']}, last seen {seen}, {device['connections']} connections")
+    return "EXIT 0"
+
+def forget_device_operation(arguments, reply, timeout):
+    """The "devices forget" remote operation: the phone has to pair again."""
+    if len(arguments) != 1:
+        raise ValueError("usage: devices forget <address>")
+    if not get_trusted_devices().forget(arguments[0]):
+        raise ValueError(f"{arguments[0]} is not a trusted device")
+    reply.line(f"{arguments[0]} forgotten")
+    return "EXIT 0"
+
+def inbox_operation(arguments, reply, timeout):
+    """The "inbox" remote operation: the latest received SMS."""
+    limit = int(arguments[0]) if arguments and arguments[0].isdigit() else 20
+    with database() as conn:
+        messages = recent_messages(conn, limit)
+    for received_at, sender, command, status, body in messages:
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(received_at))
+        reply.line(f"{when} {sender} [{command or '-'} {status}] {body}")
+    return "EXIT 0"
+
+def profile_operation(arguments, reply, timeout):
+    """The "profile" remote operation: state of the profiler and its hottest stacks."""
+    if profiler is None:
+        reply.line("profiler: never started")
+        return "EXIT 0"
+    reply.line(f"profiler: {'running' if profiler.running() else 'stopped'}")
+    for line in profiler.report():
+        reply.line(line)
+    return "EXIT 0"
+
+def profile_start_operation(arguments, reply, timeout):
+    """The "profile start" remote operation: sample for [seconds] (default 60)."""
+    seconds = int(arguments[0]) if arguments and arguments[0].isdigit() else 60
+    start_profiling(seconds)
+    reply.line(f"profiling for {seconds} s; fetch it with 'profile export:'")
+    return "EXIT 0"
+
+def profile_stop_operation(arguments, reply, timeout):
+    """The "profile stop" remote operation: stop now and save the profile."""
+    path = stop_profiling()
+    reply.line(f"saved {path}" if path else "profiler not running")
+    return "EXIT 0"
+
+def profile_list_operation(arguments, reply, timeout):
+    """The "profile list" remote operation: saved profiles, newest first."""
+    for name in list_profiles(PROFILE_DIR):
+        reply.line(f"{name} {os.path.getsize(os.path.join(PROFILE_DIR, name))} bytes")
+    return "EXIT 0"
+
+def log_recent_operation(arguments, reply, timeout):
+    """The "log recent" remote operation: [lines] [level] [source] from the in-memory log."""
+    lines = int(arguments[0]) if arguments and arguments[0].isdigit() else 100
+    level = arguments[1].lower() if len(arguments) > 1 else "debug"
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+    for line in log.recent(lines, LEVELS[level], arguments[2] if len(arguments) > 2 else None):
+        reply.line(line)
+    if log.dropped:
+        reply.line(f"({log.dropped} records were dropped before they were written)")
+    return "EXIT 0"
+
+# Operations an RFCOMM client may run with "op:<operation> [arguments]"
+remote_ops = default_operations(config=config, status=device_status)
+remote_ops.register("power", power_operation, "power states, current draw and standby estimate")
+remote_ops.register("inbox", inbox_operation, "[count] latest received SMS")
+remote_ops.register("devices", devices_operation, "phones that reconnect without pairing")
+remote_ops.register("devices forget", forget_device_operation, "address  make a phone pair again")
+remote_ops.register("log recent", log_recent_operation, "[lines] [level] [source]  in-memory log")
+remote_ops.register("profile", profile_operation, "profiler state and hottest functions")
+remote_ops.register("profile start", profile_start_operation, "[seconds]  sample every thread's stack")
+remote_ops.register("profile stop", profile_stop_operation, "stop sampling and save the profile")
+remote_ops.register("profile list", profile_list_operation, "saved profiles (fetch with 'profile export:')")
+
+def warm_up():
+    """Prepare the database, track file and SOS plan off the button path."""
+    try:
+        with startup.phase("database"):
+            create_database()  # Ensure the database is set up before it is used
+        with startup.phase("sos plan"):
+            rebuild_sos_plan()  # Prepare the SOS payload before the first button press
+    finally:
+        warmup_done.set()
+        startup.report()
 
 def main():
     """Main function to initialize the button detection."""
+    startup.mark("imports")
+    reload_config()  # Pins and timeouts must be known before GPIO is set up
+    configure_log()
+    log.capture_stdout()  # print() output goes through the log's writer thread from here on
+    # SIGHUP only sets an event: reloading inside the handler could deadlock on a lock
+    # (the LED controller's) the interrupted main thread already holds
+    threading.Thread(target=reload_on_request, name="config-reload", daemon=True).start()
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.set())
     try:
         GPIO.setwarnings(False)  # Disable warnings
         GPIO.cleanup()           # Clean up GPIO settings
         setup_gpio()             # Set up GPIO pins
-        print("System is ready, waiting for button press...")
 
-        # Create a stop event for the blinking LED
-        global stop_event
-        stop_event = threading.Event()
-        
-        GPIO.output(LED_PIN, GPIO.HIGH) 
-        GPIO.output(LED_BLUE, GPIO.LOW) 
+        # One thread renders every LED pattern
+        threading.Thread(target=leds.run, args=(threading.Event(),), name="leds", daemon=True).start()
+        threading.Thread(target=power.run, args=(threading.Event(),), name="power", daemon=True).start()
+
+        leds.on(LED_PIN)
+        leds.off(LED_BLUE)
+        startup.mark("gpio")
+        print(f"System is ready, waiting for button press... ({startup.elapsed():.2f} s after start)")
+
+        # Everything else is prepared in the background while buttons are already polled
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
         detect_button_presses()  # Start detecting button presses
     except KeyboardInterrupt:
         print("Program stopped by user.")
     finally:
+        db_writes.stop()  # Write the queued contact and message changes
+        stop_profiling()  # Keep a profile that was running
+        log.close()  # Write what is still queued
+        if track_store is not None:
+            track_store.flush()  # Make sure the track reaches the SD card
         GPIO.cleanup()  # Clean up GPIO settings
 
 if __name__ == "__main__":
-    create_database()  # Ensure the database is set up before running
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,210 @@
+"""Backup and restore of contacts.db over RFCOMM.
+
+The only way to move the contacts and messages to another device used to be
+replaying hundreds of "contact:" lines. A backup is an online, consistent
+snapshot taken with SQLite's backup API, BACKUP_PAGES pages per step, from a
+connection of its own: the shared connection and the SOS path (which only
+reads the cached SOS plan) are never held up by it, and a write during the
+copy makes SQLite restart the snapshot rather than produce a torn one.
+
+Both directions use the same framing, one header line per chunk followed by
+its raw bytes:
+
+    backup
+        <- BACKUP <size> <chunks> <sha256>\\n
+        <- CHUNK <index> <length> <crc32>\\n<length bytes>   (for every chunk)
+        <- \\nEND_OF_DATA
+
+    restore:<size>,<sha256>
+        <- READY <chunk size>\\n
+        -> CHUNK <index> <length> <crc32>\\n<length bytes>
+        <- ACK <index>\\n                                      (for every chunk)
+        <- RESTORED <contacts> contacts, <messages> messages\\nEND_OF_DATA
+
+A restore is written to a temporary file and checked (chunk CRCs, the SHA-256
+of the whole file, PRAGMA integrity_check, the contacts and messages tables)
+before it replaces anything; it is then copied into the live database with
+the backup API in one step. Any failure answers "ERROR <reason>\\nEND_OF_DATA"
+and leaves the database as it was.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import zlib
+
+CHUNK_SIZE = 16 * 1024      # Bytes per RFCOMM chunk
+BACKUP_PAGES = 64           # Database pages copied per backup step
+MAX_RESTORE_SIZE = 64 * 1024 * 1024
+REQUIRED_TABLES = ("contacts", "messages")
+
+
+class BackupError(Exception):
+    """A backup or restore could not be completed; the message is sent to the client."""
+
+
+class SocketReader:
+    """Line and fixed-size reads over a socket whose recv returns whatever arrived."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+
+    def _fill(self):
+        data = self.sock.recv(CHUNK_SIZE)
+        if not data:
+            raise BackupError("connection closed during transfer")
+        self.buffer += data
+
+    def read_line(self, limit=256):
+        while b"\n" not in self.buffer:
+            if len(self.buffer) > limit:
+                raise BackupError("header line too long")
+            self._fill()
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line.decode('utf-8', errors='replace').strip()
+
+    def read_exactly(self, size):
+        while len(self.buffer) < size:
+            self._fill()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def chunk_header(index, data):
+    return f"CHUNK {index} {len(data)} {zlib.crc32(data):08x}\n".encode('utf-8')
+
+
+def take_snapshot(db_file, target_path, pages=BACKUP_PAGES):
+    """Copy db_file into target_path with the backup API, pages at a time."""
+    source = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages)
+    finally:
+        target.close()
+        source.close()
+
+
+def send_backup(sock, db_file, chunk_size=CHUNK_SIZE):
+    """Stream a consistent snapshot of db_file to sock; return its size in bytes."""
+    handle, path = tempfile.mkstemp(prefix="contacts-backup-", suffix=".db")
+    os.close(handle)
+    try:
+        take_snapshot(db_file, path)
+        with open(path, "rb") as f:
+            snapshot = f.read()
+    finally:
+        os.remove(path)
+
+    chunks = [snapshot[start:start + chunk_size] for start in range(0, len(snapshot), chunk_size)]
+    sock.send(f"BACKUP {len(snapshot)} {len(chunks)} {hashlib.sha256(snapshot).hexdigest()}\n".encode('utf-8'))
+    for index, data in enumerate(chunks):
+        sock.sendall(chunk_header(index, data) + data)
+    sock.send("\nEND_OF_DATA".encode('utf-8'))
+    return len(snapshot)
+
+
+def receive_chunks(reader, sock, size, path):
+    """Read the chunks of a restore into path, acknowledging each; return the SHA-256 of the data."""
+    digest = hashlib.sha256()
+    received = 0
+    index = 0
+    with open(path, "wb") as f:
+        while received < size:
+            fields = reader.read_line().split()
+            if len(fields) != 4 or fields[0] != "CHUNK":
+                raise BackupError(f"expected a CHUNK header, got {' '.join(fields)!r}")
+            try:
+                chunk_index, length, crc = int(fields[1]), int(fields[2]), int(fields[3], 16)
+            except ValueError:
+                raise BackupError(f"malformed CHUNK header {' '.join(fields)!r}") from None
+            if chunk_index != index or not 0 < length <= CHUNK_SIZE or received + length > size:
+                raise BackupError(f"unexpected chunk {chunk_index} of {length} bytes")
+            data = reader.read_exactly(length)
+            if zlib.crc32(data) != crc:
+                raise BackupError(f"checksum mismatch in chunk {index}")
+            f.write(data)
+            digest.update(data)
+            received += length
+            sock.send(f"ACK {index}\n".encode('utf-8'))
+            index += 1
+    return digest.hexdigest()
+
+
+def check_database(path):
+    """Raise BackupError unless path is an intact database with the device's tables."""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        raise BackupError(f"not a database: {e}") from None
+    if result != "ok":
+        raise BackupError(f"integrity check failed: {result}")
+    missing = [table for table in REQUIRED_TABLES if table not in tables]
+    if missing:
+        raise BackupError(f"missing tables: {', '.join(missing)}")
+
+
+def send_error(sock, error):
+    """Tell the client why a restore failed, if the connection is still up."""
+    try:
+        sock.send(f"ERROR {error}\nEND_OF_DATA".encode('utf-8'))
+    except OSError:
+        pass
+
+
+def receive_restore(sock, recvdata, database, on_restored=None):
+    """Answer "restore:<size>,<sha256>": receive, verify and apply a database image.
+
+    database is the context manager of the live connection; on_restored is
+    called after the copy (schema upgrades, SOS plan). Returns the summary line.
+    """
+    reader = SocketReader(sock)
+    try:
+        _, arguments = recvdata.split(":", 1)
+        size, _, expected = arguments.partition(",")
+        try:
+            size = int(size)
+        except ValueError:
+            raise BackupError(f"bad size {size!r}") from None
+        if not 0 < size <= MAX_RESTORE_SIZE:
+            raise BackupError(f"size must be between 1 and {MAX_RESTORE_SIZE} bytes")
+
+        handle, path = tempfile.mkstemp(prefix="contacts-restore-", suffix=".db")
+        os.close(handle)
+        try:
+            sock.send(f"READY {CHUNK_SIZE}\n".encode('utf-8'))
+            if receive_chunks(reader, sock, size, path) != expected.strip().lower():
+                raise BackupError("SHA-256 of the restored file does not match")
+            check_database(path)
+
+            image = sqlite3.connect(path)
+            try:
+                with database() as conn:
+                    image.backup(conn)  # Replaces every page of the live database at once
+                    contacts = conn.execute('SELECT COUNT(*) FROM contacts').fetchone()[0]
+                    messages = conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+            finally:
+                image.close()
+        finally:
+            os.remove(path)
+    except BackupError as e:
+        send_error(sock, e)
+        raise
+    except (sqlite3.Error, OSError) as e:
+        # A full disk, a busy database or a dropped connection
+        error = BackupError(f"{type(e).__name__}: {e}")
+        send_error(sock, error)
+        raise error from e
+
+    if on_restored is not None:
+        on_restored()
+    summary = f"RESTORED {contacts} contacts, {messages} messages"
+    sock.send(f"{summary}\nEND_OF_DATA".encode('utf-8'))
+    return summary
@@ -0,0 +1,216 @@
+"""Ring-buffered structured logging.
+
+Everything used to print() straight to stdout, including "Raw Response:" for
+every AT exchange and "Output:" for every bluetoothctl line; on a slow serial
+console or a busy journald pipe the button, RFCOMM and modem loops waited for
+those writes. DeviceLog makes logging an append to memory:
+
+- a record (time, level, source, thread, message, arguments) is appended to
+  a ring of the last RING_SIZE records and to a queue for the writer;
+- the level check comes first, so a filtered-out debug call costs one
+  comparison and its arguments are never formatted;
+- a background writer formats the queued records and writes them to the
+  console and to LOG_FILE on the SD card, rotated at MAX_BYTES with BACKUPS
+  old files kept.
+
+The remaining print() calls reach the same path through capture_stdout(),
+as INFO records from source "stdout". The "log recent" remote operation reads
+the ring, so recent logs can be fetched over RFCOMM without the journal:
+
+    log.debug("modem", "Raw Response: %s", response)
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {value: name.upper() for name, value in LEVELS.items()}
+
+RING_SIZE = 2000              # Records kept in memory for "log recent"
+LOG_FILE = 'sosd.log'
+MAX_BYTES = 1024 * 1024       # Size at which LOG_FILE is rotated
+BACKUPS = 3                   # Rotated files kept (sosd.log.1 ... sosd.log.3)
+FLUSH_INTERVAL = 1.0          # Seconds the writer waits for more records before writing
+
+Record = collections.namedtuple("Record", "time level source thread message args")
+
+
+def format_record(record):
+    """Return a record as one line of text."""
+    message = record.message
+    if record.args:
+        try:
+            message = message % record.args
+        except (TypeError, ValueError):
+            message = f"{message} {record.args}"
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.time))
+    return (f"{stamp}.{int(record.time * 1000) % 1000:03d} {LEVEL_NAMES.get(record.level, record.level):<7} "
+            f"{record.source} [{record.thread}] {message}")
+
+
+class DeviceLog:
+    """Structured records in a ring buffer, written out by a background thread."""
+
+    def __init__(self, level=INFO, path=LOG_FILE, max_bytes=MAX_BYTES, backups=BACKUPS,
+                 console=True, ring_size=RING_SIZE):
+        self.level = level
+        self.path = path              # None: no log file
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.console = console        # Also write to the real stdout (journald)
+        self.ring = collections.deque(maxlen=ring_size)
+        self.dropped = 0              # Records lost because the writer fell behind
+        self._queue = collections.deque(maxlen=ring_size * 4)
+        self._wake = threading.Event()
+        self._file = None
+        self._writer = None
+        self._write_lock = threading.Lock()
+
+    # Logging
+
+    def log(self, level, source, message, *args):
+        if level < self.level:
+            return
+        record = Record(time.time(), level, source, threading.current_thread().name, message, args)
+        self.ring.append(record)
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(record)
+        if self._writer is None or not self._writer.is_alive():
+            self._start_writer()
+        if level >= WARNING or len(self._queue) >= self._queue.maxlen // 2:
+            self._wake.set()
+
+    def debug(self, source, message, *args):
+        self.log(DEBUG, source, message, *args)
+
+    def info(self, source, message, *args):
+        self.log(INFO, source, message, *args)
+
+    def warning(self, source, message, *args):
+        self.log(WARNING, source, message, *args)
+
+    def error(self, source, message, *args):
+        self.log(ERROR, source, message, *args)
+
+    def recent(self, count=100, level=DEBUG, source=None):
+        """Return the latest count records at level or above (of source, if given) as text lines."""
+        records = [record for record in list(self.ring)
+                   if record.level >= level and (source is None or record.source == source)]
+        return [format_record(record) for record in records[-count:]]
+
+    # Writing
+
+    def _start_writer(self):
+        with self._write_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write the queued records now."""
+        with self._write_lock:
+            lines = []
+            while self._queue:
+                lines.append(format_record(self._queue.popleft()) + "\n")
+            if not lines:
+                return
+            if self.console:
+                try:
+                    sys.__stdout__.write("".join(lines))
+                    sys.__stdout__.flush()
+                except (OSError, ValueError):
+                    pass
+            if self.path:
+                try:
+                    self._write_file(lines)
+                except OSError as e:
+                    sys.__stderr__.write(f"Log file {self.path} not writable: {e}\n")
+
+    def _write_file(self, lines):
+        for line in lines:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        if self._file is not None:
+            self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def configure(self, level=None, path=None, max_bytes=None, backups=None, console=None):
+        """Change the settings; path "" turns the log file off, a new path applies to the next write."""
+        with self._write_lock:
+            if level is not None:
+                self.level = LEVELS[level] if isinstance(level, str) else level
+            if path is not None and path != self.path:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self.path = path or None
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if backups is not None:
+                self.backups = backups
+            if console is not None:
+                self.console = console
+
+    def close(self):
+        self.flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # print() bridge
+
+    def capture_stdout(self):
+        """Send print() output through the log (INFO, source "stdout") instead of the console."""
+        if not isinstance(sys.stdout, StdoutBridge):
+            sys.stdout = StdoutBridge(self)
+
+
+class StdoutBridge:
+    """File-like object that turns printed lines into log records."""
+
+    def __init__(self, device_log):
+        self.device_log = device_log
+        self._partial = threading.local()
+
+    def write(self, text):
+        pending = getattr(self._partial, "text", "") + text
+        *lines, self._partial.text = pending.split("\n")
+        for line in lines:
+            if line:
+                self.device_log.info("stdout", "%s", line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+# The device's log; modules log through it with log.debug(source, message, *args)
+log = DeviceLog()
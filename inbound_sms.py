@@ -0,0 +1,242 @@
+"""Inbound SMS.
+
+The A9G stores every SMS it receives on the SIM, which holds a few dozen at
+most; nothing read them, so the SIM filled up and AT+CMGS started stalling.
+InboundSms enables "+CMTI" notifications (AT+CNMI), reads each new message
+with AT+CMGR, stores it in the inbound_sms table and only then deletes it from
+the SIM with AT+CMGD. A sweep with AT+CMGL="ALL" at start-up and every
+DRAIN_INTERVAL seconds picks up messages whose notification was missed.
+
+A message from an authorised number whose first word is a known command
+("LOCATE", "STOP") runs that command's handler on its own thread, so reading
+the SIM never waits for a GPS fix. Numbers are compared on their last
+MATCH_DIGITS digits, so "+63 917 123 4567" matches "09171234567".
+
+URC handlers run on the modem reader thread and must not send AT commands
+themselves; _on_cmti only queues the SIM index for the worker thread.
+"""
+
+import csv
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+from device_log import log
+
+READ_TIMEOUT = 5         # Seconds to wait for AT+CMGR / AT+CMGL
+DRAIN_INTERVAL = 10 * 60  # Seconds between sweeps of the SIM storage
+MATCH_DIGITS = 10        # Trailing digits that identify a phone number
+ERROR_DELAY = 5          # Seconds to wait after a failed pass before the next one
+
+# Status of a stored message
+STORED = "stored"              # Not a command
+UNAUTHORISED = "unauthorised"  # A command from a number that is not a contact
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS inbound_sms (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Sender TEXT NOT NULL,
+        SentAt TEXT,               -- Service centre time stamp as reported by the modem
+        ReceivedAt REAL NOT NULL,  -- Unix time the message was read from the SIM
+        Body TEXT NOT NULL,
+        Command TEXT,              -- LOCATE, STOP, ... or NULL for a plain message
+        Status TEXT NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS inbound_sms_received ON inbound_sms (ReceivedAt)',
+    'CREATE INDEX IF NOT EXISTS inbound_sms_sender ON inbound_sms (Sender, ReceivedAt)',
+)
+
+
+def create_tables(conn):
+    """Create the inbound_sms table and its indexes if they do not exist."""
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+
+def parse_fields(text):
+    """Split a result line's parameters, honouring quotes ('"SM",3' -> ['SM', '3'])."""
+    return next(csv.reader([text.strip()], skipinitialspace=True))
+
+
+def parse_cmti(line):
+    """Parse '+CMTI: "SM",3' into (storage, index)."""
+    storage, index = parse_fields(line.split(":", 1)[1])[:2]
+    return storage, int(index)
+
+
+def parse_cmgr(lines):
+    """Parse an AT+CMGR response (text mode) into (sender, sent_at, body), or None."""
+    for position, line in enumerate(lines):
+        if line.startswith("+CMGR:"):
+            fields = parse_fields(line.split(":", 1)[1])
+            if len(fields) < 2:
+                print(f"Malformed message header: {line}")
+                return None
+            body = [text for text in lines[position + 1:] if text != "OK"]
+            return fields[1], fields[3] if len(fields) > 3 else None, "\n".join(body)
+    return None
+
+
+def parse_cmgl(lines):
+    """Parse an AT+CMGL response (text mode) into [(index, sender, sent_at, body)].
+
+    A malformed header is skipped together with its body lines.
+    """
+    messages = []
+    current = None
+    for line in lines:
+        if line.startswith("+CMGL:"):
+            try:
+                fields = parse_fields(line.split(":", 1)[1])
+                current = [int(fields[0]), fields[2], fields[4] if len(fields) > 4 else None, []]
+            except (IndexError, ValueError):
+                print(f"Malformed message header: {line}")
+                current = None
+                continue
+            messages.append(current)
+        elif current is not None and line != "OK":
+            current[3].append(line)
+    return [(index, sender, sent_at, "\n".join(body)) for index, sender, sent_at, body in messages]
+
+
+def recent_messages(conn, limit=20):
+    """Return the latest stored messages as (received at, sender, command, status, body)."""
+    return conn.execute('SELECT ReceivedAt, Sender, Command, Status, Body FROM inbound_sms '
+                        'ORDER BY ReceivedAt DESC LIMIT ?', (limit,)).fetchall()
+
+
+def number_key(number):
+    """Return the part of a phone number used to compare it with others."""
+    return "".join(char for char in number if char.isdigit())[-MATCH_DIGITS:]
+
+
+class InboundSms:
+    """Read, store and delete received SMS, and run the commands they carry."""
+
+    def __init__(self, engine, database, authorised_numbers, handlers, modem_hold=None,
+                 ready=None, drain_interval=DRAIN_INTERVAL):
+        self.engine = engine
+        self.database = database                      # Context manager yielding the sqlite connection
+        self.authorised_numbers = authorised_numbers  # Called for the numbers allowed to send commands
+        self.handlers = handlers                      # {"LOCATE": handler(sender) -> bool, ...}
+        self.modem_hold = modem_hold or nullcontext   # Wraps every AT exchange (power policy)
+        self.ready = ready                            # Event set once the database can be used
+        self.drain_interval = drain_interval
+        self.received = 0
+        self._indexes = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Enable notifications and start reading on a background thread."""
+        self._stop_event.clear()
+        self.engine.add_urc_handler("+CMTI:", self._on_cmti)
+        self._thread = threading.Thread(target=self._run, name="inbound-sms", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.engine.remove_urc_handler("+CMTI:", self._on_cmti)
+        self._stop_event.set()
+        self._indexes.put(None)
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _on_cmti(self, line):
+        try:
+            _, index = parse_cmti(line)
+        except (IndexError, ValueError):
+            print(f"Failed to parse new message notification: {line}")
+            return
+        self._indexes.put(index)
+
+    def _run(self):
+        if self.ready is not None:
+            self.ready.wait()
+        configured = False
+        next_drain = 0
+        while not self._stop_event.is_set():
+            # A failing pass (modem, database) is logged and retried; the thread keeps running
+            try:
+                if not configured:
+                    with self.modem_hold():
+                        self.engine.command('AT+CMGF=1')          # Text mode for AT+CMGR / AT+CMGL
+                        self.engine.command('AT+CNMI=2,1,0,0,0')  # Store new messages and report them with +CMTI
+                    configured = True
+                if time.monotonic() >= next_drain:
+                    next_drain = time.monotonic() + self.drain_interval
+                    self.drain()
+                try:
+                    index = self._indexes.get(timeout=max(0, next_drain - time.monotonic()))
+                except queue.Empty:
+                    continue
+                if index is not None:
+                    self.read(index)
+            except Exception as e:
+                log.error("sms", "Inbound SMS pass failed: %s", e)
+                self._stop_event.wait(ERROR_DELAY)
+
+    def drain(self):
+        """Handle every message left on the SIM."""
+        with self.modem_hold():
+            response = self.engine.command('AT+CMGL="ALL"', timeout=READ_TIMEOUT)
+            for index, sender, sent_at, body in parse_cmgl(response):
+                self._handle_logged(index, sender, sent_at, body)
+
+    def read(self, index):
+        """Handle the message stored at index."""
+        with self.modem_hold():
+            message = parse_cmgr(self.engine.command(f'AT+CMGR={index}', timeout=READ_TIMEOUT))
+            if message is None:
+                print(f"No message at SIM index {index}.")
+                return
+            self._handle_logged(index, *message)
+
+    def _handle_logged(self, index, sender, sent_at, body):
+        """_handle one message; a failure is logged and leaves it on the SIM for the next sweep."""
+        try:
+            self._handle(index, sender, sent_at, body)
+        except Exception as e:
+            log.error("sms", "Failed to handle SMS %s from %s: %s", index, sender, e)
+
+    def _handle(self, index, sender, sent_at, body):
+        words = body.split(maxsplit=1)
+        command = words[0].upper() if words and words[0].upper() in self.handlers else None
+        key = number_key(sender)  # Alphanumeric senders ("GLOBE") have no digits and are never authorised
+        authorised = bool(key) and key in {number_key(number) for number in self.authorised_numbers()}
+        status = STORED if command is None else RUNNING if authorised else UNAUTHORISED
+
+        # The SIM copy is only deleted once the message is in the database
+        with self.database() as conn:
+            row_id = conn.execute(
+                'INSERT INTO inbound_sms (Sender, SentAt, ReceivedAt, Body, Command, Status) '
+                'VALUES (?, ?, ?, ?, ?, ?)', (sender, sent_at, time.time(), body, command, status)).lastrowid
+            conn.commit()
+        self.engine.command(f'AT+CMGD={index}')
+        self.received += 1
+        print(f"SMS from {sender} stored ({command or 'message'}, {status}).")
+
+        if status == RUNNING:
+            threading.Thread(target=self._execute, args=(row_id, command, sender),
+                             name=f"sms-{command.lower()}", daemon=True).start()
+
+    def _execute(self, row_id, command, sender):
+        try:
+            status = DONE if self.handlers[command](sender) is not False else FAILED
+        except Exception as e:
+            print(f"SMS command {command} from {sender} failed: {e}")
+            status = FAILED
+        with self.database() as conn:
+            conn.execute('UPDATE inbound_sms SET Status = ? WHERE ID = ?', (status, row_id))
+            conn.commit()
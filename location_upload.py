@@ -0,0 +1,145 @@
+"""GPRS/HTTP location upload.
+
+A data path next to the SMS fan-out: while an alert is active, fixes are
+queued and posted in batches to a configurable endpoint with the A9G's
+AT+HTTPPOST, so one GPRS attachment carries a whole track instead of one SMS
+per update. The body is form encoded (the A9G takes it as a quoted AT
+argument, so it must not contain double quotes):
+
+    device=<id>&track=<unix time>,<lat>,<lon>;<unix time>,<lat>,<lon>;...
+"""
+
+import collections
+import threading
+import time
+
+from a9g_modem import is_ok
+
+GPRS_APN = "internet"   # Access point name of the SIM's operator
+DEVICE_ID = "sos-1"     # Identifies this unit to the endpoint
+BATCH_SIZE = 10         # Post as soon as this many fixes are waiting
+FLUSH_INTERVAL = 60     # Seconds between posts of whatever is waiting
+MAX_PENDING = 500       # Oldest fixes are dropped beyond this while the network is down
+ATTACH_TIMEOUT = 30     # Seconds to wait for GPRS attach / PDP activation
+POST_TIMEOUT = 60       # Seconds to wait for AT+HTTPPOST to complete
+
+
+def encode_track(device_id, fixes):
+    """Encode a batch of (timestamp, latitude, longitude) fixes as the POST body."""
+    track = ";".join(f"{int(timestamp)},{latitude:.6f},{longitude:.6f}"
+                     for timestamp, latitude, longitude in fixes)
+    return f"device={device_id}&track={track}"
+
+
+def decode_track(body):
+    """Decode a POST body back into (device_id, [(timestamp, latitude, longitude), ...])."""
+    fields = dict(field.split("=", 1) for field in body.split("&"))
+    fixes = []
+    for point in filter(None, fields.get("track", "").split(";")):
+        timestamp, latitude, longitude = point.split(",")
+        fixes.append((int(timestamp), float(latitude), float(longitude)))
+    return fields.get("device"), fixes
+
+
+class LocationUploader:
+    """Batch fixes during an alert and post them over GPRS."""
+
+    def __init__(self, engine, url, apn=GPRS_APN, device_id=DEVICE_ID,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.engine = engine
+        self.url = url
+        self.apn = apn
+        self.device_id = device_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.attached = False
+        self.posted = 0                  # Fixes delivered so far
+        self._pending = collections.deque(maxlen=MAX_PENDING)  # (sequence number, fix), oldest first
+        self._sequence = 0               # Sequence number of the next fix queued
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Attach to GPRS and start posting batches on a background thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="location-upload", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=POST_TIMEOUT):
+        """Post whatever is still waiting, then detach."""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def add_fix(self, latitude, longitude, timestamp=None):
+        """Queue a fix for the next batch."""
+        with self._pending_lock:
+            self._pending.append((self._sequence, (timestamp or time.time(), latitude, longitude)))
+            self._sequence += 1
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def attach(self):
+        """Attach to GPRS and activate the PDP context; return True on success."""
+        steps = [
+            ('AT+CGATT=1', ATTACH_TIMEOUT),
+            (f'AT+CGDCONT=1,"IP","{self.apn}"', ATTACH_TIMEOUT),
+            ('AT+CGACT=1,1', ATTACH_TIMEOUT),
+        ]
+        for command, timeout in steps:
+            response = self.engine.command(command, timeout=timeout)
+            if not is_ok(response):
+                print(f"GPRS attach failed at '{command}': {response}")
+                return False
+        self.attached = True
+        print("GPRS attached.")
+        return True
+
+    def detach(self):
+        """Deactivate the PDP context and detach from GPRS."""
+        self.engine.command('AT+CGACT=0,1')
+        self.engine.command('AT+CGATT=0')
+        self.attached = False
+        print("GPRS detached.")
+
+    def flush(self):
+        """Post every waiting fix in one request; keep them queued if it fails."""
+        with self._pending_lock:
+            batch = [fix for _, fix in self._pending]
+            last = self._pending[-1][0] if self._pending else None
+        if not batch:
+            return True
+        if not self.attached and not self.attach():
+            return False
+
+        body = encode_track(self.device_id, batch)
+        response = self.engine.command(
+            f'AT+HTTPPOST="{self.url}","application/x-www-form-urlencoded","{body}"',
+            timeout=POST_TIMEOUT)
+        if not is_ok(response):
+            print(f"Location upload failed: {response}")
+            return False
+
+        with self._pending_lock:
+            # Only drop what was posted: fixes added meanwhile stay queued, and
+            # fixes the full deque evicted meanwhile are not counted twice
+            while self._pending and self._pending[0][0] <= last:
+                self._pending.popleft()
+        self.posted += len(batch)
+        print(f"Uploaded {len(batch)} fixes to {self.url}.")
+        return True
+
+    def _run(self):
+        self.attach()
+        while not self._stop_event.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()  # Fixes queued while the last batch was in flight
+        if self.attached:
+            self.detach()
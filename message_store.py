@@ -0,0 +1,152 @@
+"""Saved SOS messages.
+
+The messages table is defined once, by the Message dataclass: the CREATE
+TABLE, the columns added to older databases and every query are generated
+from its fields. Before, update_message_in_database wrote message_id and
+message_text while the table had ID and MessageText, so "update message:"
+failed on every call.
+
+MessageStore.prepare() runs at start-up. It brings the table up to date and
+compiles every statement with EXPLAIN, so a query that does not match the
+schema fails there, not in the middle of an RFCOMM session. The statements
+are fixed strings, so sqlite3's statement cache compiles each of them only
+once per connection.
+
+Messages are sent in Position order (ties in ID order, which is the order of
+databases that predate the column). A disabled message is kept but not sent,
+and a message with a ContactNumber is a template for that contact only. The
+ContactNumber is the number as stored in the contacts table; the templates
+follow the contact when its number changes and go when it is deleted.
+"""
+
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+TABLE = "messages"
+
+
+def column(name, declaration):
+    """Declare the table column behind a Message field."""
+    return field(metadata={"column": name, "declaration": declaration})
+
+
+@dataclass(frozen=True)
+class Message:
+    id: int = column("ID", "INTEGER PRIMARY KEY AUTOINCREMENT")
+    text: str = column("MessageText", "TEXT NOT NULL")
+    position: int = column("Position", "INTEGER NOT NULL DEFAULT 0")
+    enabled: bool = column("Enabled", "INTEGER NOT NULL DEFAULT 1")
+    contact: Optional[str] = column("ContactNumber", "TEXT")  # NULL: sent to every contact
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*(bool(value) if item.type is bool else value for item, value in zip(fields(cls), row)))
+
+
+COLUMNS = {item.name: item.metadata["column"] for item in fields(Message)}
+ID, TEXT, POSITION, ENABLED, CONTACT = (COLUMNS[name] for name in ("id", "text", "position", "enabled", "contact"))
+
+CREATE = (f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+          + ", ".join(f"{item.metadata['column']} {item.metadata['declaration']}" for item in fields(Message))
+          + ")")
+SELECT_ALL = f"SELECT {', '.join(COLUMNS.values())} FROM {TABLE} ORDER BY {POSITION}, {ID}"
+NEXT_POSITION = f"SELECT COALESCE(MAX({POSITION}), 0) + 1 FROM {TABLE}"
+INSERT = f"INSERT INTO {TABLE} ({TEXT}, {POSITION}, {CONTACT}) VALUES (?, ?, ?)"
+INSERT_WITH_ID = f"INSERT INTO {TABLE} ({ID}, {TEXT}, {POSITION}) VALUES (?, ?, ?)"
+UPDATE_TEXT = f"UPDATE {TABLE} SET {TEXT} = ? WHERE {ID} = ?"
+SET_ENABLED = f"UPDATE {TABLE} SET {ENABLED} = ? WHERE {ID} = ?"
+SET_POSITION = f"UPDATE {TABLE} SET {POSITION} = ? WHERE {ID} = ?"
+DELETE = f"DELETE FROM {TABLE} WHERE {ID} = ?"
+RETARGET = f"UPDATE {TABLE} SET {CONTACT} = ? WHERE {CONTACT} = ?"
+DELETE_TEMPLATES = f"DELETE FROM {TABLE} WHERE {CONTACT} = ?"
+
+STATEMENTS = (SELECT_ALL, NEXT_POSITION, INSERT, INSERT_WITH_ID, UPDATE_TEXT, SET_ENABLED, SET_POSITION, DELETE,
+              RETARGET, DELETE_TEMPLATES)
+
+
+class MessageStore:
+    """Typed access to the messages table through the shared connection."""
+
+    def __init__(self, database):
+        self.database = database  # Context manager yielding the sqlite connection
+
+    def prepare(self):
+        """Create or upgrade the table and compile every statement; raises sqlite3.Error on a mismatch."""
+        with self.database() as conn:
+            conn.execute(CREATE)
+            present = {row[1] for row in conn.execute(f"PRAGMA table_info({TABLE})")}
+            for item in fields(Message):
+                if item.metadata["column"] not in present:
+                    conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN {item.metadata['column']} "
+                                 f"{item.metadata['declaration']}")
+                    print(f"Added '{item.metadata['column']}' column to the {TABLE} table.")
+            for statement in STATEMENTS:
+                conn.execute("EXPLAIN " + statement, (None,) * statement.count("?"))
+            conn.commit()
+
+    def all(self):
+        """Return every message in send order."""
+        with self.database() as conn:
+            return [Message.from_row(row) for row in conn.execute(SELECT_ALL)]
+
+    def sos_messages(self):
+        """Return (messages for everyone, {contact number: template messages}) of the enabled messages."""
+        everyone, templates = [], {}
+        for message in self.all():
+            if not message.enabled:
+                continue
+            if message.contact is None:
+                everyone.append(message.text)
+            else:
+                templates.setdefault(message.contact, []).append(message.text)
+        return tuple(everyone), {contact: tuple(texts) for contact, texts in templates.items()}
+
+    def add(self, text, contact=None):
+        """Append a message (a template if contact is given); return its ID."""
+        with self.database() as conn:
+            position = conn.execute(NEXT_POSITION).fetchone()[0]
+            message_id = conn.execute(INSERT, (text, position, contact)).lastrowid
+            conn.commit()
+        return message_id
+
+    def save(self, message_id, text):
+        """Set the text of message_id, creating it at the end if it does not exist; False if created."""
+        with self.database() as conn:
+            updated = conn.execute(UPDATE_TEXT, (text, message_id)).rowcount > 0
+            if not updated:
+                position = conn.execute(NEXT_POSITION).fetchone()[0]
+                conn.execute(INSERT_WITH_ID, (message_id, text, position))
+            conn.commit()
+        return updated
+
+    def _update(self, statement, parameters):
+        with self.database() as conn:
+            changed = conn.execute(statement, parameters).rowcount > 0
+            conn.commit()
+        return changed
+
+    def set_enabled(self, message_id, enabled):
+        """Enable or disable a message; False if there is no such message."""
+        return self._update(SET_ENABLED, (int(enabled), message_id))
+
+    def move(self, message_id, position):
+        """Set the send position of a message; False if there is no such message."""
+        return self._update(SET_POSITION, (position, message_id))
+
+    def delete(self, message_id):
+        """Delete a message; False if there is no such message."""
+        return self._update(DELETE, (message_id,))
+
+    def retarget(self, old_contact, new_contact):
+        """Move the templates of old_contact to new_contact (its number changed); return how many."""
+        with self.database() as conn:
+            count = conn.execute(RETARGET, (new_contact, old_contact)).rowcount
+            conn.commit()
+        return count
+
+    def delete_templates(self, contact):
+        """Delete the templates of a contact that was deleted; return how many."""
+        with self.database() as conn:
+            count = conn.execute(DELETE_TEMPLATES, (contact,)).rowcount
+            conn.commit()
+        return count
@@ -0,0 +1,216 @@
+"""Pool of A9G modems for the outbound SMS fan-out.
+
+Gateway units carry extra A9G/SIM modules on USB serial next to the one on
+/dev/serial0. Each module gets its own ModemEngine (its own reader thread and
+transaction lock), and ModemPool spreads SMS across them:
+
+- dispatch() runs one worker per modem over a shared queue. A worker only
+  takes the next SMS once its modem has finished the previous one, so work
+  follows each modem's queue depth and a slow or congested module simply
+  takes fewer. With N modems an SOS fan-out takes roughly 1/N of the time.
+- Modems whose signal (AT+CSQ) is below MIN_SIGNAL are only used when no
+  modem has a better one.
+- An SMS that fails on one modem is put back at the front of the queue for
+  another modem; a modem that fails MAX_FAILURES sends in a row is left out
+  until the next fan-out.
+
+Consecutive SMS to the same contact (the segments of one long message, or a
+contact's whole series in "per_contact" mode) travel as one run on one modem,
+so the contact receives them in order. Location messages are queued first,
+so they still go out before the supplementary messages.
+
+The modem on /dev/serial0 stays the one used for GPS, calls and inbound SMS;
+the pool only sends.
+"""
+
+import threading
+import time
+
+from device_log import log
+
+MIN_SIGNAL = 5         # CSQ RSSI below this counts as weak (99, unknown, too)
+SIGNAL_REFRESH = 60    # Seconds a signal reading is trusted
+MAX_FAILURES = 3       # Failed sends in a row that take a modem out of a fan-out
+CSQ_TIMEOUT = 2
+
+
+def parse_csq(response):
+    """Return the RSSI (0-31) of an AT+CSQ response, or None if unknown."""
+    for line in response:
+        if line.startswith("+CSQ:"):
+            try:
+                rssi = int(line.split(":", 1)[1].split(",")[0])
+            except ValueError:
+                return None
+            return None if rssi == 99 else rssi
+    return None
+
+
+def sms_sent(response):
+    """Return True if an AT+CMGS exchange was confirmed with +CMGS."""
+    return any(line.startswith("+CMGS") for line in response)
+
+
+class PoolMember:
+    """One modem of the pool with its dispatch statistics."""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.signal = None        # Last AT+CSQ RSSI, None if unknown
+        self.signal_at = None     # time.monotonic() of that reading
+        self.available = True     # False once the module stopped answering
+        self.pending = 0          # SMS handed to the modem and not finished
+        self.failures = 0         # Failed sends in a row
+        self.sent = 0
+        self.failed = 0
+
+    def usable(self):
+        return self.available and self.failures < MAX_FAILURES
+
+    def strong(self):
+        return self.signal is not None and self.signal >= MIN_SIGNAL
+
+    def describe(self):
+        signal = "unknown" if self.signal is None else self.signal
+        state = "ok" if self.usable() else "down"
+        return f"{self.name}: {state}, signal {signal}, {self.sent} sent, {self.failed} failed"
+
+
+class ModemPool:
+    """Send SMS over several modem engines, balanced by queue depth and signal."""
+
+    def __init__(self, members):
+        self.members = [PoolMember(name, engine) for name, engine in members]
+        self._lock = threading.Condition()
+
+    def prepare(self, refresh_after=SIGNAL_REFRESH):
+        """Put every modem in text mode and read its signal; runs the modems in parallel."""
+        def prepare_member(member):
+            response = member.engine.command('AT+CMGF=1')
+            member.available = any(line == "OK" for line in response)
+            if member.available and (member.signal_at is None
+                                     or time.monotonic() - member.signal_at > refresh_after):
+                member.signal = parse_csq(member.engine.command('AT+CSQ', timeout=CSQ_TIMEOUT))
+                member.signal_at = time.monotonic()
+            member.failures = 0
+            print(f"Modem {member.describe()}")
+
+        threads = [threading.Thread(target=prepare_member, args=(member,), name=f"prepare-{member.name}")
+                   for member in self.members]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _candidates(self, exclude=()):
+        """Usable members not in exclude, the strong ones only if there are any."""
+        usable = [member for member in self.members if member.usable() and member not in exclude]
+        strong = [member for member in usable if member.strong()]
+        return strong or usable
+
+    def _may_take(self, member, run):
+        return member in self._candidates(run[1])
+
+    def _send_one(self, member, cmgs_command, body, timeouts):
+        with self._lock:
+            member.pending += 1
+        try:
+            response = member.engine.send_sms(cmgs_command, body, **timeouts)
+        except Exception as e:
+            print(f"Modem {member.name} failed to send: {e}")
+            response = []
+        ok = sms_sent(response)
+        with self._lock:
+            member.pending -= 1
+            if ok:
+                member.sent += 1
+                member.failures = 0
+            else:
+                member.failed += 1
+                member.failures += 1
+                print(f"SMS via {member.name} failed: {response}")
+        return ok
+
+    def send(self, cmgs_command, body, **timeouts):
+        """Send one SMS on the least busy, best connected modem, failing over to the others."""
+        tried = set()
+        while True:
+            with self._lock:
+                candidates = self._candidates(tried)
+                if not candidates:
+                    return False
+                member = min(candidates, key=lambda member: (member.pending, -(member.signal or 0)))
+            if self._send_one(member, cmgs_command, body, timeouts):
+                return True
+            tried.add(member)
+
+    def dispatch(self, sends, **timeouts):
+        """Send (contact, cmgs_command, body) items across the pool; return the ones that failed."""
+        runs = []  # [[items], modems that failed this run]
+        for item in sends:
+            if runs and runs[-1][0][-1][0] == item[0]:
+                runs[-1][0].append(item)
+            else:
+                runs.append([[item], set()])
+        state = {"queue": runs, "in_flight": 0, "failed": []}
+
+        workers = [threading.Thread(target=self._work, args=(member, state, timeouts),
+                                    name=f"sms-{member.name}") for member in self.members if member.usable()]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        with self._lock:
+            # Runs no usable modem was left to take
+            return state["failed"] + [item for items, _ in state["queue"] for item in items]
+
+    def _take(self, member, state):
+        """Wait for a run member may send; None once there is nothing left for it."""
+        with self._lock:
+            while member.usable():
+                for index, run in enumerate(state["queue"]):
+                    if self._may_take(member, run):
+                        state["in_flight"] += 1
+                        return state["queue"].pop(index)
+                # Stay while a run in flight may fail over to this modem, or another modem
+                # (which may stop) has a run to take
+                if not state["in_flight"] and not any(self._candidates(run[1]) for run in state["queue"]):
+                    return None
+                self._lock.wait()
+            return None
+
+    def _work(self, member, state, timeouts):
+        while True:
+            run = self._take(member, state)
+            if run is None:
+                with self._lock:
+                    self._lock.notify_all()
+                return
+            items, failed_on = run
+            sent = 0
+            for contact, cmgs_command, body in items:
+                log.info("sms", "Sending SMS to %s via %s...", contact, member.name)
+                if not self._send_one(member, cmgs_command, body, timeouts):
+                    break
+                sent += 1
+            with self._lock:
+                state["in_flight"] -= 1
+                if sent < len(items):
+                    failed_on.add(member)
+                    if self._candidates(failed_on):
+                        state["queue"].insert(0, [items[sent:], failed_on])  # Ahead of later runs
+                    else:
+                        state["failed"].extend(items[sent:])
+                self._lock.notify_all()
+
+    def status(self):
+        """Return one line per modem."""
+        with self._lock:
+            return [member.describe() for member in self.members]
+
+    def stop(self, keep=()):
+        """Stop the reader threads of the engines not in keep (the shared /dev/serial0 engine)."""
+        for member in self.members:
+            if member.engine not in keep:
+                member.engine.stop()
@@ -0,0 +1,326 @@
+"""Simulated A9G module for running the modem code without hardware.
+
+SimulatedA9G behaves like the pyserial handle on /dev/serial0: ModemEngine
+writes AT commands to it and reads back what a real A9G would answer. It
+covers the commands this project uses (SMS, GPS and AT+GPSRD NMEA reports,
+voice calls, GPRS/HTTP, AT+SLEEP). receive_sms() stores a message on the
+simulated SIM and reports it with +CMTI, as the network would.
+AT+HTTPPOST really posts to its URL, so the upload path can be exercised
+against a local HTTP stand-in:
+
+    python modem_sim.py    # posts a short track through the simulated modem
+"""
+
+import http.server
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+
+CTRL_Z = b"\x1a"
+SIM_CAPACITY = 30  # Messages the SIM holds; further ones are dropped
+
+
+class SimulatedA9G:
+    """pyserial-like port that answers AT commands like an A9G."""
+
+    def __init__(self, fix=(14.5995, 120.9842), echo=True, timeout=1,
+                 answering_numbers=(), answer_delay=2, ring_time=20, signal=20, sms_delay=0):
+        self.fix = fix                       # (latitude, longitude), or None for no fix
+        self.speed = 0.0                     # Knots reported in RMC sentences
+        self.echo = echo
+        self.timeout = timeout
+        self.answering_numbers = set(answering_numbers)
+        self.answer_delay = answer_delay     # Seconds before an answering number picks up
+        self.ring_time = ring_time           # Seconds before other numbers give NO ANSWER
+        self.signal = signal                 # RSSI reported by AT+CSQ (0-31, 99 unknown)
+        self.sms_delay = sms_delay           # Seconds the network takes to accept an SMS
+        self.sms_error = False               # Answer every SMS with +CMS ERROR (no service)
+        self.sent_sms = []                   # (number, text) of every SMS sent
+        self.dialed = []                     # Every number dialed with ATD
+        self.http_posts = []                 # (url, content type, body) of every AT+HTTPPOST
+        self.gps_enabled = False
+        self.sleep_mode = 0                  # Last AT+SLEEP mode
+        self.sim_messages = {}               # SIM index -> [status, number, time stamp, text]
+        self.new_message_indications = False  # Set by AT+CNMI, enables +CMTI
+        self.gprs_attached = False
+        self.pdp_active = False
+        self._input = b""
+        self._output = queue.Queue()
+        self._pending = b""                  # Output already taken from the queue but not read
+        self._sms_number = None              # Set while waiting for an SMS body
+        self._call = None                    # [number, stat] of the call in progress
+        self._call_timer = None
+        self._gpsrd_interval = 0
+        self._gpsrd_timer = None
+
+    # pyserial interface
+
+    @property
+    def in_waiting(self):
+        return len(self._pending) + self._output.qsize()
+
+    def read(self, size=1):
+        if not self._pending:
+            try:
+                self._pending = self._output.get(timeout=self.timeout)
+            except queue.Empty:
+                return b""
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def write(self, data):
+        self._input += data
+        self._process_input()
+        return len(data)
+
+    def close(self):
+        if self._call_timer is not None:
+            self._call_timer.cancel()
+        self._set_gps_reporting(0)
+
+    def receive_sms(self, number, text):
+        """Deliver an SMS to the SIM; return its index, or None if the SIM is full."""
+        free = [index for index in range(1, SIM_CAPACITY + 1) if index not in self.sim_messages]
+        if not free:
+            return None
+        stamp = time.strftime('%y/%m/%d,%H:%M:%S+00')
+        self.sim_messages[free[0]] = ["REC UNREAD", number, stamp, text]
+        if self.new_message_indications:
+            self._reply(f'+CMTI: "SM",{free[0]}')
+        return free[0]
+
+    # Command handling
+
+    def _reply(self, *lines):
+        self._output.put(b"".join(b"\r\n" + line.encode() + b"\r\n" for line in lines))
+
+    def _process_input(self):
+        while True:
+            if self._sms_number is not None:
+                if CTRL_Z not in self._input:
+                    return
+                body, self._input = self._input.split(CTRL_Z, 1)
+                number, self._sms_number = self._sms_number, None
+                if self.sms_delay:
+                    time.sleep(self.sms_delay)
+                if self.sms_error:
+                    self._reply("+CMS ERROR: 500")
+                    continue
+                self.sent_sms.append((number, body.decode('utf-8', errors='ignore')))
+                self._reply(f"+CMGS: {len(self.sent_sms)}", "OK")
+                continue
+
+            if b"\r" not in self._input:
+                return
+            raw, self._input = self._input.split(b"\r", 1)
+            self._input = self._input.lstrip(b"\n")
+            command = raw.decode('utf-8', errors='ignore').strip()
+            if not command:
+                continue
+            if self.echo:
+                self._output.put(command.encode() + b"\r\n")
+            self._handle(command)
+
+    def _handle(self, command):
+        upper = command.upper()
+
+        if upper in ("AT", "ATE0", "ATE1", "AT+CMGF=1", "AT+RST=2"):
+            self.echo = {"ATE0": False, "ATE1": True}.get(upper, self.echo)
+            self._reply("OK")
+        elif upper == "AT+CSQ":
+            self._reply(f"+CSQ: {self.signal},0", "OK")
+        elif upper.startswith("AT+SLEEP="):
+            self.sleep_mode = int(upper.split("=", 1)[1] or 0)
+            self._reply("OK")
+        elif upper.startswith("AT+CNMI="):
+            self.new_message_indications = upper.split("=", 1)[1].split(",")[1:2] != ["0"]
+            self._reply("OK")
+        elif upper.startswith("AT+CMGR="):
+            message = self.sim_messages.get(int(upper.split("=", 1)[1] or 0))
+            if message is None:
+                self._reply("+CMS ERROR: 321")  # Invalid memory index
+            else:
+                status, number, stamp, text = message
+                self._reply(f'+CMGR: "{status}","{number}","","{stamp}"', text, "OK")
+                message[0] = "REC READ"
+        elif upper.startswith("AT+CMGL="):
+            lines = []
+            for index, (status, number, stamp, text) in sorted(self.sim_messages.items()):
+                lines += [f'+CMGL: {index},"{status}","{number}","","{stamp}"', text]
+                self.sim_messages[index][0] = "REC READ"
+            self._reply(*lines, "OK")
+        elif upper.startswith("AT+CMGD="):
+            self.sim_messages.pop(int(upper.split("=", 1)[1].split(",")[0] or 0), None)
+            self._reply("OK")
+        elif upper.startswith("AT+GPSRD="):
+            self._set_gps_reporting(int(upper.split("=", 1)[1] or 0))
+            self._reply("OK")
+        elif upper.startswith("AT+GPS="):
+            self.gps_enabled = upper.endswith("=1")
+            self._reply("OK")
+        elif upper == "AT+LOCATION=2":
+            if self.fix is None or not self.gps_enabled:
+                self._reply("GPS NOT FIX NOW", "OK")
+            else:
+                self._reply(f"{self.fix[0]},{self.fix[1]}", "OK")
+        elif upper.startswith("AT+CMGS="):
+            self._sms_number = command.split("=", 1)[1].strip('"')
+            self._output.put(b"\r\n> ")
+        elif upper.startswith("AT+CGATT="):
+            self.gprs_attached = upper.endswith("=1")
+            self._reply("OK")
+        elif upper.startswith("AT+CGDCONT="):
+            self._reply("OK")
+        elif upper.startswith("AT+CGACT="):
+            self.pdp_active = upper.split("=", 1)[1].startswith("1")
+            self._reply("OK" if self.gprs_attached or not self.pdp_active else "ERROR")
+        elif upper.startswith("AT+HTTPPOST="):
+            self._http_post(command.split("=", 1)[1])
+        elif upper.startswith("ATD"):
+            self._dial(command[3:].rstrip(";"))
+        elif upper == "ATH":
+            self._hang_up()
+            self._reply("OK")
+        elif upper == "AT+CLCC":
+            if self._call is not None:
+                number, stat = self._call
+                self._reply(f'+CLCC: 1,0,{stat},0,0,"{number}",129', "OK")
+            else:
+                self._reply("OK")
+        else:
+            self._reply("ERROR")
+
+    def _set_gps_reporting(self, interval):
+        self._gpsrd_interval = interval
+        if self._gpsrd_timer is not None:
+            self._gpsrd_timer.cancel()
+            self._gpsrd_timer = None
+        if interval > 0:
+            self._gpsrd_timer = threading.Timer(interval, self._report_nmea)
+            self._gpsrd_timer.daemon = True
+            self._gpsrd_timer.start()
+
+    def _report_nmea(self):
+        if self.fix is not None and self.gps_enabled:
+            self._output.put(("+GPSRD:" + "\r\n".join(nmea_sentences(self.fix, self.speed)) + "\r\n").encode())
+        self._set_gps_reporting(self._gpsrd_interval)
+
+    def _http_post(self, arguments):
+        # AT+HTTPPOST="url","content type","body"; the body may contain commas
+        url, content_type, body = (part.strip('"') for part in arguments.split('","', 2))
+        self.http_posts.append((url, content_type, body))
+        if not self.pdp_active:
+            self._reply("+CME ERROR: 53")
+            return
+        request = urllib.request.Request(url, data=body.encode(), headers={"Content-Type": content_type})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                self._reply(f"HTTP/1.1 {response.status} {response.reason}", "OK")
+        except urllib.error.HTTPError as e:
+            self._reply(f"HTTP/1.1 {e.code} {e.reason}", "ERROR")
+        except OSError:
+            self._reply("+CME ERROR: 58")
+
+    def _dial(self, number):
+        self.dialed.append(number)
+        self._hang_up()
+        self._call = [number, 3]  # Alerting
+        self._reply("OK")
+        if number in self.answering_numbers:
+            self._call_timer = threading.Timer(self.answer_delay, self._answer)
+        else:
+            self._call_timer = threading.Timer(self.ring_time, self._end_call, ("NO ANSWER",))
+        self._call_timer.daemon = True
+        self._call_timer.start()
+
+    def _answer(self):
+        if self._call is not None:
+            self._call[1] = 0  # Active
+
+    def _end_call(self, reason):
+        if self._call is not None:
+            self._call = None
+            self._reply(reason)
+
+    def _hang_up(self):
+        if self._call_timer is not None:
+            self._call_timer.cancel()
+            self._call_timer = None
+        self._call = None
+
+
+def nmea_coordinate(degrees, positive, negative, width):
+    """Format signed degrees as an NMEA (d)ddmm.mmmm value and hemisphere."""
+    hemisphere = positive if degrees >= 0 else negative
+    degrees = abs(degrees)
+    whole = int(degrees)
+    return f"{whole:0{width}d}{(degrees - whole) * 60:07.4f}", hemisphere
+
+
+def nmea_sentence(body):
+    """Add the leading '$' and checksum to an NMEA sentence body."""
+    checksum = 0
+    for char in body:
+        checksum ^= ord(char)
+    return f"${body}*{checksum:02X}"
+
+
+def nmea_sentences(fix, speed_knots=0.0, hdop=0.9):
+    """Return the GGA and RMC sentences an A9G reports for a fix."""
+    now = time.gmtime()
+    clock = time.strftime("%H%M%S.000", now)
+    latitude, north_south = nmea_coordinate(fix[0], "N", "S", 2)
+    longitude, east_west = nmea_coordinate(fix[1], "E", "W", 3)
+    return [
+        nmea_sentence(f"GNGGA,{clock},{latitude},{north_south},{longitude},{east_west},1,08,{hdop:.1f},10.0,M,0.0,M,,"),
+        nmea_sentence(f"GNRMC,{clock},A,{latitude},{north_south},{longitude},{east_west},"
+                      f"{speed_knots:.2f},0.00,{time.strftime('%d%m%y', now)},,,A"),
+    ]
+
+
+def start_http_standin(port=0):
+    """Start a local HTTP server that records POST bodies; return (server, received)."""
+    received = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            received.append((self.path, self.rfile.read(length).decode('utf-8')))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass  # Keep the demo output readable
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, received
+
+
+def main():
+    """Post a short track to a local HTTP stand-in through the simulated modem."""
+    from a9g_modem import ModemEngine
+    from location_upload import LocationUploader, decode_track
+
+    server, received = start_http_standin()
+    url = f"http://127.0.0.1:{server.server_address[1]}/track"
+    engine = ModemEngine(SimulatedA9G())
+
+    uploader = LocationUploader(engine, url, batch_size=3, flush_interval=1).start()
+    for step in range(7):
+        uploader.add_fix(14.5995 + step * 0.0001, 120.9842, timestamp=time.time() + step)
+        time.sleep(0.2)
+    uploader.stop()
+    engine.stop()
+    server.shutdown()
+
+    for path, body in received:
+        device_id, fixes = decode_track(body)
+        print(f"POST {path} from {device_id}: {len(fixes)} fixes")
+    print(f"{uploader.posted} fixes uploaded in {len(received)} requests.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Allow-listed remote operations.
+
+RFCOMM clients used to send any string to run_raspberry_pi_command, which ran
+it through a shell with no time limit, so one runaway command froze the only
+session. Now a request names an operation from a registry, with its arguments:
+
+    status                      uptime, load, memory, temperature, disk
+    log [lines]                 last lines of the service journal
+    log follow [seconds]        journal lines as they are written
+    reboot                      restart the Raspberry Pi
+    config get [section.key]    current settings (when a ConfigManager is given)
+    config set section.key value
+    help                        list the operations
+
+Commands run as argument lists without a shell, under a timeout, and their
+output is sent to the client as it arrives, up to OUTPUT_LIMIT bytes. Every
+reply ends with a status line ("EXIT 0", "TIMEOUT", "TRUNCATED", "ERROR ...")
+and END_OF_DATA.
+"""
+
+import shutil
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_TIMEOUT = 10        # Seconds an operation may run
+OUTPUT_LIMIT = 64 * 1024    # Bytes of output sent per operation
+READ_SIZE = 4096            # Bytes read from a command per chunk
+
+LOG_UNIT = "sosd"           # systemd unit whose journal "log" returns
+LOG_LINES = 100             # Lines returned by "log" without an argument
+MAX_LOG_LINES = 2000
+FOLLOW_SECONDS = 30         # "log follow" duration without an argument
+MAX_FOLLOW_SECONDS = 300
+
+Operation = namedtuple("Operation", "name handler summary timeout")
+
+
+class Reply:
+    """Output of one operation, sent to the client as it is written and capped at limit bytes."""
+
+    def __init__(self, send, limit=OUTPUT_LIMIT):
+        self.send = send
+        self.limit = limit
+        self.sent = 0
+        self.truncated = False
+
+    def write(self, data):
+        """Send data; return False once the limit has been reached."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        room = self.limit - self.sent
+        if len(data) > room:
+            data = data[:room]
+            self.truncated = True
+        if data:
+            self.send(data)
+            self.sent += len(data)
+        return not self.truncated
+
+    def line(self, text):
+        return self.write(text + "\n")
+
+
+def run_argv(argv, reply, timeout=DEFAULT_TIMEOUT, expected_timeout=False):
+    """Run argv without a shell, streaming its output into reply; return the status line.
+
+    The command is killed when it runs past timeout or its output reaches the
+    reply limit. With expected_timeout (for commands that never end on their
+    own, like "journalctl -f") running out of time counts as success.
+    """
+    try:
+        process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+    except OSError as e:
+        return f"ERROR {argv[0]}: {e.strerror}"
+
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.daemon = True
+    timer.start()
+    try:
+        while True:
+            chunk = process.stdout.read1(READ_SIZE)
+            if not chunk:
+                break
+            if not reply.write(chunk):
+                process.kill()
+                break
+        returncode = process.wait()
+    finally:
+        timer.cancel()
+        process.stdout.close()
+
+    if reply.truncated:
+        return "TRUNCATED"
+    if timed_out.is_set():
+        return "EXIT 0" if expected_timeout else "TIMEOUT"
+    return f"EXIT {returncode}"
+
+
+def bounded_int(text, default, high):
+    """Parse an optional positive integer argument, capped at high."""
+    if not text:
+        return default
+    if not text.isdigit() or int(text) == 0:
+        raise ValueError(f"expected a positive number, got {text!r}")
+    return min(int(text), high)
+
+
+def read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def system_status():
+    """Return status lines for the Raspberry Pi, from /proc and /sys (no commands run)."""
+    lines = []
+    uptime = read_first_line('/proc/uptime')
+    if uptime:
+        lines.append(f"uptime: {float(uptime.split()[0]):.0f} s")
+    load = read_first_line('/proc/loadavg')
+    if load:
+        lines.append(f"load: {' '.join(load.split()[:3])}")
+    try:
+        with open('/proc/meminfo') as f:
+            meminfo = dict(line.split(':', 1) for line in f)
+        lines.append(f"memory available: {meminfo['MemAvailable'].strip()} of {meminfo['MemTotal'].strip()}")
+    except (OSError, KeyError, ValueError):
+        pass
+    temperature = read_first_line('/sys/class/thermal/thermal_zone0/temp')
+    if temperature and temperature.isdigit():
+        lines.append(f"cpu temperature: {int(temperature) / 1000:.1f} C")
+    disk = shutil.disk_usage('/')
+    lines.append(f"disk free: {disk.free // (1024 * 1024)} MB of {disk.total // (1024 * 1024)} MB")
+    lines.append(f"time: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+    return lines
+
+
+class RemoteOps:
+    """Registry of the operations a remote client may run."""
+
+    def __init__(self, limit=OUTPUT_LIMIT):
+        self.limit = limit
+        self.operations = {}
+        self.register("help", self._help, "list the operations")
+
+    def register(self, name, handler, summary, timeout=DEFAULT_TIMEOUT):
+        """Allow operation name; handler(arguments, reply, timeout) returns the status line."""
+        self.operations[name] = Operation(name, handler, summary, timeout)
+
+    def find(self, request):
+        """Return (operation, argument words) for a request, or (None, words)."""
+        words = request.split()
+        for length in (2, 1):  # "config get" before "config"
+            name = " ".join(words[:length])
+            if len(words) >= length and name in self.operations:
+                return self.operations[name], words[length:]
+        return None, words
+
+    def execute(self, request, send):
+        """Run request ("<operation> [arguments]"), streaming its reply through send()."""
+        reply = Reply(send, self.limit)
+        operation, arguments = self.find(request)
+        if operation is None:
+            status = f"ERROR unknown operation {request.strip()!r} (try 'help')"
+        else:
+            print(f"Running remote operation '{operation.name}' {arguments}")
+            try:
+                status = operation.handler(arguments, reply, operation.timeout)
+            except ValueError as e:
+                status = f"ERROR {e}"
+            if reply.truncated:
+                status = "TRUNCATED"
+        send(f"\n{status}\nEND_OF_DATA".encode('utf-8'))
+        print(f"Remote operation '{request.strip()}': {status}")
+        return status
+
+    def _help(self, arguments, reply, timeout):
+        for operation in self.operations.values():
+            reply.line(f"{operation.name:<12} {operation.summary}")
+        return "EXIT 0"
+
+
+def status_operation(extra=None):
+    """Build the "status" handler; extra() may add device-specific lines."""
+    def status(arguments, reply, timeout):
+        for line in system_status() + (extra() if extra is not None else []):
+            reply.line(line)
+        return "EXIT 0"
+    return status
+
+
+def log_operation(arguments, reply, timeout):
+    if arguments[:1] == ["follow"]:
+        seconds = bounded_int(arguments[1] if len(arguments) > 1 else None, FOLLOW_SECONDS, MAX_FOLLOW_SECONDS)
+        return run_argv(["journalctl", "-u", LOG_UNIT, "-f", "-n", "0", "--no-pager"], reply,
+                        timeout=seconds, expected_timeout=True)
+    lines = bounded_int(arguments[0] if arguments else None, LOG_LINES, MAX_LOG_LINES)
+    return run_argv(["journalctl", "-u", LOG_UNIT, "-n", str(lines), "--no-pager"], reply, timeout)
+
+
+def reboot_operation(arguments, reply, timeout):
+    reply.line("Rebooting...")
+    return run_argv(["sudo", "systemctl", "reboot"], reply, timeout)
+
+
+def config_operations(manager):
+    """Build the "config get" and "config set" handlers for a sosd.config.ConfigManager."""
+    def get(arguments, reply, timeout):
+        for name, value in manager.items(arguments[0] if arguments else None):
+            reply.line(f"{name} = {'' if value is None else value}")
+        return "EXIT 0"
+
+    def set_(arguments, reply, timeout):
+        if len(arguments) < 2:
+            raise ValueError("usage: config set section.key value")
+        changed = manager.update(arguments[0], " ".join(arguments[1:]))
+        reply.line(f"{arguments[0]} saved to {manager.path}; changed: {', '.join(changed) or 'nothing'}")
+        return "EXIT 0"
+
+    return get, set_
+
+
+def default_operations(config=None, status=None, limit=OUTPUT_LIMIT):
+    """Return a registry with the standard operations.
+
+    config is a sosd.config.ConfigManager (the config operations are left out
+    without one); status() may return extra lines for "status".
+    """
+    ops = RemoteOps(limit)
+    ops.register("status", status_operation(status), "uptime, load, memory, temperature, disk")
+    ops.register("log", log_operation, "[lines | follow [seconds]] service journal")
+    ops.register("reboot", reboot_operation, "restart the Raspberry Pi")
+    if config is not None:
+        get, set_ = config_operations(config)
+        ops.register("config get", get, "[section.key] show settings")
+        ops.register("config set", set_, "section.key value  change and apply a setting")
+    return ops
+
+
+def run_command(argv, timeout=DEFAULT_TIMEOUT):
+    """Run a local command (argument list, no shell); return (status line, output text)."""
+    output = []
+    status = run_argv(argv, Reply(output.append), timeout)
+    return status, b"".join(output).decode('utf-8', errors='replace')
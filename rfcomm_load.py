@@ -0,0 +1,518 @@
+"""Load and soak test of the RFCOMM server.
+
+Nobody knew how many commands a second start_rfcomm_server sustains, or what
+hours of use do to contacts.db and the process. This tool runs the unchanged
+server loop in-process, with a stand-in for the bluetooth module whose
+BluetoothSocket listens on a UNIX socket (or TCP on 127.0.0.1), and drives it
+from a client that sends a weighted mix of verbs:
+
+    contact   "contact:<A_ID>,<name>,<number>"       a new contact
+    update    "update contact:<A_ID>,<name>,<number>" rename a live contact
+    delete    "delete contact:<number>"               delete a live contact
+    message   "set message:<text>"                    a new saved message
+    sync      "sync data"                             every contact and message
+    search    "search contacts:20,,<prefix>"          one page of contacts
+
+Every REPORT_EVERY seconds it prints one row: the commands handled and the
+rate, how long each command kept the server loop busy (p50/p95/p99 over the
+interval), the p95 round trip of the verbs that answer (sync, search), the
+size of contacts.db with its WAL, the mutations written by db_writes, the
+resident memory, open descriptors and threads. The summary breaks the times
+down per verb, shows database and memory growth per hour after the first
+interval, and checks that every contact sent arrived.
+
+The server works on a copy in a temporary directory (contacts.db, the track
+file, trusted devices and sosd.log), so the device's data is never touched;
+print() output goes to the log file as on the device, not to the terminal.
+Over the stand-in socket the client ends each command with a newline and the
+server is handed one command per recv(), like the separate writes of a phone;
+backup and restore, which stream binary chunks, are not part of a mix. With a
+session key the commands travel as SecureSession frames instead:
+
+    python rfcomm_load.py 60
+    python rfcomm_load.py 14400 contact=4,update=3,delete=1,sync=1,search=1 50 --every 300
+    python rfcomm_load.py 600 contact=1,sync=1 --tcp --session-key session.key --db contacts.db
+
+Arguments: duration in seconds, the mix (verb=weight, ...), the rate in
+commands a second (0, the default, sends as fast as the server takes them).
+"""
+
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_MIX = "contact=6,update=2,search=1,sync=1"
+REPORT_EVERY = 10        # Seconds between report rows
+RESERVOIR = 10000        # Latency samples kept per verb for the summary
+SEARCH_PAGE = 20
+
+# Command prefix of each verb, and how the verbs that answer end their reply
+VERBS = {
+    "contact": "contact:",
+    "update": "update contact:",
+    "delete": "delete contact:",
+    "message": "set message:",
+    "sync": "sync data",
+    "search": "search contacts:",
+}
+REPLY_END = {"sync": b"]}", "search": b"END_OF_DATA"}
+
+
+def parse_mix(text):
+    """Return [(verb, weight)] for "verb=weight,..."; raises ValueError."""
+    mix = []
+    for item in text.split(","):
+        verb, _, weight = item.strip().partition("=")
+        if verb not in VERBS:
+            raise ValueError(f"unknown verb {verb!r} (one of {', '.join(VERBS)})")
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"bad weight for {verb}: {weight!r}") from None
+        if weight > 0:
+            mix.append((verb, weight))
+    if not mix:
+        raise ValueError("the mix has no verb with a positive weight")
+    return mix
+
+
+def verb_of(command):
+    """Return the verb of a received command ("other" if it is not one of VERBS)."""
+    text = command.decode('utf-8', errors='replace').strip()
+    for verb, prefix in VERBS.items():
+        if text.startswith(prefix):
+            return verb
+    return "other"
+
+
+def percentile(values, fraction):
+    """Return the fraction (0-1) percentile of values, None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def milliseconds(value):
+    return "-" if value is None else f"{value * 1000:.2f}"
+
+
+def process_memory():
+    """Return (resident KB, open descriptors); None for what the platform does not show."""
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Peak, in KB on Linux
+    try:
+        fds = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        fds = None
+    return rss, fds
+
+
+def database_size(path):
+    """Return the size of a database with its WAL and journal, in bytes."""
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal", "-journal")
+               if os.path.exists(path + suffix))
+
+
+class Samples:
+    """Count, maximum and a uniform reservoir of latencies."""
+
+    def __init__(self, size=RESERVOIR):
+        self.size = size
+        self.values = []
+        self.count = 0
+        self.max = 0.0
+        self._random = random.Random(0)
+
+    def add(self, value):
+        self.count += 1
+        self.max = max(self.max, value)
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            index = self._random.randrange(self.count)
+            if index < self.size:
+                self.values[index] = value
+
+
+class LoadStats:
+    """Latencies of a run: per verb for the summary, and those of the current interval."""
+
+    def __init__(self):
+        self.service = {}       # verb -> Samples: time a command kept the server loop busy
+        self.round_trip = {}    # verb -> Samples: client round trip of the verbs that answer
+        self.handled = 0        # Commands the server finished
+        self._interval_service = Samples()
+        self._interval_round_trip = Samples()
+        self._lock = threading.Lock()
+
+    def add_service(self, verb, seconds):
+        with self._lock:
+            self.service.setdefault(verb, Samples()).add(seconds)
+            self._interval_service.add(seconds)
+            self.handled += 1
+
+    def add_round_trip(self, verb, seconds):
+        with self._lock:
+            self.round_trip.setdefault(verb, Samples()).add(seconds)
+            self._interval_round_trip.add(seconds)
+
+    def take_interval(self):
+        """Return and reset the (service time, round trip) samples of the interval."""
+        with self._lock:
+            interval = self._interval_service.values, self._interval_round_trip.values
+            self._interval_service, self._interval_round_trip = Samples(), Samples()
+            return interval
+
+
+class TimedConnection:
+    """The server's client socket; times each command from its recv() to the next recv()."""
+
+    def __init__(self, sock, stats):
+        self.sock = sock
+        self.stats = stats
+        self._verb = None
+        self._received = None
+
+    def recv(self, bufsize=1024):
+        if self._verb is not None:
+            self.stats.add_service(self._verb, time.perf_counter() - self._received)
+        data = self.sock.recv(bufsize)
+        self._received = time.perf_counter()
+        self._verb = verb_of(data) if data else None
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)  # send, sendall, settimeout, close
+
+
+class FramedConnection:
+    """An unencrypted stream connection that returns one newline-terminated command per recv()."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = b""
+
+    def recv(self, bufsize=1024):
+        while b"\n" not in self._buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                rest, self._buffer = self._buffer, b""
+                return rest
+            self._buffer += data
+        command, self._buffer = self._buffer.split(b"\n", 1)
+        return command
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class LocalServerSocket:
+    """BluetoothSocket of the stand-in: listens on a UNIX socket in directory, or on TCP."""
+
+    def __init__(self, rfcomm):
+        self.rfcomm = rfcomm
+        self.channel = None
+        self.path = None
+        if rfcomm.transport == "tcp":
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def bind(self, address):
+        self.channel = address[1]
+        if self.rfcomm.transport == "tcp":
+            self.sock.bind(("127.0.0.1", 0))
+        else:
+            self.path = os.path.join(self.rfcomm.directory, f"rfcomm-{self.channel}.sock")
+            self.sock.bind(self.path)
+
+    def listen(self, backlog):
+        self.sock.listen(backlog)
+        self.rfcomm.address = self.sock.getsockname()
+        self.rfcomm.listening.set()
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def accept(self):
+        conn, _ = self.sock.accept()
+        if self.rfcomm.transport == "tcp":
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, ("local", self.channel)  # Not a Bluetooth address: the device is not remembered
+
+    def close(self):
+        self.sock.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class LocalRfcomm:
+    """Stand-in for the bluetooth module (PyBluez), installed as sys.modules["bluetooth"]."""
+
+    RFCOMM = 3
+
+    class BluetoothError(OSError):
+        pass
+
+    def __init__(self, transport, directory):
+        self.transport = transport      # "unix" or "tcp"
+        self.directory = directory
+        self.address = None             # What the server listens on, once it does
+        self.listening = threading.Event()
+
+    def BluetoothSocket(self, protocol):
+        return LocalServerSocket(self)
+
+
+class LoadClient:
+    """The phone's side: builds commands from the mix and keeps track of the live contacts."""
+
+    def __init__(self, sock, mix, stats, session=False, seed=None):
+        self.sock = sock
+        self.stats = stats
+        self.session = session          # sock is a SecureSession: one frame per command
+        self.verbs = [verb for verb, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.random = random.Random(seed)
+        self.live = {}                  # A_ID -> number of the contacts sent and not deleted
+        self.created = 0
+        self.messages = 0
+        self.sent = 0
+
+    def next_command(self):
+        """Return (verb, command text) of the next command."""
+        verb = self.random.choices(self.verbs, self.weights)[0]
+        if verb in ("update", "delete") and not self.live:
+            verb = "contact"
+        if verb == "contact":
+            self.created += 1
+            a_id = self.created
+            self.live[a_id] = f"+63917{a_id:07d}"
+            return verb, f"contact:{a_id},Load {a_id},{self.live[a_id]}"
+        if verb == "update":
+            a_id = self._some_live()
+            return verb, f"update contact:{a_id},Load {a_id} renamed,{self.live[a_id]}"
+        if verb == "delete":
+            a_id = self._some_live()
+            return verb, f"delete contact:{self.live.pop(a_id)}"
+        if verb == "message":
+            self.messages += 1
+            return verb, f"set message:Load test message {self.messages}"
+        if verb == "search":
+            return verb, f"search contacts:{SEARCH_PAGE},,Load {self.random.randint(1, 9)}"
+        return verb, "sync data"
+
+    def _some_live(self):
+        # Sampling a key without copying the whole dictionary on every command
+        for _ in range(20):
+            a_id = self.random.randint(1, self.created)
+            if a_id in self.live:
+                return a_id
+        return next(iter(self.live))
+
+    def send(self, command):
+        data = command.encode('utf-8')
+        if self.session:
+            self.sock.send(data)
+        else:
+            self.sock.sendall(data + b"\n")
+        self.sent += 1
+
+    def read_reply(self, end):
+        reply = bytearray()
+        while not reply.endswith(end):
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError("the server closed the connection")
+            reply += data
+        return reply
+
+    def run_one(self):
+        verb, command = self.next_command()
+        started = time.perf_counter()
+        self.send(command)
+        if verb in REPLY_END:
+            self.read_reply(REPLY_END[verb])
+            self.stats.add_round_trip(verb, time.perf_counter() - started)
+
+
+def count_rows(button_detector, table):
+    with button_detector.database() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def emit(line):
+    """Write a report line to the terminal; print() goes to the device log during a run."""
+    sys.__stdout__.write(line + "\n")
+    sys.__stdout__.flush()
+
+
+def run(duration, mix, rate=0, every=REPORT_EVERY, transport="unix", key_file=None, db_file=None,
+        seed=None):
+    """Serve one connection with start_rfcomm_server and load it for duration seconds.
+
+    Returns 0 if every contact sent is in the database at the end, 1 otherwise.
+    """
+    import button_detector
+    from device_log import log
+    from secure_session import accept_session, client_handshake, load_session_key
+
+    workdir = tempfile.mkdtemp(prefix="rfcomm-load-")
+    button_detector.DB_FILE = os.path.join(workdir, "contacts.db")
+    button_detector.TRACK_FILE = os.path.join(workdir, "track.bin")
+    button_detector.TRUSTED_DEVICES_FILE = os.path.join(workdir, "trusted_devices.json")
+    button_detector.SESSION_KEY_FILE = key_file
+    if db_file:
+        shutil.copyfile(db_file, button_detector.DB_FILE)
+    log.configure(path=os.path.join(workdir, "sosd.log"), console=False)
+    log.capture_stdout()
+    button_detector.create_database()
+    initial_contacts = count_rows(button_detector, "contacts")
+
+    stats = LoadStats()
+
+    def timed_session(sock, key_file):
+        session = accept_session(sock, key_file)
+        return TimedConnection(FramedConnection(sock) if session is sock else session, stats)
+
+    rfcomm = LocalRfcomm(transport, workdir)
+    previous_bluetooth = sys.modules.get("bluetooth")
+    sys.modules["bluetooth"] = rfcomm
+    button_detector.accept_session = timed_session
+    server = threading.Thread(target=button_detector.start_rfcomm_server, name="rfcomm-server", daemon=True)
+    try:
+        server.start()
+        if not rfcomm.listening.wait(10):
+            emit("The RFCOMM server did not start listening.")
+            return 1
+        sock = socket.socket(socket.AF_INET if transport == "tcp" else socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(rfcomm.address)
+        if transport == "tcp":
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if key_file:
+            sock = client_handshake(sock, load_session_key(key_file))
+        client = LoadClient(sock, mix, stats, session=bool(key_file), seed=seed)
+
+        emit(f"Load test of {duration:g} s, mix {', '.join(f'{verb}={weight:g}' for verb, weight in mix)}, "
+             f"{f'{rate:g} commands/s' if rate else 'unthrottled'}, over {transport}"
+             f"{' with a secure session' if key_file else ''}; data in {workdir}")
+        emit(f"{'time':>7} {'cmds':>8} {'cmd/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rtt95 ms':>9}"
+             f" {'db KB':>8} {'written':>8} {'rss KB':>8} {'fds':>4} {'thr':>4}")
+        started = time.monotonic()
+        deadline = started + duration
+        next_report = started + every
+        next_send = started
+        handled = 0
+        samples = []  # (elapsed, database bytes, resident KB) per row
+        while True:
+            now = time.monotonic()
+            if now >= next_report or now >= deadline:
+                service, round_trip = stats.take_interval()
+                rss, fds = process_memory()
+                size = database_size(button_detector.DB_FILE)
+                elapsed = now - started
+                interval = elapsed - (samples[-1][0] if samples else 0.0)
+                samples.append((elapsed, size, rss))
+                emit(f"{elapsed:7.0f} {stats.handled:8d} {(stats.handled - handled) / max(interval, 1e-9):8.1f}"
+                     f" {milliseconds(percentile(service, 0.5)):>8} {milliseconds(percentile(service, 0.95)):>8}"
+                     f" {milliseconds(percentile(service, 0.99)):>8} {milliseconds(percentile(round_trip, 0.95)):>9}"
+                     f" {size // 1024:8d} {button_detector.db_writes.flushed:8d} {rss:8d}"
+                     f" {'-' if fds is None else fds:>4} {threading.active_count():4d}")
+                handled = stats.handled
+                next_report += every
+                if now >= deadline:
+                    break
+            if rate:
+                next_send += 1 / rate
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            client.run_one()
+
+        client.send("Q")
+        server.join(30)
+        sock.close()
+    finally:
+        button_detector.accept_session = accept_session
+        if previous_bluetooth is None:
+            sys.modules.pop("bluetooth", None)
+        else:
+            sys.modules["bluetooth"] = previous_bluetooth
+
+    button_detector.db_writes.flush()
+    contacts = count_rows(button_detector, "contacts")
+    expected = initial_contacts + len(client.live)
+    for line in summary(stats, samples, client.sent, time.monotonic() - started):
+        emit(line)
+    emit(f"contacts: {contacts} in the database, {expected} expected"
+         f"{'' if contacts == expected else ' - MUTATIONS WERE LOST'}; messages: {count_rows(button_detector, 'messages')}")
+    log.flush()
+    return 0 if contacts == expected else 1
+
+
+def summary(stats, samples, sent, elapsed):
+    """Return the closing report lines: per-verb latencies, then database and memory growth."""
+    lines = [f"{sent} commands in {elapsed:.1f} s, {stats.handled / max(elapsed, 1e-9):.1f} handled/s",
+             f"{'verb':<8} {'count':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+             f" {'rtt50 ms':>9} {'rtt95 ms':>9} {'rtt99 ms':>9}"]
+    for verb, service in sorted(stats.service.items()):
+        round_trip = stats.round_trip.get(verb)
+        trips = round_trip.values if round_trip is not None else []
+        lines.append(f"{verb:<8} {service.count:8d} {milliseconds(percentile(service.values, 0.5)):>8}"
+                     f" {milliseconds(percentile(service.values, 0.95)):>8}"
+                     f" {milliseconds(percentile(service.values, 0.99)):>8} {milliseconds(service.max):>8}"
+                     f" {milliseconds(percentile(trips, 0.5)):>9} {milliseconds(percentile(trips, 0.95)):>9}"
+                     f" {milliseconds(percentile(trips, 0.99)):>9}")
+    if len(samples) >= 2:
+        # Growth is measured from the first row, after start-up allocations
+        (first_time, first_size, first_rss), (last_time, last_size, last_rss) = samples[0], samples[-1]
+        hours = max(last_time - first_time, 1e-9) / 3600
+        lines.append(f"database: {first_size // 1024} KB -> {last_size // 1024} KB"
+                     f" ({(last_size - first_size) / 1024 / hours:+.0f} KB/h)")
+        lines.append(f"memory: {first_rss} KB -> {last_rss} KB resident ({(last_rss - first_rss) / hours:+.0f} KB/h)")
+    return lines
+
+
+def main(argv):
+    flags = {"--tcp": False}
+    options = {"--every": str(REPORT_EVERY), "--session-key": None, "--db": None, "--seed": None}
+    positional = []
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument in flags:
+            flags[argument] = True
+        elif argument in options:
+            options[argument] = next(arguments, None)
+        else:
+            positional.append(argument)
+    if not 1 <= len(positional) <= 3:
+        print("usage: rfcomm_load.py SECONDS [MIX] [RATE] [--tcp] [--every SECONDS] "
+              "[--session-key FILE] [--db CONTACTS_DB] [--seed N]")
+        print(f"MIX is verb=weight,... of {', '.join(VERBS)} (default {DEFAULT_MIX})")
+        return 2
+    try:
+        duration = float(positional[0])
+        mix = parse_mix(positional[1] if len(positional) > 1 else DEFAULT_MIX)
+        rate = float(positional[2]) if len(positional) > 2 else 0
+        every = float(options["--every"])
+        seed = int(options["--seed"]) if options["--seed"] is not None else None
+    except (TypeError, ValueError) as e:
+        print(f"rfcomm_load.py: {e}")
+        return 2
+    return run(duration, mix, rate, every, "tcp" if flags["--tcp"] else "unix",
+               options["--session-key"], options["--db"], seed)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,460 @@
+"""Authenticated, encrypted session layer for the RFCOMM protocol.
+
+The phone and the device share a random key (the PSK, stored hex-encoded in
+SESSION_KEY_FILE). Before any command is accepted both sides prove they hold
+it, then every command and reply travels in an AEAD-encrypted frame:
+
+    frame   length (2 bytes, big endian) | type (1 byte) | body
+
+    HELLO         client  version, cipher ids offered, client nonce (16),
+                          [ticket id (16), resumption proof (32)]
+    SERVER_HELLO  server  cipher id, resumed flag, server nonce (16), server proof (32)
+    FINISHED      client  client proof (32), full handshakes only
+    TICKET        server  encrypted: ticket id (16), lifetime in seconds (4)
+    DATA          both    encrypted payload
+
+The proofs are HMAC-SHA256 over the handshake transcript keyed with the shared
+secret; the session keys come from HKDF over the same secret and both nonces,
+one key per direction. The 12-byte AEAD nonce is the direction plus a frame
+counter, so frames cannot be replayed, reordered or reflected, and the 3-byte
+frame header is authenticated as associated data.
+
+After a handshake the server issues a single-use ticket. A phone that
+reconnects sends the ticket in its HELLO, already proven with the resumption
+secret of the previous session, so a resumed handshake is a single round trip
+with no FINISHED. Tickets expire after TICKET_LIFETIME and live in memory
+only; a phone whose ticket is unknown falls back to the full handshake.
+
+ChaCha20-Poly1305 is used when the cryptography package is installed. Without
+it the session falls back to BLAKE2b in counter mode with a keyed BLAKE2b tag
+(encrypt-then-MAC), both from hashlib. Each frame costs 19 bytes (header and
+tag). Run this module to measure the per-frame cost:
+
+    python secure_session.py            # frame benchmark
+    python secure_session.py keygen     # write a new SESSION_KEY_FILE
+"""
+
+import hashlib
+import hmac
+import os
+import socket
+import struct
+import threading
+import time
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+except ImportError:  # Optional; the hashlib construction below is used instead
+    ChaCha20Poly1305 = None
+
+SESSION_KEY_FILE = 'session.key'
+PROTOCOL_VERSION = 1
+
+HELLO = 1
+SERVER_HELLO = 2
+FINISHED = 3
+TICKET = 4
+DATA = 5
+
+HEADER = struct.Struct(">HB")
+NONCE_SIZE = 16
+PROOF_SIZE = 32
+TAG_SIZE = 16
+TICKET_ID_SIZE = 16
+MAX_PAYLOAD = 4096          # Plaintext bytes per DATA frame; longer sends are split
+HANDSHAKE_TIMEOUT = 10      # Seconds the peer gets to complete the handshake
+TICKET_LIFETIME = 24 * 60 * 60
+MAX_TICKETS = 32
+
+CLIENT_TO_SERVER = b"c2s\0"
+SERVER_TO_CLIENT = b"s2c\0"
+
+
+class SessionError(ConnectionError):
+    """The handshake failed or a frame did not authenticate."""
+
+
+def hkdf(secret, salt, info, length):
+    """HKDF-SHA256 (RFC 5869)."""
+    prk = hmac.new(salt or bytes(32), secret, hashlib.sha256).digest()
+    output, block = b"", b""
+    counter = 1
+    while len(output) < length:
+        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha256).digest()
+        output += block
+        counter += 1
+    return output[:length]
+
+
+# Keyed BLAKE2b is a PRF, so BLAKE2b(key, nonce | block counter) is a sound
+# stream cipher as long as a (key, nonce) pair never repeats: the keys are new
+# for every session (HKDF over both handshake nonces) and the nonce carries
+# the direction and frame counter. Encrypt-then-MAC, with a MAC key separate
+# from the encryption key, rejects any altered frame before it is decrypted.
+# It is slower than ChaCha20-Poly1305, not weaker, so it stays a fallback
+# rather than making the cryptography package a hard dependency.
+class Blake2Aead:
+    """AEAD from hashlib: BLAKE2b keystream in counter mode, keyed BLAKE2b tag over the ciphertext."""
+
+    cipher_id = 2
+    name = "blake2b-etm"
+
+    def __init__(self, key):
+        self._enc_key = hkdf(key, b"", b"enc", 64)
+        self._mac_key = hkdf(key, b"", b"mac", 64)
+
+    def _keystream(self, nonce, length):
+        blocks = []
+        for counter in range((length + 63) // 64):
+            blocks.append(hashlib.blake2b(nonce + counter.to_bytes(4, "big"), key=self._enc_key).digest())
+        return b"".join(blocks)[:length]
+
+    def _xor(self, nonce, data):
+        if not data:
+            return b""
+        stream = self._keystream(nonce, len(data))
+        return (int.from_bytes(data, "little") ^ int.from_bytes(stream, "little")).to_bytes(len(data), "little")
+
+    def _tag(self, nonce, ciphertext, aad):
+        mac = hashlib.blake2b(key=self._mac_key, digest_size=TAG_SIZE)
+        mac.update(struct.pack(">QQ", len(aad), len(ciphertext)))
+        mac.update(aad)
+        mac.update(nonce)
+        mac.update(ciphertext)
+        return mac.digest()
+
+    def encrypt(self, nonce, data, aad):
+        ciphertext = self._xor(nonce, bytes(data))
+        return ciphertext + self._tag(nonce, ciphertext, aad)
+
+    def decrypt(self, nonce, data, aad):
+        ciphertext, tag = data[:-TAG_SIZE], data[-TAG_SIZE:]
+        if len(data) < TAG_SIZE or not hmac.compare_digest(tag, self._tag(nonce, ciphertext, aad)):
+            raise SessionError("frame failed authentication")
+        return self._xor(nonce, ciphertext)
+
+
+class ChaChaAead:
+    """ChaCha20-Poly1305 from the cryptography package."""
+
+    cipher_id = 1
+    name = "chacha20-poly1305"
+
+    def __init__(self, key):
+        self._aead = ChaCha20Poly1305(key)
+
+    def encrypt(self, nonce, data, aad):
+        return self._aead.encrypt(nonce, bytes(data), aad)
+
+    def decrypt(self, nonce, data, aad):
+        try:
+            return self._aead.decrypt(nonce, data, aad)
+        except Exception:  # cryptography.exceptions.InvalidTag
+            raise SessionError("frame failed authentication") from None
+
+
+# Ciphers in order of preference, by id
+CIPHERS = {cipher.cipher_id: cipher for cipher in ([ChaChaAead] if ChaCha20Poly1305 else []) + [Blake2Aead]}
+
+
+def load_session_key(path=SESSION_KEY_FILE):
+    """Return the PSK stored in path, or None if there is no key file."""
+    try:
+        with open(path) as f:
+            key = bytes.fromhex(f.read().strip())
+    except FileNotFoundError:
+        return None
+    if len(key) < 16:
+        raise ValueError(f"{path}: the session key must be at least 16 bytes")
+    return key
+
+
+def write_session_key(path=SESSION_KEY_FILE):
+    """Create a new random PSK in path (readable by the owner only); return it."""
+    key = os.urandom(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(key.hex() + "\n")
+    return key
+
+
+def send_frame(sock, frame_type, body):
+    sock.sendall(HEADER.pack(len(body), frame_type) + body)
+
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_frame(sock):
+    """Return (type, header, body) of the next frame, or None at end of stream."""
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    length, frame_type = HEADER.unpack(header)
+    body = recv_exact(sock, length)
+    if body is None:
+        return None
+    return frame_type, header, body
+
+
+def expect_frame(sock, frame_type):
+    frame = recv_frame(sock)
+    if frame is None:
+        raise SessionError("connection closed during the handshake")
+    if frame[0] != frame_type:
+        raise SessionError(f"expected frame type {frame_type}, got {frame[0]}")
+    return frame[2]
+
+
+def proof(secret, label, transcript):
+    return hmac.new(secret, label + transcript, hashlib.sha256).digest()
+
+
+class TicketStore:
+    """Resumption secrets of the tickets the server has issued (single use, in memory)."""
+
+    def __init__(self, lifetime=TICKET_LIFETIME, capacity=MAX_TICKETS):
+        self.lifetime = lifetime
+        self.capacity = capacity
+        self._tickets = {}            # ticket id -> (resumption secret, expiry time)
+        self._lock = threading.Lock()
+
+    def issue(self, secret):
+        """Store secret under a new ticket id and return the id."""
+        ticket_id = os.urandom(TICKET_ID_SIZE)
+        with self._lock:
+            now = time.time()
+            self._tickets = {key: value for key, value in self._tickets.items() if value[1] > now}
+            while len(self._tickets) >= self.capacity:
+                del self._tickets[min(self._tickets, key=lambda key: self._tickets[key][1])]
+            self._tickets[ticket_id] = (secret, now + self.lifetime)
+        return ticket_id
+
+    def take(self, ticket_id):
+        """Return and forget the secret of a valid ticket, or None."""
+        with self._lock:
+            secret, expires = self._tickets.pop(ticket_id, (None, 0))
+        return secret if expires > time.time() else None
+
+    def clear(self):
+        with self._lock:
+            self._tickets.clear()
+
+
+class SecureSession:
+    """Encrypted stream over a connected socket, with the socket's send/recv/close interface."""
+
+    def __init__(self, sock, cipher, send_key, recv_key, send_direction, recv_direction, resumed=False):
+        self.sock = sock
+        self.cipher = cipher
+        self.resumed = resumed
+        self.ticket = None            # (ticket id, resumption secret), on the client
+        self._send_aead = cipher(send_key)
+        self._recv_aead = cipher(recv_key)
+        self._send_direction = send_direction
+        self._recv_direction = recv_direction
+        self._send_counter = 0
+        self._recv_counter = 0
+        self._send_lock = threading.Lock()
+
+    def _seal(self, frame_type, payload):
+        header = HEADER.pack(len(payload) + TAG_SIZE, frame_type)
+        nonce = self._send_direction + self._send_counter.to_bytes(8, "big")
+        self._send_counter += 1
+        return header + self._send_aead.encrypt(nonce, payload, header)
+
+    def _open(self, header, body):
+        nonce = self._recv_direction + self._recv_counter.to_bytes(8, "big")
+        self._recv_counter += 1
+        return self._recv_aead.decrypt(nonce, body, header)
+
+    def send_control(self, frame_type, payload):
+        with self._send_lock:
+            self.sock.sendall(self._seal(frame_type, payload))
+
+    def recv_control(self, frame_type):
+        frame = recv_frame(self.sock)
+        if frame is None or frame[0] != frame_type:
+            raise SessionError(f"expected frame type {frame_type}")
+        return self._open(frame[1], frame[2])
+
+    def send(self, data):
+        """Encrypt and send all of data (split into MAX_PAYLOAD frames); return its length."""
+        data = memoryview(data).cast("B")
+        with self._send_lock:
+            frames = [self._seal(DATA, data[start:start + MAX_PAYLOAD])
+                      for start in range(0, max(len(data), 1), MAX_PAYLOAD)]
+            self.sock.sendall(b"".join(frames))
+        return len(data)
+
+    sendall = send
+
+    def recv(self, bufsize=None):
+        """Return the payload of the next DATA frame (b"" at end of stream); bufsize is ignored."""
+        frame = recv_frame(self.sock)
+        if frame is None:
+            return b""
+        frame_type, header, body = frame
+        if frame_type != DATA:
+            raise SessionError(f"unexpected frame type {frame_type}")
+        return self._open(header, body)
+
+    def close(self):
+        self.sock.close()
+
+
+def derive_keys(secret, client_nonce, server_nonce, transcript):
+    keys = hkdf(secret, client_nonce + server_nonce, b"sos rfcomm keys" + transcript, 96)
+    return keys[:32], keys[32:64], keys[64:]  # client to server, server to client, resumption
+
+
+def server_handshake(sock, psk, tickets, timeout=HANDSHAKE_TIMEOUT):
+    """Authenticate a connected client and return its SecureSession; raises SessionError."""
+    previous_timeout = sock.gettimeout()
+    sock.settimeout(timeout)
+    try:
+        hello = expect_frame(sock, HELLO)
+        if len(hello) < 2 or hello[0] != PROTOCOL_VERSION:
+            raise SessionError("unsupported session protocol version")
+        offered = hello[2:2 + hello[1]]
+        rest = hello[2 + hello[1]:]
+        if len(rest) not in (NONCE_SIZE, NONCE_SIZE + TICKET_ID_SIZE + PROOF_SIZE):
+            raise SessionError("malformed HELLO")
+        client_nonce, ticket_id = rest[:NONCE_SIZE], rest[NONCE_SIZE:NONCE_SIZE + TICKET_ID_SIZE]
+        cipher = next((CIPHERS[cipher_id] for cipher_id in offered if cipher_id in CIPHERS), None)
+        if cipher is None:
+            raise SessionError("no cipher in common")
+
+        secret = tickets.take(ticket_id) if ticket_id else None
+        resumed = secret is not None and hmac.compare_digest(
+            hello[-PROOF_SIZE:], proof(secret, b"resume", hello[:-PROOF_SIZE]))
+        if not resumed:
+            secret = psk
+
+        server_nonce = os.urandom(NONCE_SIZE)
+        transcript = hello + bytes([cipher.cipher_id, resumed]) + server_nonce
+        send_frame(sock, SERVER_HELLO, bytes([cipher.cipher_id, resumed]) + server_nonce
+                   + proof(secret, b"server", transcript))
+
+        if not resumed and not hmac.compare_digest(expect_frame(sock, FINISHED),
+                                                   proof(secret, b"client", transcript)):
+            raise SessionError("client failed to prove the session key")
+
+        client_key, server_key, resumption = derive_keys(secret, client_nonce, server_nonce, transcript)
+        session = SecureSession(sock, cipher, server_key, client_key, SERVER_TO_CLIENT, CLIENT_TO_SERVER, resumed)
+        session.send_control(TICKET, tickets.issue(resumption) + struct.pack(">I", tickets.lifetime))
+    except socket.timeout:
+        raise SessionError("handshake timed out") from None
+    finally:
+        sock.settimeout(previous_timeout)
+    return session
+
+
+def client_handshake(sock, psk, ticket=None, ciphers=None):
+    """Authenticate to the server and return a SecureSession; session.ticket resumes the next one.
+
+    This is the phone's side, used by tests and tools on a computer.
+    """
+    offered = bytes(ciphers or list(CIPHERS))
+    client_nonce = os.urandom(NONCE_SIZE)
+    hello = bytes([PROTOCOL_VERSION, len(offered)]) + offered + client_nonce
+    if ticket:
+        hello += ticket[0]
+        hello += proof(ticket[1], b"resume", hello)
+    send_frame(sock, HELLO, hello)
+
+    server_hello = expect_frame(sock, SERVER_HELLO)
+    cipher_id, resumed = server_hello[0], bool(server_hello[1])
+    server_nonce = server_hello[2:2 + NONCE_SIZE]
+    if cipher_id not in CIPHERS or resumed and not ticket:
+        raise SessionError("server chose an unexpected cipher or resumption")
+    secret = ticket[1] if resumed else psk
+    transcript = hello + server_hello[:2] + server_nonce
+    if not hmac.compare_digest(server_hello[2 + NONCE_SIZE:], proof(secret, b"server", transcript)):
+        raise SessionError("server failed to prove the session key")
+    if not resumed:
+        send_frame(sock, FINISHED, proof(secret, b"client", transcript))
+
+    client_key, server_key, resumption = derive_keys(secret, client_nonce, server_nonce, transcript)
+    session = SecureSession(sock, CIPHERS[cipher_id], client_key, server_key,
+                            CLIENT_TO_SERVER, SERVER_TO_CLIENT, resumed)
+    session.ticket = (session.recv_control(TICKET)[:TICKET_ID_SIZE], resumption)
+    return session
+
+
+def timed_handshake(psk, tickets, cipher_id, ticket=None):
+    """Run a handshake over a socket pair; return (client session, seconds)."""
+    server_sock, client_sock = socket.socketpair()
+    thread = threading.Thread(target=server_handshake, args=(server_sock, psk, tickets))
+    thread.start()
+    started = time.perf_counter()
+    client = client_handshake(client_sock, psk, ticket=ticket, ciphers=[cipher_id])
+    thread.join()
+    seconds = time.perf_counter() - started
+    server_sock.close()
+    client_sock.close()
+    return client, seconds
+
+
+# Tickets issued by this process's RFCOMM servers
+server_tickets = TicketStore()
+
+
+def accept_session(sock, key_file=SESSION_KEY_FILE, tickets=server_tickets):
+    """Secure an accepted RFCOMM connection; without a key file, return sock unchanged.
+
+    A key file that cannot be used refuses the connection with SessionError
+    rather than serve it unauthenticated.
+    """
+    try:
+        psk = load_session_key(key_file) if key_file else None
+    except ValueError as e:  # Not hex, or too short
+        print(f"Session key unusable; refusing the connection: {e}")
+        raise SessionError(f"unusable session key: {e}") from None
+    if psk is None:
+        print("No session key configured; the RFCOMM connection is not authenticated.")
+        return sock
+    session = server_handshake(sock, psk, tickets)
+    print(f"Secure session established ({session.cipher.name}{', resumed' if session.resumed else ''}).")
+    return session
+
+
+def benchmark(sizes=(16, 128, 1024, 4096), duration=1.0):
+    """Print the handshake and per-frame cost of each available cipher."""
+    psk = os.urandom(32)
+    for cipher_id, cipher in CIPHERS.items():
+        tickets = TicketStore()
+        client, handshake = timed_handshake(psk, tickets, cipher_id)
+        resumed, resume = timed_handshake(psk, tickets, cipher_id, client.ticket)
+        print(f"{cipher.name}: handshake {handshake * 1000:.2f} ms, "
+              f"resumed ({resumed.resumed}) {resume * 1000:.2f} ms")
+
+        aead = cipher(os.urandom(32))
+        header = HEADER.pack(0, DATA)
+        for size in sizes:
+            payload = os.urandom(size)
+            count = 0
+            started = time.perf_counter()
+            while time.perf_counter() - started < duration:
+                aead.decrypt(bytes(12), aead.encrypt(bytes(12), payload, header), header)
+                count += 1
+            seconds = (time.perf_counter() - started) / count
+            print(f"  {size:5d} B frames: {seconds * 1e6:8.1f} us seal+open, "
+                  f"{size / seconds / 1e6:6.2f} MB/s, {HEADER.size + TAG_SIZE} B overhead")
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["keygen"]:
+        path = sys.argv[2] if len(sys.argv) > 2 else SESSION_KEY_FILE
+        write_session_key(path)
+        print(f"New session key written to {path}; copy it to the phone app.")
+    else:
+        benchmark()
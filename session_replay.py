@@ -0,0 +1,414 @@
+"""Capture and replay of bluetoothctl and UART sessions.
+
+The string matching of the pairing flow ("Invalid command in menu main:",
+"[agent] Authorize service") and the AT parsing of get_gps_location only run
+against real hardware. With SOSD_CAPTURE set to a directory, the program
+records what it writes to and reads from bluetoothctl and /dev/serial0, with
+timing, into transcripts (one JSON object per line):
+
+    {"kind": "uart", "started": 1700000000.0}
+    {"t": 0.004, "dir": "tx", "data": "AT+GPS=1\\r\\n"}
+    {"t": 0.061, "dir": "rx", "data": "\\r\\nOK\\r\\n"}
+
+A replay feeds a transcript back into the unchanged handlers. What was
+received after each command is released relative to the moment the handler
+writes that command again, scaled by speed (2 = twice as fast, 0 = no
+waiting), so a replay reacts to the code under test instead of to the wall
+clock. Writes that differ from the recording are reported as divergences, and
+the time the handler took to answer each piece of output is measured, which
+makes the replay usable for latency regression checks:
+
+    SOSD_CAPTURE=captures python button_detector.py
+    python session_replay.py show captures/uart-20240101-120000.jsonl
+    python session_replay.py gps captures/uart-20240101-120000.jsonl 10
+    python session_replay.py pairing captures/bluetoothctl-20240101-120000.jsonl 0
+"""
+
+import heapq
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import types
+
+from bluetoothctl_session import BluetoothCtl
+
+CAPTURE_DIR = os.environ.get("SOSD_CAPTURE")  # Directory transcripts are recorded into, if set
+
+
+def capture_path(kind):
+    """Return a new transcript path for kind ("uart" or "bluetoothctl") in CAPTURE_DIR."""
+    os.makedirs(CAPTURE_DIR, exist_ok=True)
+    return os.path.join(CAPTURE_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+
+
+class Recorder:
+    """Append timed tx/rx events to a transcript file."""
+
+    def __init__(self, path, kind):
+        self.path = path
+        self._file = open(path, "w")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._file.write(json.dumps({"kind": kind, "started": time.time()}) + "\n")
+        self._file.flush()
+
+    def event(self, direction, data):
+        """Record data (bytes) sent ("tx") or received ("rx") now."""
+        with self._lock:
+            if self._file.closed:
+                return
+            # latin-1 maps every byte to one character, so the bytes survive JSON exactly
+            self._file.write(json.dumps({"t": round(time.monotonic() - self._started, 6),
+                                         "dir": direction, "data": data.decode('latin-1')}) + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def load_transcript(path):
+    """Return (kind, [(t, direction, bytes)]) of a transcript file."""
+    with open(path) as f:
+        header = json.loads(f.readline())
+        events = [json.loads(line) for line in f if line.strip()]
+    return header["kind"], [(event["t"], event["dir"], event["data"].encode('latin-1')) for event in events]
+
+
+class RecordingSerial:
+    """pyserial handle that records everything written to and read from the port."""
+
+    def __init__(self, port, path):
+        self.port = port
+        self.recorder = Recorder(path, "uart")
+
+    @property
+    def in_waiting(self):
+        return self.port.in_waiting
+
+    def read(self, size=1):
+        data = self.port.read(size)
+        if data:
+            self.recorder.event("rx", data)
+        return data
+
+    def readinto(self, buffer):
+        count = self.port.readinto(buffer)
+        if count:
+            self.recorder.event("rx", bytes(buffer[:count]))
+        return count
+
+    def write(self, data):
+        self.recorder.event("tx", data)
+        return self.port.write(data)
+
+    def close(self):
+        self.recorder.close()
+        self.port.close()
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+
+class RecordingBluetoothCtl(BluetoothCtl):
+    """bluetoothctl session that records its input and output."""
+
+    def __init__(self, path, argv=("bluetoothctl",)):
+        super().__init__(argv)
+        self.recorder = Recorder(path, "bluetoothctl")
+
+    def _feed(self, text):
+        self.recorder.event("rx", text.encode('utf-8'))
+        super()._feed(text)
+
+    def send(self, text):
+        self.recorder.event("tx", (text + "\n").encode('utf-8'))
+        super().send(text)
+
+    def close(self):
+        super().close()
+        self.recorder.close()
+
+
+class Player:
+    """Release the received data of a transcript in answer to the writes of the code under test.
+
+    The transcript is split into turns: the data received before the first
+    write, then each write with the data received after it. deliver(data) is
+    called from the player thread.
+    """
+
+    def __init__(self, events, deliver, speed=1.0):
+        self.deliver = deliver
+        self.speed = speed
+        self.turns = [[None, []]]          # [write event, [received events]]
+        for event in events:
+            if event[1] == "tx":
+                self.turns.append([event, []])
+            else:
+                self.turns[-1][1].append(event)
+        self.next_turn = 1
+        self.divergences = []            # Descriptions of writes that differ from the recording
+        self.responses = []              # (write, seconds since the last data was delivered)
+        self._due = []                   # Heap of (release time, sequence, data)
+        self._sequence = 0
+        self._delivering = False
+        self._last_delivery = None
+        self._stopped = False
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._changed:
+            self._schedule(0.0, self.turns[0][1])
+        self._thread = threading.Thread(target=self._run, name="replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._changed:
+            self._stopped = True
+            self._changed.notify_all()
+
+    def finished(self):
+        """True once every write has been seen and everything received has been delivered."""
+        with self._changed:
+            return self._stopped or (self.next_turn >= len(self.turns) and not self._due
+                                     and not self._delivering)
+
+    def _schedule(self, recorded_at, received):
+        now = time.monotonic()
+        for t, _, data in received:
+            delay = (t - recorded_at) / self.speed if self.speed else 0.0
+            heapq.heappush(self._due, (now + delay, self._sequence, data))
+            self._sequence += 1
+        self._changed.notify_all()
+
+    def write(self, data):
+        """Take one write of the code under test and schedule the data recorded after it."""
+        with self._changed:
+            if self._last_delivery is not None:
+                self.responses.append((data, time.monotonic() - self._last_delivery))
+            if self.next_turn >= len(self.turns):
+                self.divergences.append(f"write {data!r} after the end of the transcript")
+                return
+            (t, _, expected), received = self.turns[self.next_turn]
+            if data != expected:
+                self.divergences.append(f"write {self.next_turn}: expected {expected!r}, got {data!r}")
+            self.next_turn += 1
+            self._schedule(t, received)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._stopped and (not self._due or self._due[0][0] > time.monotonic()):
+                    self._changed.wait(self._due[0][0] - time.monotonic() if self._due else None)
+                if self._stopped:
+                    return
+                _, _, data = heapq.heappop(self._due)
+                self._delivering = True
+            try:
+                self.deliver(data)  # Outside the lock: the receiver may write back
+            finally:
+                with self._changed:
+                    self._delivering = False
+                    self._last_delivery = time.monotonic()
+                    self._changed.notify_all()
+
+    def report(self):
+        """Return the replay result as text lines."""
+        lines = [f"writes replayed: {self.next_turn - 1} of {len(self.turns) - 1}",
+                 f"divergences: {len(self.divergences)}"]
+        lines += [f"  {divergence}" for divergence in self.divergences]
+        if self.responses:
+            slowest = max(self.responses, key=lambda response: response[1])
+            total = sum(seconds for _, seconds in self.responses)
+            lines.append(f"response time: mean {total / len(self.responses) * 1000:.1f} ms, "
+                         f"slowest {slowest[1] * 1000:.1f} ms before {slowest[0]!r}")
+        return lines
+
+
+class ReplaySerial:
+    """pyserial-like port that replays a UART transcript."""
+
+    def __init__(self, path, speed=1.0, timeout=1):
+        kind, events = load_transcript(path)
+        if kind != "uart":
+            raise ValueError(f"{path} is a {kind} transcript, not a UART one")
+        self.timeout = timeout
+        self._output = queue.Queue()
+        self._pending = b""
+        self.player = Player(events, self._output.put, speed).start()
+
+    @property
+    def in_waiting(self):
+        return len(self._pending) + self._output.qsize()
+
+    def read(self, size=1):
+        if not self._pending:
+            try:
+                self._pending = self._output.get(timeout=self.timeout)
+            except queue.Empty:
+                return b""
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def write(self, data):
+        self.player.write(bytes(data))
+        return len(data)
+
+    def close(self):
+        self.player.stop()
+
+
+class ReplayBluetoothCtl(BluetoothCtl):
+    """bluetoothctl session that replays a transcript instead of running bluetoothctl.
+
+    It stops running once the transcript is used up, like bluetoothctl exiting.
+    """
+
+    def __init__(self, path, speed=1.0):
+        super().__init__(("replay", path))
+        kind, events = load_transcript(path)
+        if kind != "bluetoothctl":
+            raise ValueError(f"{path} is a {kind} transcript, not a bluetoothctl one")
+        self.player = Player(events, lambda data: self._feed(data.decode('utf-8', errors='replace')), speed)
+
+    def start(self):
+        self.player.start()
+        return self
+
+    def is_running(self):
+        return not self.player.finished()
+
+    def send(self, text):
+        with self._write_lock:
+            self.player.write((text + "\n").encode('utf-8'))
+
+    def close(self):
+        self.player.stop()
+
+
+def scaled(seconds, speed):
+    """Return a wait of the code under test at replay speed."""
+    return seconds / speed if speed else 0.0
+
+
+def show(path):
+    """Print a transcript with timestamps."""
+    kind, events = load_transcript(path)
+    print(f"{kind} transcript, {len(events)} events")
+    for t, direction, data in events:
+        print(f"{t:10.3f} {'>>' if direction == 'tx' else '<<'} {data!r}")
+
+
+class ReplayGPIO:
+    """Stand-in for RPi.GPIO off the device: buttons read as released, outputs are ignored."""
+
+    BCM = 11
+    IN, OUT = 1, 0
+    HIGH, LOW = 1, 0
+    PUD_UP = 22
+
+    def __init__(self):
+        self.mode = None
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def getmode(self):
+        return self.mode
+
+    def setup(self, pin, direction, pull_up_down=None):
+        pass
+
+    def output(self, pin, value):
+        pass
+
+    def input(self, pin):
+        return self.HIGH  # The buttons have pull-ups
+
+    def setwarnings(self, flag):
+        pass
+
+    def cleanup(self, pins=None):
+        pass
+
+
+def install_gpio_stand_in():
+    """Install ReplayGPIO as RPi.GPIO unless the real module works here, so button_detector imports."""
+    try:
+        import RPi.GPIO  # noqa: F401
+    except (ImportError, RuntimeError):  # RuntimeError: RPi.GPIO is installed, but this is not a Pi
+        package = types.ModuleType("RPi")
+        package.GPIO = ReplayGPIO()
+        sys.modules["RPi"] = package
+        sys.modules["RPi.GPIO"] = package.GPIO
+
+
+def replay_gps(path, speed):
+    """Run get_gps_location, and the SOS it starts, against a recorded UART session.
+
+    The SMS part only replays cleanly with the contacts.db of the recording.
+    """
+    install_gpio_stand_in()
+    import button_detector
+    from a9g_modem import ModemEngine
+
+    button_detector.warm_up()  # The SOS fan-out after the fix reads contacts.db
+    port = ReplaySerial(path, speed)
+    button_detector.modem = ModemEngine(port)
+    # The handler's own waits are part of the session too
+    button_detector.GPS_FIX_WAIT = scaled(button_detector.GPS_FIX_WAIT, speed)
+    button_detector.GPS_RETRY_DELAY = scaled(button_detector.GPS_RETRY_DELAY, speed)
+    started = time.monotonic()
+    result = button_detector.get_gps_location()
+    print(f"get_gps_location() returned {result} after {time.monotonic() - started:.2f} s")
+    button_detector.modem.stop()
+    return port.player
+
+
+def replay_pairing(path, speed, scan=True):
+    """Run the pairing flow against a recorded bluetoothctl session.
+
+    sdptool and the RFCOMM server are not part of the transcript; the replay
+    only reports that the flow reached them.
+    """
+    install_gpio_stand_in()
+    import bluetoothctl_session
+    import button_detector
+
+    ctl = ReplayBluetoothCtl(path, speed).start()
+    bluetoothctl_session.session = ctl
+    button_detector.warmup_done.set()
+    button_detector.register_serial_port = lambda channel: print(f"[replay] sdptool add --channel={channel} SP")
+    button_detector.start_rfcomm_server = lambda accept_timeout=None, authorised=False: print(
+        f"[replay] RFCOMM server started (authorised={authorised})")
+    button_detector.PAIRING_COUNTDOWN = scaled(button_detector.PAIRING_COUNTDOWN, speed)
+    started = time.monotonic()
+    button_detector.run_pairing_flow(scan)
+    print(f"Pairing flow ended after {time.monotonic() - started:.2f} s")
+    return ctl.player
+
+
+def main(argv):
+    if len(argv) < 2 or argv[0] not in ("show", "gps", "pairing"):
+        print("usage: session_replay.py show|gps|pairing TRANSCRIPT [speed]")
+        return 2
+    path = argv[1]
+    speed = float(argv[2]) if len(argv) > 2 else 1.0
+    if argv[0] == "show":
+        show(path)
+        return 0
+    player = replay_gps(path, speed) if argv[0] == "gps" else replay_pairing(path, speed)
+    for line in player.report():
+        print(line)
+    return 1 if player.divergences else 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,157 @@
+"""Precomputed SOS payloads.
+
+Everything an SOS fan-out needs except the coordinates is prepared here ahead
+of the button press: the priority-ordered recipients, the AT+CMGS commands for
+each of them, every saved message split into SMS-sized segments and encoded to
+the bytes written to the A9G, and the send order. At send time only the
+location text is formatted and encoded.
+"""
+
+# Characters of the GSM 03.38 default alphabet (one septet each)
+GSM7_BASIC = (
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Characters of the GSM 03.38 extension table (escape + septet, two each)
+GSM7_EXTENDED = "^{}\\[~]|€\f"
+
+GSM7_SEGMENT_LENGTH = 160  # Septets in a single text mode SMS
+GSM7_REPLACEMENT = "?"     # Sent in place of characters outside the GSM alphabet
+
+CTRL_Z = chr(26)  # Terminates the message body after the AT+CMGS prompt
+
+# Fan-out orders understood by schedule_sos_messages
+SCHEDULE_MODES = ("location_first", "per_contact")
+
+# Placeholder for the location in a schedule; replaced by the fix at send time
+LOCATION = object()
+
+
+def schedule_sos_messages(contact_numbers, messages, location_text, mode="location_first", contact_messages=None):
+    """Return the (contact, message) send order for an SOS fan-out.
+
+    contact_messages maps a contact to the templates sent to that contact only,
+    after the messages sent to everyone.
+    """
+    contact_messages = contact_messages or {}
+    if mode == "per_contact":
+        # Every message followed by the location to one contact, then the next contact
+        return [(contact, message)
+                for contact in contact_numbers
+                for message in list(messages) + list(contact_messages.get(contact, ())) + [location_text]]
+
+    if mode != "location_first":
+        print(f"Unknown SOS schedule mode '{mode}'. Using 'location_first'.")
+
+    # Location to every contact first, then each message round across all contacts
+    schedule = [(contact, location_text) for contact in contact_numbers]
+    for message in messages:
+        schedule.extend((contact, message) for contact in contact_numbers)
+    # Then the templates, one round at a time across the contacts that have them
+    rounds = max((len(contact_messages.get(contact, ())) for contact in contact_numbers), default=0)
+    for index in range(rounds):
+        schedule.extend((contact, contact_messages[contact][index]) for contact in contact_numbers
+                        if index < len(contact_messages.get(contact, ())))
+    return schedule
+
+
+def gsm7_length(text):
+    """Return the number of septets needed for text, or None if it is not GSM-7."""
+    length = 0
+    for char in text:
+        if char in GSM7_BASIC:
+            length += 1
+        elif char in GSM7_EXTENDED:
+            length += 2
+        else:
+            return None
+    return length
+
+
+def to_gsm7(text):
+    """Replace the characters the GSM alphabet lacks with GSM7_REPLACEMENT."""
+    return "".join(char if char in GSM7_BASIC or char in GSM7_EXTENDED else GSM7_REPLACEMENT
+                   for char in text)
+
+
+def split_sms_segments(text):
+    """Split a message into SMS-sized segments, breaking on whitespace when possible.
+
+    The A9G is driven in text mode with its GSM character set, so messages go
+    out as GSM-7 only: characters outside it are replaced first, and segments
+    are measured in the septets that are actually sent.
+    """
+    text = to_gsm7(text)
+    limit, measure = GSM7_SEGMENT_LENGTH, gsm7_length
+
+    segments = []
+    remaining = text
+    while measure(remaining) > limit:
+        # Longest prefix that still fits in one segment
+        end = limit
+        while measure(remaining[:end]) > limit:
+            end -= 1
+
+        # Prefer to break after the last space inside that prefix
+        space = remaining.rfind(" ", 0, end)
+        if space > 0:
+            end = space + 1
+
+        segments.append(remaining[:end].rstrip())
+        remaining = remaining[end:].lstrip()
+
+    if remaining or not segments:
+        segments.append(remaining)
+    return segments
+
+
+def encode_sms_body(text):
+    """Encode one SMS segment as the bytes written after the AT+CMGS prompt."""
+    return (text + CTRL_Z).encode()
+
+
+def encode_cmgs_command(contact):
+    """Encode the AT+CMGS command that opens an SMS to contact."""
+    return f'AT+CMGS="{contact}"\r\n'.encode()
+
+
+class SosPlan:
+    """Recipients, encoded bodies and send order for one SOS fan-out."""
+
+    def __init__(self, contact_numbers, messages, mode="location_first", contact_messages=None):
+        self.recipients = tuple(contact_numbers)
+        self.messages = tuple(messages)
+        self.mode = mode
+        # Templates of the recipients only; the others are never sent
+        self.contact_messages = {contact: tuple(texts) for contact, texts in (contact_messages or {}).items()
+                                 if contact in self.recipients and texts}
+
+        # AT+CMGS command for every recipient
+        self.cmgs_commands = {contact: encode_cmgs_command(contact) for contact in self.recipients}
+
+        # Every saved message split into segments and encoded once
+        self.message_payloads = {
+            message: tuple(encode_sms_body(segment) for segment in split_sms_segments(message))
+            for message in self.messages + tuple(text for texts in self.contact_messages.values() for text in texts)
+        }
+
+        # Send order with the location left as a placeholder
+        self.schedule = tuple(schedule_sos_messages(self.recipients, self.messages, LOCATION, mode,
+                                                    self.contact_messages))
+
+    def __len__(self):
+        """Return the number of scheduled messages (before segmentation)."""
+        return len(self.schedule)
+
+    def location_payload(self, latitude, longitude):
+        """Format and encode the location message for a fix."""
+        return tuple(encode_sms_body(segment)
+                     for segment in split_sms_segments(f"{latitude},{longitude}"))
+
+    def sends(self, latitude, longitude):
+        """Yield (contact, cmgs_command, body) for every SMS of the fan-out, in order."""
+        location = self.location_payload(latitude, longitude)
+        for contact, message in self.schedule:
+            payload = location if message is LOCATION else self.message_payloads[message]
+            for body in payload:
+                yield contact, self.cmgs_commands[contact], body
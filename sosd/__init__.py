@@ -0,0 +1,18 @@
+"""SOS device daemon.
+
+Runs the whole device as one supervised process (``python -m sosd``) instead
+of one script per feature. Each subsystem lives in its own module:
+
+    storage    contacts.db connection, track file and SOS plan
+    leds       LED patterns
+    modem      A9G power and the SOS flow on the shared modem engine
+    bluetooth  pairing and the RFCOMM server
+    inputs     button polling
+    power      modem sleep, GPS and discoverability duty cycling
+
+config.py holds the device settings read from sosd.ini (reloaded on SIGHUP).
+
+The device logic itself stays in button_detector; the subsystems drive it.
+detect.py, final.py, capstone.py and button_led_control.py, the scripts this
+package replaced, only start the daemon.
+"""
@@ -0,0 +1,5 @@
+from startup_timing import startup  # First import: starts the startup clock
+from sosd.daemon import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Bluetooth subsystem: pairing through bluetoothctl, then the RFCOMM server."""
+
+import queue
+
+from sosd.daemon import Subsystem
+
+PAIR = "pair"
+
+
+class BluetoothSubsystem(Subsystem):
+    """Run the Bluetooth connection flow when asked to pair."""
+
+    name = "bluetooth"
+
+    def __init__(self, device):
+        super().__init__()
+        self.device = device
+
+    def handle(self, event):
+        if event != PAIR:
+            super().handle(event)
+            return
+        self.device.manage_bluetooth_connection()
+
+        # Presses made while the flow was running do not start it again
+        while True:
+            try:
+                self.inbox.get_nowait()
+            except queue.Empty:
+                break
@@ -0,0 +1,296 @@
+"""Device configuration.
+
+Pins, RFCOMM channels, delays and modem timeouts are read from an INI file
+(SOSD_CONFIG, default sosd.ini). Every key is optional; anything left out keeps
+its default:
+
+    [pins]
+    button_bluetooth = 23
+    a9g_power = 17
+
+    [bluetooth]
+    rfcomm_channel = 23
+    fast_reconnect = yes
+
+    [timeouts]
+    at_command = 5
+    gps_fix_wait = 6
+
+    [sos]
+    schedule_mode = location_first
+    location_upload_url = http://example.org/track
+
+    [power]
+    policy = standby
+    battery_mah = 10000
+
+Each setting maps onto a module constant of button_detector, which the flows
+read when they run. Applying a configuration only rebinds those constants, so a
+reload (SIGHUP or the "reload config" RFCOMM command) takes effect on the next
+press, connection or AT command, without a restart and without touching the
+modem engine. A file that does not validate is rejected as a whole and the
+running configuration stays in place.
+"""
+
+import configparser
+import os
+import threading
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+from sos_plan import SCHEDULE_MODES
+from sosd.power import POLICIES
+
+CONFIG_FILE = os.environ.get("SOSD_CONFIG", "sosd.ini")
+
+GPIO_PINS = (0, 27)        # BCM numbers on the 40-pin header
+RFCOMM_CHANNELS = (1, 30)  # Valid RFCOMM server channels
+
+
+def setting(target, default, low=None, high=None, choices=None):
+    """Declare a setting that sets the device constant target."""
+    return field(default=default, metadata={"target": target, "low": low, "high": high, "choices": choices})
+
+
+class Section:
+    """Base of the config sections; checks every setting against its bounds."""
+
+    def __post_init__(self):
+        for item in fields(self):
+            value = getattr(self, item.name)
+            low, high, choices = item.metadata["low"], item.metadata["high"], item.metadata["choices"]
+            if value is None:
+                continue
+            if low is not None and value < low or high is not None and value > high:
+                raise ValueError(f"{self.name}.{item.name} = {value} is outside {low}..{high}")
+            if choices is not None and value not in choices:
+                raise ValueError(f"{self.name}.{item.name} = {value!r} is not one of {', '.join(choices)}")
+
+
+@dataclass(frozen=True)
+class PinConfig(Section):
+    name = "pins"
+    button_bluetooth: int = setting("BUTTON_PIN_1", 23, *GPIO_PINS)
+    button_a9g: int = setting("BUTTON_PIN_2", 24, *GPIO_PINS)
+    led_green: int = setting("LED_PIN", 12, *GPIO_PINS)
+    led_blue: int = setting("LED_BLUE", 6, *GPIO_PINS)
+    a9g_power: int = setting("A9G_POWER_PIN", 17, *GPIO_PINS)
+
+    def __post_init__(self):
+        super().__post_init__()
+        pins = [getattr(self, item.name) for item in fields(self)]
+        if len(set(pins)) != len(pins):
+            raise ValueError(f"pins must all differ, got {pins}")
+
+
+@dataclass(frozen=True)
+class BluetoothConfig(Section):
+    name = "bluetooth"
+    rfcomm_channel: int = setting("RFCOMM_CHANNEL", 23, *RFCOMM_CHANNELS)
+    fallback_channel_min: int = setting("RFCOMM_FALLBACK_MIN", 24, *RFCOMM_CHANNELS)
+    fallback_channel_max: int = setting("RFCOMM_FALLBACK_MAX", 30, *RFCOMM_CHANNELS)
+    pairing_countdown: float = setting("PAIRING_COUNTDOWN", 10.0, 1, 300)
+    command_timeout: float = setting("BLUETOOTHCTL_TIMEOUT", 5.0, 0.5, 60)
+    session_key_file: Optional[str] = setting("SESSION_KEY_FILE", "session.key")
+    fast_reconnect: bool = setting("FAST_RECONNECT", True)
+    reconnect_wait: float = setting("RECONNECT_WAIT", 8.0, 1, 120)
+    reconnect_initiate: bool = setting("RECONNECT_INITIATE", False)
+    trusted_devices_file: str = setting("TRUSTED_DEVICES_FILE", "trusted_devices.json")
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.fallback_channel_min > self.fallback_channel_max:
+            raise ValueError("bluetooth.fallback_channel_min is above fallback_channel_max")
+
+
+@dataclass(frozen=True)
+class TimeoutConfig(Section):
+    name = "timeouts"
+    at_command: float = setting("AT_COMMAND_TIMEOUT", 5.0, 0.1, 120)
+    sms_prompt: float = setting("SMS_PROMPT_TIMEOUT", 5.0, 0.1, 120)
+    sms_send: float = setting("SMS_SEND_TIMEOUT", 30.0, 1, 300)
+    gps_fix_wait: float = setting("GPS_FIX_WAIT", 6.0, 0, 120)
+    gps_retry_delay: float = setting("GPS_RETRY_DELAY", 2.0, 0, 120)
+    a9g_power_on: float = setting("A9G_POWER_ON_DELAY", 10.0, 0, 60)
+    long_press: float = setting("LONG_PRESS_SECONDS", 3.0, 0.5, 30)
+    button_poll: float = setting("BUTTON_POLL_INTERVAL", 0.1, 0.01, 1)
+
+
+@dataclass(frozen=True)
+class SosConfig(Section):
+    name = "sos"
+    schedule_mode: str = setting("SOS_SCHEDULE_MODE", "location_first", choices=SCHEDULE_MODES)
+    sms_retry_rounds: int = setting("SMS_RETRY_ROUNDS", 2, 0, 10)
+    voice_escalation_contacts: int = setting("VOICE_ESCALATION_CONTACTS", 2, 0, 20)
+    tracking_duration: int = setting("SOS_TRACKING_DURATION", 30 * 60, 0, 24 * 60 * 60)
+    tracking_sms_interval: int = setting("TRACKING_SMS_INTERVAL", 10 * 60, 60, 24 * 60 * 60)
+    location_upload_url: Optional[str] = setting("LOCATION_UPLOAD_URL", None)
+    sms_commands: bool = setting("SMS_COMMANDS", True)
+    locate_attempts: int = setting("LOCATE_ATTEMPTS", 3, 1, 20)
+    sms_modems: str = setting("SMS_MODEMS", "")
+    modem_backend: str = setting("MODEM_BACKEND", "thread", choices=("thread", "asyncio"))
+
+
+@dataclass(frozen=True)
+class PowerConfig(Section):
+    name = "power"
+    policy: str = setting("POWER_POLICY", "balanced", choices=tuple(POLICIES))
+    battery_mah: int = setting("BATTERY_CAPACITY_MAH", 0, 0, 1000000)
+
+
+@dataclass(frozen=True)
+class LogConfig(Section):
+    name = "log"
+    level: str = setting("LOG_LEVEL", "info", choices=("debug", "info", "warning", "error"))
+    file: Optional[str] = setting("LOG_FILE", "sosd.log")
+    max_kb: int = setting("LOG_MAX_KB", 1024, 16, 64 * 1024)
+    backups: int = setting("LOG_BACKUPS", 3, 0, 20)
+    console: bool = setting("LOG_CONSOLE", True)
+
+
+@dataclass(frozen=True)
+class ProfileConfig(Section):
+    name = "profile"
+    enabled: bool = setting("PROFILING", False)
+    interval: float = setting("PROFILE_INTERVAL", 0.02, 0.005, 1)
+    directory: str = setting("PROFILE_DIR", "profiles")
+
+
+@dataclass(frozen=True)
+class Config:
+    pins: PinConfig = field(default_factory=PinConfig)
+    bluetooth: BluetoothConfig = field(default_factory=BluetoothConfig)
+    timeouts: TimeoutConfig = field(default_factory=TimeoutConfig)
+    sos: SosConfig = field(default_factory=SosConfig)
+    power: PowerConfig = field(default_factory=PowerConfig)
+    log: LogConfig = field(default_factory=LogConfig)
+    profile: ProfileConfig = field(default_factory=ProfileConfig)
+
+    def settings(self):
+        """Return {device constant: value} for every setting."""
+        values = {}
+        for section in fields(self):
+            section = getattr(self, section.name)
+            for item in fields(section):
+                values[item.metadata["target"]] = getattr(section, item.name)
+        return values
+
+
+def convert(text, kind):
+    """Convert an INI value to the annotated type of its setting."""
+    if kind is Optional[str]:
+        return text or None
+    if kind is int:
+        return int(text, 0)
+    if kind is bool:
+        if text.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+            raise ValueError(text)
+        return configparser.ConfigParser.BOOLEAN_STATES[text.lower()]
+    return kind(text)
+
+
+def parse_config(parser):
+    """Build a Config from a ConfigParser; raises ValueError on unknown or invalid settings."""
+    sections = {item.name: item.default_factory for item in fields(Config)}
+    unknown = set(parser.sections()) - set(sections)
+    if unknown:
+        raise ValueError(f"unknown section [{sorted(unknown)[0]}]")
+
+    values = {}
+    for name, section_class in sections.items():
+        if not parser.has_section(name):
+            continue
+        types = {item.name: item.type for item in fields(section_class)}
+        options = {}
+        for key, text in parser.items(name):
+            if key not in types:
+                raise ValueError(f"unknown setting {name}.{key}")
+            try:
+                options[key] = convert(text.strip(), types[key])
+            except ValueError:
+                raise ValueError(f"{name}.{key} = {text!r} is not a valid {types[key].__name__}") from None
+        values[name] = section_class(**options)
+    return Config(**values)
+
+
+def read_parser(path):
+    """Return a ConfigParser holding path (empty if the file does not exist)."""
+    parser = configparser.ConfigParser(interpolation=None)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                parser.read_file(f)
+        except configparser.Error as e:
+            raise ValueError(f"{path}: {' '.join(str(e).split())}") from None
+    return parser
+
+
+def load_config(path=CONFIG_FILE):
+    """Read and validate path; a missing file gives the defaults."""
+    return parse_config(read_parser(path))
+
+
+class ConfigManager:
+    """Keep the device constants in step with the configuration file."""
+
+    def __init__(self, device, path=CONFIG_FILE):
+        self.device = device
+        self.path = path
+        self.config = Config()
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback({constant: old value}) after a load changed any constants."""
+        self._listeners.append(callback)
+
+    def load(self):
+        """Load the file and apply it; return {constant: old value} of what changed.
+
+        Raises ValueError, leaving the current configuration applied, if the
+        file does not validate.
+        """
+        with self._lock:
+            config = load_config(self.path)
+            changed = {}
+            for name, value in config.settings().items():
+                old = getattr(self.device, name, None)
+                if old != value:
+                    changed[name] = old
+                    setattr(self.device, name, value)
+            self.config = config
+        if changed:
+            for callback in self._listeners:
+                callback(changed)
+        return changed
+
+    def items(self, prefix=None):
+        """Return [(section.key, value)] of the current settings, optionally under prefix."""
+        found = []
+        for section in fields(self.config):
+            values = getattr(self.config, section.name)
+            for item in fields(values):
+                name = f"{section.name}.{item.name}"
+                if prefix is None or name == prefix or name.startswith(prefix + "."):
+                    found.append((name, getattr(values, item.name)))
+        if not found:
+            raise ValueError(f"unknown setting {prefix}")
+        return found
+
+    def update(self, name, value):
+        """Set section.key to value in the file and apply it; return the changed constants.
+
+        The edited file is validated before it replaces the old one, so a bad
+        value raises ValueError and changes nothing.
+        """
+        section, _, key = name.partition(".")
+        with self._lock:
+            parser = read_parser(self.path)
+            if not parser.has_section(section):
+                parser.add_section(section)
+            parser.set(section, key, value)
+            parse_config(parser)
+            with open(self.path + ".tmp", "w") as f:
+                parser.write(f)
+            os.replace(self.path + ".tmp", self.path)
+        return self.load()
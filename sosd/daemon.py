@@ -0,0 +1,227 @@
+"""Supervisor for the SOS device subsystems.
+
+The daemon runs every subsystem (storage, leds, modem, bluetooth, input) on
+its own thread inside one process, so they share one modem engine and one
+database connection. A watchdog checks them every WATCHDOG_INTERVAL seconds: a
+subsystem whose thread died is started again in place, with an increasing
+delay if it keeps crashing, and a subsystem that reports itself unhealthy is
+asked to recover. The other subsystems, and the modem's warm state, are not
+touched.
+
+SIGHUP asks the daemon to reload its configuration; the reload runs on the
+watchdog thread and leaves every subsystem running.
+"""
+
+import queue
+import signal
+import threading
+import time
+import traceback
+
+WATCHDOG_INTERVAL = 2   # Seconds between watchdog checks
+RESTART_DELAY = 1       # Seconds before the first restart of a crashed subsystem
+MAX_RESTART_DELAY = 60  # Upper bound of the restart back-off
+STABLE_AFTER = 60       # Seconds a subsystem must run before its back-off resets
+
+
+class Subsystem:
+    """A unit of the daemon with its own thread.
+
+    Override setup() for one-time initialisation, run() for the main loop (by
+    default it passes inbox events to handle()), and teardown() for shutdown.
+    """
+
+    name = "subsystem"
+
+    def __init__(self):
+        self.daemon = None
+        self.inbox = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.started_at = None
+        self.restarts = 0
+        self.last_error = None
+
+    def setup(self):
+        """Prepare the subsystem; called once, before the first run()."""
+
+    def run(self):
+        """Main loop; runs until stop_event is set."""
+        while not self.stop_event.is_set():
+            try:
+                event = self.inbox.get(timeout=1)
+            except queue.Empty:
+                continue
+            self.handle(event)
+
+    def handle(self, event):
+        """Handle one event posted to this subsystem."""
+        print(f"{self.name}: ignoring event {event!r}")
+
+    def healthy(self):
+        """Return False if the subsystem needs recover() although its thread is alive."""
+        return True
+
+    def recover(self):
+        """Repair the subsystem in place after healthy() returned False."""
+
+    def teardown(self):
+        """Release what setup() acquired; called once at shutdown."""
+
+    def post(self, event):
+        """Queue an event for handle()."""
+        self.inbox.put(event)
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+class Daemon:
+    """Start, watch and stop a set of subsystems."""
+
+    def __init__(self, subsystems, gpio=None, on_reload=None):
+        self.subsystems = list(subsystems)
+        self.gpio = gpio
+        self.on_reload = on_reload    # Called on SIGHUP to reload the configuration
+        self.stop_event = threading.Event()
+        self.reload_event = threading.Event()
+        self._restart_at = {}  # Subsystem name -> time its restart is due
+        for subsystem in self.subsystems:
+            subsystem.daemon = self
+
+    def __getitem__(self, name):
+        for subsystem in self.subsystems:
+            if subsystem.name == name:
+                return subsystem
+        raise KeyError(name)
+
+    def post(self, name, event):
+        """Queue an event for the subsystem called name."""
+        self[name].post(event)
+
+    def start(self):
+        """Set up and launch every subsystem in order."""
+        if self.gpio is not None:
+            self.gpio.setwarnings(False)
+            self.gpio.setmode(self.gpio.BCM)
+        for subsystem in self.subsystems:
+            subsystem.setup()
+            self._launch(subsystem)
+        print(f"Daemon started: {', '.join(subsystem.name for subsystem in self.subsystems)}")
+
+    def _launch(self, subsystem):
+        subsystem.stop_event.clear()
+        subsystem.started_at = time.time()
+        subsystem.thread = threading.Thread(target=self._run_subsystem, args=(subsystem,),
+                                            name=subsystem.name, daemon=True)
+        subsystem.thread.start()
+
+    def _run_subsystem(self, subsystem):
+        try:
+            subsystem.run()
+        except Exception as e:
+            subsystem.last_error = e
+            print(f"Subsystem '{subsystem.name}' crashed: {e}")
+            traceback.print_exc()
+
+    def _restart_delay(self, subsystem):
+        if subsystem.started_at and time.time() - subsystem.started_at >= STABLE_AFTER:
+            subsystem.restarts = 0
+        return min(MAX_RESTART_DELAY, RESTART_DELAY * 2 ** subsystem.restarts)
+
+    def check(self):
+        """One watchdog pass: restart dead subsystems and recover unhealthy ones."""
+        now = time.time()
+        for subsystem in self.subsystems:
+            if self.stop_event.is_set():
+                return
+            if not subsystem.is_alive():
+                due = self._restart_at.setdefault(subsystem.name, now + self._restart_delay(subsystem))
+                if now >= due:
+                    del self._restart_at[subsystem.name]
+                    subsystem.restarts += 1
+                    print(f"Restarting subsystem '{subsystem.name}' (restart {subsystem.restarts}).")
+                    self._launch(subsystem)
+            elif not subsystem.healthy():
+                print(f"Subsystem '{subsystem.name}' is unhealthy. Recovering...")
+                try:
+                    subsystem.recover()
+                except Exception as e:
+                    print(f"Failed to recover subsystem '{subsystem.name}': {e}")
+
+    def run_forever(self):
+        """Start the subsystems and watch them until SIGINT/SIGTERM."""
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop_event.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop_event.set())
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.reload_event.set())
+        self.start()
+        try:
+            while not self.stop_event.wait(WATCHDOG_INTERVAL):
+                if self.reload_event.is_set():
+                    self.reload_event.clear()
+                    self.reload()
+                self.check()
+        finally:
+            self.stop()
+
+    def reload(self):
+        """Reload the configuration in place."""
+        if self.on_reload is None:
+            print("No configuration to reload.")
+            return
+        try:
+            self.on_reload()
+        except Exception as e:
+            print(f"Failed to reload the configuration: {e}")
+
+    def stop(self):
+        """Stop every subsystem in reverse order."""
+        self.stop_event.set()
+        for subsystem in reversed(self.subsystems):
+            subsystem.stop_event.set()
+        for subsystem in reversed(self.subsystems):
+            if subsystem.thread is not None:
+                subsystem.thread.join(timeout=5)
+            try:
+                subsystem.teardown()
+            except Exception as e:
+                print(f"Failed to tear down subsystem '{subsystem.name}': {e}")
+        if self.gpio is not None:
+            self.gpio.cleanup()
+        print("Daemon stopped.")
+
+
+def build_daemon():
+    """Create the daemon with the standard subsystems around button_detector's flows."""
+    import RPi.GPIO as GPIO
+    import button_detector as device
+    from sosd.bluetooth import BluetoothSubsystem
+    from sosd.inputs import InputSubsystem
+    from sosd.leds import LedSubsystem
+    from sosd.modem import ModemSubsystem
+    from sosd.power import PowerSubsystem
+    from sosd.storage import StorageSubsystem
+
+    device.reload_config()  # Pins and timeouts must be known before the subsystems set up
+    device.configure_log()
+    device.log.capture_stdout()  # print() output goes through the log's writer thread
+    return Daemon([
+        StorageSubsystem(device),
+        LedSubsystem(device.leds, [device.LED_PIN, device.LED_BLUE]),
+        ModemSubsystem(device),
+        BluetoothSubsystem(device),
+        InputSubsystem(device),
+        PowerSubsystem(device.power),
+    ], gpio=GPIO, on_reload=device.reload_config)
+
+
+def main():
+    from startup_timing import startup
+    startup.mark("imports")
+    daemon = build_daemon()
+    startup.mark("daemon")
+    try:
+        daemon.run_forever()
+    finally:
+        import button_detector
+        button_detector.log.close()  # Write the records still queued
@@ -0,0 +1,29 @@
+"""Input subsystem: button polling, with the work handed to other subsystems."""
+
+from sosd.bluetooth import PAIR
+from sosd.daemon import Subsystem
+from sosd.modem import POWER_ON, SOS
+
+
+class InputSubsystem(Subsystem):
+    """Poll the buttons and post their actions, so a long SOS never blocks them."""
+
+    name = "input"
+
+    def __init__(self, device):
+        super().__init__()
+        self.device = device
+
+    def setup(self):
+        gpio = self.device.GPIO
+        for pin in (self.device.BUTTON_PIN_1, self.device.BUTTON_PIN_2):
+            gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+        self.device.leds.on(self.device.LED_PIN)  # Ready
+
+    def run(self):
+        self.device.detect_button_presses(
+            on_bluetooth=lambda: self.daemon.post("bluetooth", PAIR),
+            on_long_press=lambda: self.daemon.post("modem", SOS),
+            on_short_press=lambda: self.daemon.post("modem", POWER_ON),
+            stop_event=self.stop_event,
+        )
@@ -0,0 +1,96 @@
+"""LED subsystem.
+
+Every LED is driven by one render thread: callers only say what an LED should
+show ("on", "off" or "blink") and the thread applies it. This replaces the
+one-off blinking threads that shared a single stop event, where stopping the
+blue LED also stopped the green one.
+"""
+
+import threading
+
+from sosd.daemon import Subsystem
+
+BLINK_INTERVAL = 0.5  # Seconds on, then seconds off, while blinking
+
+ON = "on"
+OFF = "off"
+BLINK = "blink"
+
+
+class LedController:
+    """Desired pattern per LED pin, rendered by run()."""
+
+    def __init__(self, gpio, blink_interval=BLINK_INTERVAL):
+        self.gpio = gpio
+        self.blink_interval = blink_interval
+        self._patterns = {}           # pin -> ON / OFF / BLINK
+        self._blink_state = False
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+
+    def set(self, pin, pattern):
+        """Show pattern on pin; "on" and "off" take effect immediately."""
+        with self._lock:
+            self._patterns[pin] = pattern
+            if pattern != BLINK:
+                self.gpio.output(pin, self.gpio.HIGH if pattern == ON else self.gpio.LOW)
+        self._changed.set()
+
+    def on(self, pin):
+        self.set(pin, ON)
+
+    def off(self, pin):
+        self.set(pin, OFF)
+
+    def blink(self, pin):
+        self.set(pin, BLINK)
+
+    def pattern(self, pin):
+        with self._lock:
+            return self._patterns.get(pin, OFF)
+
+    def pins(self):
+        """Return the pins the controller drives."""
+        with self._lock:
+            return list(self._patterns)
+
+    def forget(self, pin):
+        """Stop driving pin (e.g. before it is released); return its last pattern."""
+        with self._lock:
+            return self._patterns.pop(pin, OFF)
+
+    def run(self, stop_event):
+        """Toggle the blinking LEDs until stop_event is set."""
+        while not stop_event.is_set():
+            with self._lock:
+                self._blink_state = not self._blink_state
+                level = self.gpio.HIGH if self._blink_state else self.gpio.LOW
+                for pin, pattern in self._patterns.items():
+                    if pattern == BLINK:
+                        self.gpio.output(pin, level)
+            self._changed.wait(self.blink_interval)
+            self._changed.clear()
+
+
+class LedSubsystem(Subsystem):
+    """Set up the LED pins and run the shared LedController."""
+
+    name = "leds"
+
+    def __init__(self, controller, pins):
+        super().__init__()
+        self.controller = controller
+        self.pins = pins
+
+    def setup(self):
+        gpio = self.controller.gpio
+        for pin in self.pins:
+            gpio.setup(pin, gpio.OUT)
+            self.controller.off(pin)
+
+    def run(self):
+        self.controller.run(self.stop_event)
+
+    def teardown(self):
+        for pin in self.controller.pins():  # The pins may have moved on a config reload
+            self.controller.off(pin)
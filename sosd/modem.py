@@ -0,0 +1,42 @@
+"""Modem subsystem: A9G power and the SOS flow on the shared modem engine."""
+
+from sosd.daemon import Subsystem
+
+SOS = "sos"
+POWER_ON = "power on"
+
+
+class ModemSubsystem(Subsystem):
+    """Run modem work posted by the other subsystems, one job at a time."""
+
+    name = "modem"
+
+    def __init__(self, device):
+        super().__init__()
+        self.device = device
+
+    def setup(self):
+        gpio = self.device.GPIO
+        gpio.setup(self.device.A9G_POWER_PIN, gpio.OUT)
+
+    def handle(self, event):
+        if event == SOS:
+            self.device.start_sos()
+        elif event == POWER_ON:
+            self.device.turn_on_a9g()
+        else:
+            super().handle(event)
+
+    def healthy(self):
+        modem = self.device.modem
+        return modem is None or modem.is_running()
+
+    def recover(self):
+        # Restart the reader thread; the port and the module's state are kept
+        self.device.modem.start()
+
+    def teardown(self):
+        self.device.stop_inbound_sms()
+        self.device.stop_modem_pool()
+        if self.device.modem is not None:
+            self.device.modem.stop()
@@ -0,0 +1,286 @@
+"""Power budget.
+
+The PowerManager tracks the state of each power consumer (the A9G modem, its
+GPS, the Bluetooth radio and the Raspberry Pi itself) and duty-cycles them
+according to a policy:
+
+    performance  modem awake, GPS always on, always discoverable, scan while pairing
+    balanced     modem sleeps after a minute idle, GPS warmed 1 min every 30 min,
+                 discoverable 30 s every 5 min
+    standby      modem sleeps after 10 s, GPS off until an SOS,
+                 discoverable 10 s every 15 min
+
+Sleeping and cold components make an alert slower: a sleeping A9G needs a
+wake-up command before the first SMS, and a GPS that has not run for hours
+needs a cold start instead of a hot one. The report shows that delay next
+to the estimated current draw, so a battery unit can pick the trade-off.
+The current figures in CURRENT_MA are typical datasheet values; replace them
+with measurements of the actual unit.
+
+While a flow holds a component (an SOS holds the modem and GPS, pairing holds
+Bluetooth) the policy leaves it alone.
+"""
+
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from bluetoothctl_session import get_bluetoothctl
+from sosd.daemon import Subsystem
+
+TICK = 1  # Seconds between duty-cycle checks
+
+# Component states
+OFF = "off"
+SLEEP = "sleep"
+IDLE = "idle"
+ACTIVE = "active"
+ON = "on"
+CONNECTABLE = "connectable"
+DISCOVERABLE = "discoverable"
+SCANNING = "scanning"
+CONNECTED = "connected"
+
+# Estimated current draw in mA at 5 V, per component and state
+CURRENT_MA = {
+    "base": {ON: 100},                     # Raspberry Pi Zero W, HDMI off
+    "modem": {OFF: 0, SLEEP: 3, IDLE: 25, ACTIVE: 150},
+    "gps": {OFF: 0, ON: 30},
+    "bluetooth": {OFF: 0, CONNECTABLE: 5, DISCOVERABLE: 8, SCANNING: 30, CONNECTED: 10},
+}
+
+MODEM_WAKE_DELAY = 1     # Seconds to wake a sleeping A9G
+GPS_HOT_START = 5        # Seconds to a fix with fresh ephemeris
+GPS_COLD_START = 35      # Seconds to a fix from a cold start
+EPHEMERIS_LIFETIME = 4 * 60 * 60  # Seconds a GPS warm-up keeps the next start hot
+
+# modem_idle: "sleep" puts an idle modem in AT+SLEEP after modem_sleep_after seconds, "on" keeps it awake.
+# GPS and discoverability run for the first *_for seconds of every *_every seconds (0 = never, for >= every = always).
+Policy = namedtuple("Policy", "name modem_idle modem_sleep_after gps_for gps_every "
+                              "discoverable_for discoverable_every pairing_scan")
+
+POLICIES = {
+    "performance": Policy("performance", "on", 0, 1, 1, 1, 1, True),
+    "balanced": Policy("balanced", "sleep", 60, 60, 30 * 60, 30, 5 * 60, False),
+    "standby": Policy("standby", "sleep", 10, 0, 0, 10, 15 * 60, False),
+}
+
+
+def duty(on_seconds, every):
+    """Fraction of the time a duty-cycled component is on."""
+    if every <= 0 or on_seconds <= 0:
+        return 0.0
+    return min(1.0, on_seconds / every)
+
+
+def in_window(elapsed, on_seconds, every):
+    """Return True if a component with this duty cycle should be on elapsed seconds in."""
+    if every <= 0 or on_seconds <= 0:
+        return False
+    return on_seconds >= every or elapsed % every < on_seconds
+
+
+def average_current(policy):
+    """Estimated mean current in mA of an idle unit running policy."""
+    modem = CURRENT_MA["modem"][SLEEP if policy.modem_idle == "sleep" else IDLE]
+    gps = duty(policy.gps_for, policy.gps_every) * CURRENT_MA["gps"][ON]
+    discoverable = duty(policy.discoverable_for, policy.discoverable_every)
+    bluetooth = (discoverable * CURRENT_MA["bluetooth"][DISCOVERABLE]
+                 + (1 - discoverable) * CURRENT_MA["bluetooth"][CONNECTABLE])
+    return CURRENT_MA["base"][ON] + modem + gps + bluetooth
+
+
+def alert_delay(policy):
+    """Estimated extra seconds before an SOS fix, caused by the policy: (modem, gps)."""
+    modem = MODEM_WAKE_DELAY if policy.modem_idle == "sleep" else 0
+    warm = policy.gps_every > 0 and policy.gps_for > 0 and policy.gps_every <= EPHEMERIS_LIFETIME
+    return modem, GPS_HOT_START if warm else GPS_COLD_START
+
+
+class PowerManager:
+    """Track component states and duty-cycle them by the device's POWER_POLICY."""
+
+    def __init__(self, device):
+        self.device = device
+        self.states = {"base": ON, "modem": OFF, "gps": OFF, "bluetooth": CONNECTABLE}
+        self.started = time.time()
+        self.used_mah = 0.0
+        self._since = time.time()
+        self._holds = {}              # Component -> number of flows holding it
+        self._taken = {}              # Component -> holds ever started, to spot one during a transition
+        self._modem_used = time.time()
+        self._lock = threading.RLock()
+
+    def policy(self):
+        return POLICIES.get(self.device.POWER_POLICY, POLICIES["balanced"])
+
+    def _account(self):
+        now = time.time()
+        self.used_mah += self.current() * (now - self._since) / 3600
+        self._since = now
+
+    def set_state(self, component, state):
+        """Record that component is now in state (for accounting and duty cycling)."""
+        with self._lock:
+            if self.states[component] != state:
+                self._account()
+                self.states[component] = state
+            if component == "modem" and state in (IDLE, ACTIVE):
+                self._modem_used = time.time()
+
+    def current(self, component=None):
+        """Estimated current in mA of one component, or of the whole unit."""
+        with self._lock:
+            if component is not None:
+                return CURRENT_MA[component][self.states[component]]
+            return sum(CURRENT_MA[name][state] for name, state in self.states.items())
+
+    @contextmanager
+    def hold(self, component, state, after=None):
+        """Keep component in state while a flow runs, then record it as after (if given).
+
+        The policy leaves a held component alone and takes it over again once
+        the flow ends. A modem that is off stays off: the flow powers it on.
+        """
+        wake = False
+        with self._lock:
+            self._holds[component] = self._holds.get(component, 0) + 1
+            self._taken[component] = self._taken.get(component, 0) + 1
+            if component == "modem":
+                wake = self.states["modem"] == SLEEP
+                if self.states["modem"] == OFF:
+                    state = OFF
+            if not wake:
+                self.set_state(component, state)
+        if wake:
+            self._wake_modem()  # Outside the lock; the policy leaves a held modem alone
+            self.set_state(component, state)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._holds[component] -= 1
+                if (after is not None and not self.held(component)  # The last flow holding it
+                        and not (component == "modem" and self.states["modem"] == OFF)):
+                    self.set_state(component, after)
+
+    @contextmanager
+    def active(self):
+        """Full power for an alert: modem awake and GPS on until the flow ends."""
+        with self.hold("modem", ACTIVE, after=IDLE), self.hold("gps", ON):
+            yield
+
+    def held(self, component):
+        return self._holds.get(component, 0) > 0
+
+    def _unchanged(self, component, taken, states):
+        """True if nothing took component since taken and states were read (call with the lock held)."""
+        return (not self.held(component) and self._taken.get(component, 0) == taken.get(component, 0)
+                and self.states[component] == states[component])
+
+    # Hardware actions. They send AT commands, so they run outside the lock and
+    # record the new state only if no flow took the component in the meantime.
+
+    def _wake_modem(self):
+        """Wake a sleeping A9G; the caller records the new state."""
+        self.device.send_command('AT')          # The first characters only wake the module
+        self.device.send_command('AT+SLEEP=0')
+
+    def _sleep_modem(self, taken, states):
+        if not any('OK' in line for line in self.device.send_command('AT+SLEEP=2')):
+            return
+        with self._lock:
+            if self._unchanged("modem", taken, states):
+                self.set_state("modem", SLEEP)
+                return
+        self._wake_modem()  # A flow took the modem while it was being put to sleep
+
+    def _set_gps(self, on, taken, states):
+        wake = states["modem"] == SLEEP
+        if wake:
+            self._wake_modem()
+        self.device.send_command('AT+GPS=1' if on else 'AT+GPS=0')
+        with self._lock:
+            if wake and self._unchanged("modem", taken, states):
+                self.set_state("modem", IDLE)
+            if self._unchanged("gps", taken, states):
+                self.set_state("gps", ON if on else OFF)
+
+    def _set_discoverable(self, on, taken, states):
+        # Through the shared session: a second bluetoothctl would race the pairing flow's
+        command = "discoverable on" if on else "discoverable off"
+        lines = get_bluetoothctl().command(command, rf"{command} succeeded|Failed")
+        if not any(f"{command} succeeded" in line for line in lines):
+            return
+        with self._lock:
+            if self._unchanged("bluetooth", taken, states):
+                self.set_state("bluetooth", DISCOVERABLE if on else CONNECTABLE)
+
+    def tick(self):
+        """Apply the policy once."""
+        policy = self.policy()
+        elapsed = time.time() - self.started
+        # Decide under the lock; the AT commands and bluetoothctl run outside it, so
+        # hold() (an SOS, pairing) never waits for a duty-cycle transition
+        with self._lock:
+            self._account()
+            taken = dict(self._taken)
+            states = dict(self.states)
+            modem_on = states["modem"] != OFF
+            set_gps = None
+            if modem_on and not self.held("gps"):
+                want_gps = in_window(elapsed, policy.gps_for, policy.gps_every)
+                if want_gps != (states["gps"] == ON):
+                    set_gps = want_gps
+            sleep = (set_gps is None and modem_on and not self.held("modem") and states["modem"] == IDLE
+                     and states["gps"] == OFF and policy.modem_idle == "sleep"
+                     and time.time() - self._modem_used >= policy.modem_sleep_after)
+            bluetooth = None if self.held("bluetooth") else states["bluetooth"]
+
+        if set_gps is not None:
+            self._set_gps(set_gps, taken, states)
+        if sleep:
+            self._sleep_modem(taken, states)
+        if bluetooth in (CONNECTABLE, DISCOVERABLE):
+            want_discoverable = in_window(elapsed, policy.discoverable_for, policy.discoverable_every)
+            if want_discoverable != (bluetooth == DISCOVERABLE):
+                self._set_discoverable(want_discoverable, taken, states)
+
+    def run(self, stop_event):
+        """Duty-cycle the components until stop_event is set."""
+        while not stop_event.wait(TICK):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Power policy step failed: {e}")
+
+    def report(self, battery_mah=None):
+        """Return the power status as text lines."""
+        policy = self.policy()
+        with self._lock:
+            self._account()
+            lines = [f"policy: {policy.name}"]
+            for component, state in self.states.items():
+                lines.append(f"{component}: {state} ({CURRENT_MA[component][state]} mA)")
+            average = average_current(policy)
+            lines.append(f"now: {self.current()} mA, policy average: {average:.0f} mA")
+            if battery_mah:
+                lines.append(f"standby on {battery_mah} mAh: {battery_mah / average:.0f} h")
+            lines.append(f"used since start: {self.used_mah:.1f} mAh")
+        modem, gps = alert_delay(policy)
+        lines.append(f"alert delay: modem +{modem} s, gps fix ~{gps} s")
+        return lines
+
+
+class PowerSubsystem(Subsystem):
+    """Run the power policy."""
+
+    name = "power"
+
+    def __init__(self, manager):
+        super().__init__()
+        self.manager = manager
+
+    def run(self):
+        self.manager.run(self.stop_event)
@@ -0,0 +1,42 @@
+"""Storage subsystem: the shared contacts.db connection, its write-behind queue, track file and SOS plan."""
+
+from sosd.daemon import Subsystem
+
+FLUSH_INTERVAL = 60  # Seconds between writing the track file back to the SD card
+
+
+class StorageSubsystem(Subsystem):
+    """Prepare the database and keep the shared connection healthy."""
+
+    name = "storage"
+
+    def __init__(self, device):
+        super().__init__()
+        self.device = device
+
+    def run(self):
+        if not self.device.warmup_done.is_set():
+            self.device.warm_up()  # Database, track file and SOS plan
+        while not self.stop_event.wait(FLUSH_INTERVAL):
+            if self.device.track_store is not None:
+                self.device.track_store.flush()
+
+    def healthy(self):
+        try:
+            with self.device.database() as conn:
+                conn.execute('SELECT 1')
+            return True
+        except Exception as e:
+            print(f"Database check failed: {e}")
+            return False
+
+    def recover(self):
+        # The next query reopens the shared connection
+        self.device.close_database()
+
+    def teardown(self):
+        self.device.db_writes.stop()  # Queued RFCOMM changes
+        self.device.stop_profiling()  # Save a profile that was running
+        if self.device.track_store is not None:
+            self.device.track_store.flush()
+        self.device.close_database()
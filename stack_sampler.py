@@ -0,0 +1,172 @@
+"""Sampling profiler for on-device runs.
+
+When the device feels slow there is nothing but print output to go on, and a
+debugger cannot be attached to a unit in the field. StackSampler looks at the
+stack of every thread (sys._current_frames) INTERVAL times a second from a
+background thread and counts identical stacks. Nothing is traced or
+instrumented, so the cost is one stack walk per thread per sample, a few
+percent of a Pi Zero at the default 50 Hz, and only while a profile runs.
+
+Profiles are written in the collapsed-stack format used by flamegraph.pl and
+speedscope, one stack per line, root first, with its sample count:
+
+    MainThread;button_detector:main;button_detector:detect_button_presses 412
+    a9g-reader;a9g_modem:_read_loop;modem_sim:read 97
+
+report() splits the samples over the parts of the device that usually matter
+(the button loop, the RFCOMM server, the modem) before the hottest functions.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+INTERVAL = 0.02          # Seconds between samples (50 Hz)
+MAX_DEPTH = 64           # Frames kept per stack, counted from the leaf
+PROFILE_DIR = "profiles"
+MAX_PROFILES = 10        # Profile files kept; the oldest are deleted
+
+# Parts of the device, recognised by a function on the stack
+AREAS = (
+    ("buttons", "detect_button_presses"),
+    ("rfcomm", "start_rfcomm_server"),
+    ("modem", "a9g_modem:"),
+    ("modem", "async_modem:"),
+)
+
+
+def frame_name(frame):
+    """Return "module:function" for a frame."""
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def collapse(frame, depth=MAX_DEPTH):
+    """Return the frames of a stack, root first; a deeper stack loses its outermost frames."""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return names[::-1][-depth:]
+
+
+class StackSampler:
+    """Sample every thread's stack on a background thread and count the stacks."""
+
+    def __init__(self, interval=INTERVAL, directory=PROFILE_DIR):
+        self.interval = interval
+        self.directory = directory
+        self.counts = Counter()      # "thread;frame;frame" -> samples
+        self.samples = 0
+        self.started = None
+        self.elapsed = 0.0           # Seconds spent taking samples
+        self.path = None             # File of the last saved profile
+        self._lock = threading.Lock()  # counts, samples and elapsed, taken by report() and save()
+        self._stop_event = threading.Event()
+        self._thread = None          # Only start() and stop() set it
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=None):
+        """Start sampling; stop and save by itself after duration seconds if given."""
+        if self.running():
+            return self
+        with self._lock:
+            self.counts.clear()
+            self.samples = 0
+            self.elapsed = 0.0
+        self.started = time.time()
+        self.path = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(duration,), name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and save the profile; return its path (None if nothing was sampled)."""
+        thread = self._thread
+        if thread is None or thread is threading.current_thread():
+            return None
+        self._stop_event.set()
+        thread.join()  # The sampler saves the profile as it ends
+        self._thread = None
+        return self.path
+
+    def _run(self, duration):
+        own = threading.get_ident()
+        deadline = time.monotonic() + duration if duration else None
+        while not self._stop_event.wait(self.interval):
+            started = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [";".join([names.get(ident, f"thread-{ident}")] + collapse(frame))
+                      for ident, frame in sys._current_frames().items() if ident != own]
+            with self._lock:
+                self.counts.update(stacks)
+                self.samples += 1
+                self.elapsed += time.perf_counter() - started
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        self.save()
+
+    def save(self):
+        """Write the collapsed stacks to a new file in directory and drop the oldest files."""
+        with self._lock:
+            counts = self.counts.copy()
+            samples = self.samples
+        if not counts:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))}.folded"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "w") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(path + ".tmp", path)
+        for old in list_profiles(self.directory)[MAX_PROFILES:]:
+            os.remove(os.path.join(self.directory, old))
+        print(f"Profile of {samples} samples saved to {path}.")
+        self.path = path
+        return path
+
+    def report(self, top=10):
+        """Return text lines: samples per device area, then the functions most often on top."""
+        with self._lock:
+            counts = self.counts.copy()
+            samples, elapsed = self.samples, self.elapsed
+        lines = [f"samples: {samples}, sampling cost {elapsed * 1000 / max(samples, 1):.2f} ms each"]
+        total = sum(counts.values()) or 1
+        areas = Counter()
+        leaves = Counter()
+        for stack, count in counts.items():
+            for area, marker in AREAS:
+                if marker in stack:
+                    areas[area] += count
+                    break
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        lines += [f"{area}: {count * 100 / total:.1f}% of thread samples" for area, count in areas.most_common()]
+        lines += [f"{count:6d} {leaf}" for leaf, count in leaves.most_common(top)]
+        return lines
+
+
+def list_profiles(directory=PROFILE_DIR):
+    """Return the profile file names in directory, newest first."""
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(".folded")]
+    except FileNotFoundError:
+        return []
+    return sorted(names, reverse=True)
+
+
+def profile_path(name, directory=PROFILE_DIR):
+    """Return the path of a saved profile (the newest without a name); raises ValueError."""
+    names = list_profiles(directory)
+    if not name:
+        if not names:
+            raise ValueError("no saved profiles")
+        name = names[0]
+    if name not in names:
+        raise ValueError(f"no profile named {name!r}")
+    return os.path.join(directory, name)
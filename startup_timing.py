@@ -0,0 +1,77 @@
+"""Startup phase timing.
+
+Import this module first: it notes the time, and each mark() records how long
+the phase that just ended took. phase() times work that runs off the main
+path (for example background warm-up). report() prints the breakdown,
+including the time the interpreter spent before this module was imported when
+/proc makes that visible.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def process_age():
+    """Seconds since this process was started, or None if /proc is not available."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 (after the parenthesised command name) is the start time in clock ticks
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """Record consecutive startup phases and background phases."""
+
+    def __init__(self):
+        age = process_age()
+        self._start = time.perf_counter() - (age or 0)
+        self._last = time.perf_counter()
+        self._lock = threading.Lock()
+        self.phases = []              # (name, seconds) on the path to button-ready
+        self.background = []          # (name, seconds) of background phases
+        if age is not None:
+            self.phases.append(("interpreter", age))
+
+    def mark(self, name):
+        """End the current phase, naming it name."""
+        now = time.perf_counter()
+        with self._lock:
+            self.phases.append((name, now - self._last))
+            self._last = now
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block that runs outside the main startup path."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.background.append((name, time.perf_counter() - started))
+
+    def elapsed(self):
+        """Seconds since the process started (or since this module was imported)."""
+        return time.perf_counter() - self._start
+
+    def report(self):
+        """Print the startup breakdown."""
+        with self._lock:
+            phases = list(self.phases)
+            background = list(self.background)
+        print("Startup timing:")
+        total = 0.0
+        for name, seconds in phases:
+            total += seconds
+            print(f"  {name:<16} {seconds * 1000:8.1f} ms  (at {total * 1000:8.1f} ms)")
+        for name, seconds in background:
+            print(f"  {name:<16} {seconds * 1000:8.1f} ms  (background)")
+
+
+startup = StartupTimer()
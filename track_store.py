@@ -0,0 +1,148 @@
+"""Compact on-disk track storage.
+
+Fixes are kept in a memory-mapped ring file of fixed-width records instead of
+one SQLite row per fix, so logging a track costs a 32-byte memory write per fix
+and no transaction or fsync. When the ring is full the oldest records are
+overwritten.
+
+File layout (little endian):
+
+    header  32 bytes  magic "TRK1", record size, capacity, reserved, records appended
+    records capacity * 32 bytes, each: timestamp (double), latitude (double),
+            longitude (double), speed in m/s (float), HDOP (float)
+
+Record i of the ring lives in slot (appended - held + i) % capacity, where
+held = min(appended, capacity). Only the "appended" counter is ever updated in
+the header, after the record itself has been written.
+
+Exports find a time range by bisection, so records must stay in time order.
+time.time() can step backwards (an NTP correction on a Pi without a real-time
+clock), so a fix stamped earlier than the newest record is stored with the
+newest record's timestamp instead.
+"""
+
+import mmap
+import os
+import struct
+import threading
+
+TRACK_FILE = 'tracks.bin'
+TRACK_CAPACITY = 20000  # Records kept (about 640 KB)
+
+MAGIC = b"TRK1"
+HEADER = struct.Struct("<4sIIIQ8x")
+RECORD = struct.Struct("<dddff")
+APPENDED_OFFSET = 16    # Offset of the "records appended" counter in the header
+APPENDED = struct.Struct("<Q")
+
+
+class TrackStore:
+    """Append-only ring of packed fix records in a memory-mapped file."""
+
+    def __init__(self, path=TRACK_FILE, capacity=TRACK_CAPACITY):
+        self.path = path
+        self._map = None
+        self._lock = threading.Lock()  # The tracker thread and LOCATE both append
+        size = HEADER.size + capacity * RECORD.size
+
+        new_file = not os.path.exists(path) or os.path.getsize(path) < HEADER.size
+        self._file = open(path, "w+b" if new_file else "r+b")
+        if new_file:
+            self._file.truncate(size)
+            self._file.write(HEADER.pack(MAGIC, RECORD.size, capacity, 0, 0))
+            self._file.flush()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+        magic, record_size, self.capacity, _, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a track file")
+        if len(self._map) < HEADER.size + self.capacity * RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is truncated")
+
+    @property
+    def appended(self):
+        """Number of records ever appended (including overwritten ones)."""
+        return APPENDED.unpack_from(self._map, APPENDED_OFFSET)[0]
+
+    def __len__(self):
+        return min(self.appended, self.capacity)
+
+    def append(self, timestamp, latitude, longitude, speed=0.0, hdop=0.0):
+        """Store one fix in O(1), overwriting the oldest record when full."""
+        with self._lock:
+            appended = self.appended
+            if appended:
+                timestamp = max(timestamp, self._timestamp(len(self) - 1))  # Keep the ring in time order
+            offset = HEADER.size + (appended % self.capacity) * RECORD.size
+            RECORD.pack_into(self._map, offset, timestamp, latitude, longitude, speed, hdop)
+            APPENDED.pack_into(self._map, APPENDED_OFFSET, appended + 1)
+
+    def _slot(self, index):
+        """Return the slot of the index-th oldest record held."""
+        appended = self.appended
+        return (appended - min(appended, self.capacity) + index) % self.capacity
+
+    def __getitem__(self, index):
+        """Return the index-th oldest record as (timestamp, latitude, longitude, speed, hdop)."""
+        held = len(self)
+        if not -held <= index < held:
+            raise IndexError("track record index out of range")
+        return RECORD.unpack_from(self._map, HEADER.size + self._slot(index % held) * RECORD.size)
+
+    def _timestamp(self, index):
+        return struct.unpack_from("<d", self._map, HEADER.size + self._slot(index) * RECORD.size)[0]
+
+    def _bisect(self, timestamp):
+        """Return the index of the first record at or after timestamp (records are in time order)."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range_indices(self, start=None, end=None):
+        """Return (first, stop) indices of the records with start <= timestamp < end."""
+        first = 0 if start is None else self._bisect(start)
+        stop = len(self) if end is None else self._bisect(end)
+        return first, max(first, stop)
+
+    def query(self, start=None, end=None):
+        """Return the records with start <= timestamp < end."""
+        with self._lock:
+            first, stop = self.range_indices(start, end)
+            return [self[index] for index in range(first, stop)]
+
+    def export(self, start=None, end=None):
+        """Return the packed records in a time range as memoryview slices of the file.
+
+        No bytes are copied; the slices (at most two, when the range wraps around
+        the end of the ring) can be sent straight to a socket. They must be
+        released before the store is closed.
+        """
+        with self._lock:
+            first, stop = self.range_indices(start, end)
+            if first == stop:
+                return []
+            first_slot = self._slot(first)
+        view = memoryview(self._map)
+        count = stop - first
+        tail = min(count, self.capacity - first_slot)
+        slices = [view[HEADER.size + first_slot * RECORD.size:HEADER.size + (first_slot + tail) * RECORD.size]]
+        if count > tail:
+            slices.append(view[HEADER.size:HEADER.size + (count - tail) * RECORD.size])
+        return slices
+
+    def flush(self):
+        """Write dirty pages back to the file."""
+        self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
@@ -0,0 +1,243 @@
+"""Continuous location tracking after an SOS.
+
+With AT+GPSRD=<n> the A9G reports NMEA sentences every n seconds as URCs
+("+GPSRD:$GNGGA,..." followed by the other sentences of the burst). The
+tracker parses them into fixes and only keeps a fix when the unit has moved
+DISTANCE_THRESHOLD metres or MAX_INTERVAL seconds have passed. The reporting
+interval follows the speed: fast movement is sampled often, a unit lying still
+is sampled rarely, so the GPS is not kept at full rate for the whole window.
+Kept fixes go into a fixed-size ring buffer and are handed out in batches
+every BATCH_INTERVAL seconds.
+"""
+
+import array
+import collections
+import math
+import threading
+import time
+
+TRACKING_DURATION = 30 * 60  # Seconds to keep tracking after an SOS
+DISTANCE_THRESHOLD = 50      # Metres of movement that make a new fix worth keeping
+MIN_INTERVAL = 5             # Fastest sampling interval in seconds
+MAX_INTERVAL = 120           # Slowest sampling interval; a fix is kept at least this often
+BATCH_INTERVAL = 60          # Seconds between batched updates
+RING_CAPACITY = 512          # Fixes held in memory
+
+KNOTS_TO_MPS = 0.514444
+EARTH_RADIUS = 6371000  # Metres
+
+# One fix: unix time, degrees, degrees, metres per second, horizontal dilution of precision
+Fix = collections.namedtuple("Fix", "timestamp latitude longitude speed hdop")
+
+
+def haversine_distance(latitude1, longitude1, latitude2, longitude2):
+    """Return the great-circle distance between two points in metres."""
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def nmea_checksum_ok(sentence):
+    """Return True if an NMEA sentence has no checksum or a correct one."""
+    if "*" not in sentence:
+        return True
+    body, checksum = sentence.lstrip("$").split("*", 1)
+    calculated = 0
+    for char in body:
+        calculated ^= ord(char)
+    try:
+        return calculated == int(checksum[:2], 16)
+    except ValueError:
+        return False
+
+
+def parse_nmea_coordinate(value, hemisphere):
+    """Convert an NMEA (d)ddmm.mmmm value and hemisphere to signed degrees."""
+    if not value:
+        return None
+    degrees_length = value.index(".") - 2
+    degrees = float(value[:degrees_length]) + float(value[degrees_length:]) / 60
+    return -degrees if hemisphere in ("S", "W") else degrees
+
+
+class NmeaParser:
+    """Combine RMC (position, speed) and GGA (HDOP) sentences into fixes."""
+
+    def __init__(self):
+        self.hdop = 0.0
+
+    def feed(self, line, timestamp=None):
+        """Parse one line; return a Fix for a valid RMC sentence, otherwise None."""
+        sentence = line.split(":", 1)[1] if line.startswith("+GPSRD:") else line
+        sentence = sentence.strip()
+        if not sentence.startswith("$") or not nmea_checksum_ok(sentence):
+            return None
+
+        fields = sentence.split("*", 1)[0].split(",")
+        kind = fields[0][3:]
+        try:
+            if kind == "GGA" and len(fields) > 8 and fields[8]:
+                self.hdop = float(fields[8])
+            elif kind == "RMC" and len(fields) > 7 and fields[2] == "A":
+                latitude = parse_nmea_coordinate(fields[3], fields[4])
+                longitude = parse_nmea_coordinate(fields[5], fields[6])
+                speed = float(fields[7] or 0) * KNOTS_TO_MPS
+                if latitude is not None and longitude is not None:
+                    return Fix(timestamp or time.time(), latitude, longitude, speed, self.hdop)
+        except ValueError:
+            print(f"Failed to parse NMEA sentence: {sentence}")
+        return None
+
+
+class FixRing:
+    """Fixed-capacity ring of fixes packed into one array of doubles."""
+
+    FIELDS = len(Fix._fields)
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self._values = array.array("d", bytes(8 * self.FIELDS * capacity))
+        self._next = 0      # Slot the next fix is written to
+        self._count = 0
+        self.appended = 0   # Fixes appended since creation (including overwritten ones)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, fix):
+        """Store a fix, overwriting the oldest one when full."""
+        start = self._next * self.FIELDS
+        self._values[start:start + self.FIELDS] = array.array("d", fix)
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        self.appended += 1
+
+    def __getitem__(self, index):
+        """Return the index-th oldest fix held."""
+        if not -self._count <= index < self._count:
+            raise IndexError("fix index out of range")
+        slot = (self._next - self._count + index % self._count) % self.capacity
+        start = slot * self.FIELDS
+        return Fix(*self._values[start:start + self.FIELDS])
+
+    def since(self, appended):
+        """Return the fixes appended after the appended-th one that are still held."""
+        missing = min(self.appended - appended, self._count)
+        return [self[index] for index in range(self._count - missing, self._count)]
+
+    def latest(self):
+        """Return the newest fix, or None."""
+        return self[-1] if self._count else None
+
+
+def next_sampling_interval(speed, distance_threshold=DISTANCE_THRESHOLD):
+    """Seconds until the unit may have moved distance_threshold at speed (m/s)."""
+    if speed <= 0:
+        return MAX_INTERVAL
+    return int(min(MAX_INTERVAL, max(MIN_INTERVAL, distance_threshold / speed)))
+
+
+class LocationTracker:
+    """Stream positions for a window with speed-adaptive sampling and batched updates."""
+
+    def __init__(self, engine, on_batch, duration=TRACKING_DURATION, on_fix=None,
+                 batch_interval=BATCH_INTERVAL, ring=None):
+        self.engine = engine
+        self.on_batch = on_batch         # Called with a list of new fixes every batch_interval
+        self.on_fix = on_fix             # Called with every kept fix
+        self.duration = duration
+        self.batch_interval = batch_interval
+        self.ring = ring if ring is not None else FixRing()
+        self.interval = MIN_INTERVAL
+        self._parser = NmeaParser()
+        self._fix_event = threading.Event()
+        self._latest = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start tracking on a background thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="location-tracker", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """End the tracking window early."""
+        self._stop_event.set()
+        self._fix_event.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def running(self):
+        """Return True while the tracking thread is streaming fixes."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def should_keep(self, fix):
+        """Return True if fix moved far enough or enough time passed since the last kept fix."""
+        last = self.ring.latest()
+        if last is None:
+            return True
+        if fix.timestamp - last.timestamp >= MAX_INTERVAL:
+            return True
+        return haversine_distance(last.latitude, last.longitude, fix.latitude, fix.longitude) >= DISTANCE_THRESHOLD
+
+    def _on_nmea(self, line):
+        fix = self._parser.feed(line)
+        if fix is not None:
+            self._latest = fix
+            self._fix_event.set()
+
+    def _set_interval(self, interval):
+        if interval != self.interval:
+            self.interval = interval
+            self.engine.command(f'AT+GPSRD={interval}')
+            print(f"Tracking interval set to {interval} seconds.")
+
+    def _run(self):
+        prefixes = ("+GPSRD:", "$")
+        for prefix in prefixes:
+            self.engine.add_urc_handler(prefix, self._on_nmea)
+        self.engine.command('AT+GPS=1')
+        self.engine.command(f'AT+GPSRD={self.interval}')
+
+        deadline = time.time() + self.duration
+        next_batch = time.time() + self.batch_interval
+        batched = self.ring.appended
+        try:
+            while not self._stop_event.is_set() and time.time() < deadline:
+                self._fix_event.wait(min(self.interval * 2, max(0, deadline - time.time())))
+                self._fix_event.clear()
+
+                fix, self._latest = self._latest, None
+                if fix is not None:
+                    if self.should_keep(fix):
+                        self.ring.append(fix)
+                        if self.on_fix is not None:
+                            self.on_fix(fix)
+                    self._set_interval(next_sampling_interval(fix.speed))
+
+                if time.time() >= next_batch:
+                    batched = self._send_batch(batched)
+                    next_batch = time.time() + self.batch_interval
+
+            self._send_batch(batched)
+        finally:
+            self.engine.command('AT+GPSRD=0')
+            for prefix in prefixes:
+                self.engine.remove_urc_handler(prefix, self._on_nmea)
+            print(f"Tracking finished: {self.ring.appended} fixes kept.")
+
+    def _send_batch(self, batched):
+        """Hand the fixes kept since the last batch to on_batch; return the new mark."""
+        fixes = self.ring.since(batched)
+        if fixes:
+            try:
+                self.on_batch(fixes)
+            except Exception as e:
+                print(f"Failed to send tracking batch: {e}")
+        return self.ring.appended
@@ -0,0 +1,95 @@
+"""Trusted-device cache.
+
+Every button-1 press used to run the whole pairing flow (power on,
+discoverable, agent, scan, a 10 s countdown, sdptool) even when the same
+phone had been connected a minute before. TrustedDevices remembers the
+phones that opened an authenticated RFCOMM session and the channel they used,
+so the next press can listen on that channel straight away:
+
+    {"AA:BB:CC:DD:EE:FF": {"channel": 23, "last_seen": 1700000000.0, "connections": 4}}
+
+The file is rewritten atomically on every change and holds at most
+MAX_DEVICES phones; the least recently seen is dropped first.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+TRUSTED_FILE = 'trusted_devices.json'
+MAX_DEVICES = 8
+
+ADDRESS = re.compile(r"^([0-9A-F]{2}:){5}[0-9A-F]{2}$")
+
+
+def normalise_address(address):
+    """Return a Bluetooth address in upper case; raises ValueError if it is not one."""
+    address = address.strip().upper()
+    if not ADDRESS.match(address):
+        raise ValueError(f"not a Bluetooth address: {address!r}")
+    return address
+
+
+class TrustedDevices:
+    """Phones that completed a session, with the RFCOMM channel they connected on."""
+
+    def __init__(self, path=TRUSTED_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.devices = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                devices = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable trusted-device file {self.path}: {e}")
+            return {}
+        return devices if isinstance(devices, dict) else {}
+
+    def _save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.devices, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+    def record(self, address, channel):
+        """Remember that address connected on channel just now."""
+        address = normalise_address(address)
+        with self._lock:
+            entry = self.devices.get(address, {})
+            self.devices[address] = {
+                "channel": channel,
+                "last_seen": time.time(),
+                "connections": entry.get("connections", 0) + 1,
+            }
+            while len(self.devices) > MAX_DEVICES:
+                oldest = min(self.devices, key=lambda name: self.devices[name]["last_seen"])
+                del self.devices[oldest]
+            self._save()
+
+    def forget(self, address):
+        """Drop address; return False if it was not known."""
+        address = normalise_address(address)
+        with self._lock:
+            if self.devices.pop(address, None) is None:
+                return False
+            self._save()
+            return True
+
+    def last(self):
+        """Return (address, entry) of the most recently seen phone, or None."""
+        with self._lock:
+            if not self.devices:
+                return None
+            address = max(self.devices, key=lambda name: self.devices[name]["last_seen"])
+            return address, dict(self.devices[address])
+
+    def items(self):
+        """Return [(address, entry)], most recently seen first."""
+        with self._lock:
+            return sorted(((address, dict(entry)) for address, entry in self.devices.items()),
+                          key=lambda item: item[1]["last_seen"], reverse=True)
@@ -0,0 +1,125 @@
+"""Voice-call escalation after an SOS.
+
+Dials the top-priority contacts one after another on the shared modem engine
+until somebody answers. Call state is tracked from "+CLCC:" lines (polled with
+AT+CLCC and reported by the module) and from the call progress URCs "NO
+CARRIER", "BUSY" and "NO ANSWER". Everything runs on its own thread; each AT
+command only holds the engine for one transaction, so SMS retries keep flowing
+in between.
+"""
+
+import threading
+import time
+
+from a9g_modem import is_ok
+
+RING_TIMEOUT = 30      # Seconds to let a contact's phone ring before hanging up
+TALK_TIMEOUT = 300     # Seconds to keep an answered call up at most
+POLL_INTERVAL = 1      # Seconds between AT+CLCC polls
+
+# +CLCC <stat> values
+CALL_ACTIVE = 0
+CALL_HELD = 1
+CALL_DIALING = 2
+CALL_ALERTING = 3
+
+CALL_ENDED_URCS = ("NO CARRIER", "BUSY", "NO ANSWER", "NO DIALTONE")
+
+
+def parse_clcc(line):
+    """Parse '+CLCC: id,dir,stat,mode,mpty[,"number",type]' into (stat, number)."""
+    fields = line.split(":", 1)[1].split(",")
+    stat = int(fields[2])
+    number = fields[5].strip().strip('"') if len(fields) > 5 else None
+    return stat, number
+
+
+class CallEscalation:
+    """Dial contacts in priority order until one of them answers."""
+
+    def __init__(self, engine, contact_numbers, ring_timeout=RING_TIMEOUT, talk_timeout=TALK_TIMEOUT):
+        self.engine = engine
+        self.contact_numbers = list(contact_numbers)
+        self.ring_timeout = ring_timeout
+        self.talk_timeout = talk_timeout
+        self.answered_by = None          # Number of the contact who picked up
+        self._call_state = None          # Last +CLCC <stat> seen for the current call
+        self._call_ended = threading.Event()
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start dialing on a background thread."""
+        self._thread = threading.Thread(target=self._run, name="voice-escalation", daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        """Wait for the escalation to finish."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def cancel(self):
+        """Stop dialing; any call in progress is hung up."""
+        self._cancelled.set()
+        self._call_ended.set()
+
+    def _on_clcc(self, line):
+        try:
+            self._call_state, _ = parse_clcc(line)
+        except (IndexError, ValueError):
+            print(f"Failed to parse call state: {line}")
+
+    def _on_call_ended(self, line):
+        print(f"Call ended: {line}")
+        self._call_ended.set()
+
+    def _run(self):
+        self.engine.add_urc_handler("+CLCC:", self._on_clcc)
+        for urc in CALL_ENDED_URCS:
+            self.engine.add_urc_handler(urc, self._on_call_ended)
+        try:
+            for number in self.contact_numbers:
+                if self._cancelled.is_set():
+                    break
+                if self._call(number):
+                    self.answered_by = number
+                    break
+            if self.answered_by:
+                print(f"Voice escalation reached {self.answered_by}.")
+            else:
+                print("Voice escalation finished without reaching anyone.")
+        finally:
+            self.engine.remove_urc_handler("+CLCC:", self._on_clcc)
+            for urc in CALL_ENDED_URCS:
+                self.engine.remove_urc_handler(urc, self._on_call_ended)
+
+    def _call(self, number):
+        """Dial one contact; return True if the call was answered."""
+        print(f"Calling {number}...")
+        self._call_state = CALL_DIALING
+        self._call_ended.clear()
+
+        response = self.engine.command(f"ATD{number};")
+        if not is_ok(response):
+            print(f"Failed to dial {number}: {response}")
+            return False
+
+        # Ring until answered, rejected or timed out
+        deadline = time.time() + self.ring_timeout
+        while time.time() < deadline and not self._call_ended.is_set():
+            self.engine.command("AT+CLCC")
+            if self._call_state == CALL_ACTIVE:
+                break
+            self._call_ended.wait(POLL_INTERVAL)
+
+        if self._call_state != CALL_ACTIVE:
+            print(f"{number} did not answer.")
+            self.engine.command("ATH")
+            return False
+
+        # Answered: keep the line open until the contact hangs up
+        print(f"{number} answered.")
+        self._call_ended.wait(self.talk_timeout)
+        self.engine.command("ATH")
+        return True
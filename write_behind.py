@@ -0,0 +1,108 @@
+"""Write-behind buffer for database mutations.
+
+Every RFCOMM mutation ("contact:", "set message:", ...) used to commit on its
+own before the next command was read, so each one waited for an fsync on the
+SD card. WriteBehind queues the mutation instead and returns at once; a
+background thread applies the queued mutations in one transaction when the
+oldest has waited FLUSH_DELAY seconds or MAX_PENDING have piled up, then calls
+on_flush once for the whole batch.
+
+Anything that reads what a client wrote (sync data, search, an SOS) calls
+flush() first, which applies the queue synchronously, so reads always see
+earlier writes. A write that was acknowledged but not yet flushed is lost if
+the power fails within FLUSH_DELAY.
+"""
+
+import threading
+import time
+
+FLUSH_DELAY = 0.5   # Seconds a mutation may wait before it is written
+MAX_PENDING = 50    # Queued mutations that trigger a write straight away
+
+
+class WriteBehind:
+    """Queue mutations and apply them in grouped transactions."""
+
+    def __init__(self, transaction, on_flush=None, delay=FLUSH_DELAY, max_pending=MAX_PENDING):
+        self.transaction = transaction   # Context manager: commits once when the block ends
+        self.on_flush = on_flush         # Called after a batch has been written
+        self.delay = delay
+        self.max_pending = max_pending
+        self.flushed = 0                 # Mutations written so far
+        self.batches = 0
+        self._pending = []               # (function, args)
+        self._oldest = None              # time.monotonic() of the oldest queued mutation
+        self._changed = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._thread = None
+
+    def submit(self, function, *args):
+        """Queue function(*args), a mutation that commits through the shared connection."""
+        with self._changed:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((function, args))
+            self._changed.notify_all()
+
+    def pending(self):
+        with self._changed:
+            return len(self._pending)
+
+    def flush(self):
+        """Write everything queued so far; return the number of mutations written."""
+        with self._flush_lock:
+            with self._changed:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                with self.transaction():
+                    for function, args in batch:
+                        function(*args)
+            except Exception as e:
+                # The batch was rolled back: apply what can be applied one at a time
+                print(f"Grouped write failed ({e}); writing {len(batch)} changes one by one.")
+                for function, args in batch:
+                    try:
+                        function(*args)
+                    except Exception as e:
+                        print(f"Dropped {function.__name__}{args}: {e}")
+            self.flushed += len(batch)
+            self.batches += 1
+        if self.on_flush is not None:
+            self.on_flush()
+        return len(batch)
+
+    def stop(self):
+        """Write what is queued and stop the background thread."""
+        with self._changed:
+            self._stopped = True
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._stopped:
+                    if len(self._pending) >= self.max_pending:
+                        break
+                    if self._pending:
+                        remaining = self._oldest + self.delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._changed.wait(remaining)
+                    else:
+                        self._changed.wait()
+                if self._stopped:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed: {e}")